@@ -0,0 +1,221 @@
+import argparse
+import json
+import logging
+import time
+
+from node import Node
+from failure_detector import FAILURE_DETECTORS
+from collections import Counter
+from threading import Thread
+from typing import Any, Dict, List
+
+
+"""
+Benchmarks bully elections with every node inside one process, on ephemeral localhost ports.
+Coordinators are killed and restarted on a schedule, and each failover is measured. Run from the src directory, e.g.:
+
+    python benchmark.py --nodes 50 --failures 3 --output results.json
+"""
+
+
+# constants
+CONVERGENCE_TIMEOUT = 120.0
+CONVERGENCE_POLL_INTERVAL = 0.01
+
+
+class LocalCluster:
+    """
+    N nodes on ephemeral localhost ports. A killed node is restarted on the same port, so the others can reach it again.
+    """
+    def __init__(self, nodes: int, server_workers: int, coordinator_status_interval: float, logger: logging.Logger, failure_detector: str = "fixed"):
+        self.server_workers = server_workers
+        self.coordinator_status_interval = coordinator_status_interval
+        self.failure_detector = failure_detector
+        self.logger = logger
+        self.nodes: Dict[int, Node] = {}
+        self.ports: Dict[int, int] = {}
+        for node_id in range(1, nodes + 1):
+            node = self._create_node(node_id, "0")
+            self.ports[node_id] = node.start_server()
+            self.nodes[node_id] = node
+        for node in self.nodes.values():
+            node.add_nodes(self._other_nodes(node.node_id))
+        # nodes that were killed keep their message counts, so totals never go backwards
+        self.killed_messages: Counter = Counter()
+
+    def _create_node(self, node_id: int, node_port: str) -> Node:
+        return Node(
+            node_id=node_id,
+            node_port=node_port,
+            other_nodes={},
+            logger=self.logger,
+            server_workers=self.server_workers,
+            coordinator_status_interval=self.coordinator_status_interval,
+            failure_detector=self.failure_detector,
+        )
+
+    def _other_nodes(self, node_id: int) -> Dict[int, str]:
+        return { other_id: f"localhost:{port}" for other_id, port in self.ports.items() if other_id != node_id }
+
+    def start(self):
+        for node in self.nodes.values():
+            Thread(target=node.start_election_cycle, daemon=True).start()
+
+    def kill(self, node_id: int):
+        node = self.nodes.pop(node_id)
+        node.stop()
+        self.killed_messages.update(node.messages_sent)
+
+    def restart(self, node_id: int):
+        node = self._create_node(node_id, str(self.ports[node_id]))
+        node.start_server()
+        node.add_nodes(self._other_nodes(node_id))
+        self.nodes[node_id] = node
+        Thread(target=node.start_election_cycle, daemon=True).start()
+
+    def messages_sent(self) -> Counter:
+        total = Counter(self.killed_messages)
+        for node in list(self.nodes.values()):
+            total.update(node.messages_sent)
+        return total
+
+    def wait_for_coordinator(self, coordinator_id: int, timeout: float = CONVERGENCE_TIMEOUT) -> bool:
+        """
+        Waits until every running node agrees that coordinator_id is the coordinator.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if all(node.coordinator_id == coordinator_id for node in list(self.nodes.values())):
+                return True
+            time.sleep(CONVERGENCE_POLL_INTERVAL)
+        return False
+
+    def close(self):
+        for node in self.nodes.values():
+            node.stop()
+
+
+def measure_failover(cluster: LocalCluster, started_at: float, messages_before: Counter, expected_coordinator: int) -> Dict[str, Any]:
+    """
+    Measures how the cluster converged to expected_coordinator after an event at started_at.
+    detection_time is until the first node saw the coordinator fail, election_time from then until every node
+    agreed on the new coordinator, and convergence_time is the sum of both.
+    """
+    converged = cluster.wait_for_coordinator(expected_coordinator)
+    nodes = list(cluster.nodes.values())
+    detections = [node.failure_detected_at for node in nodes if node.failure_detected_at is not None and node.failure_detected_at >= started_at]
+    changes = [node.coordinator_changed_at for node in nodes if node.coordinator_changed_at is not None and node.coordinator_changed_at >= started_at]
+    detected_at = min(detections) if detections else None
+    converged_at = max(changes) if converged and changes else None
+    messages = cluster.messages_sent() - messages_before
+    return {
+        "expected_coordinator": expected_coordinator,
+        "converged": converged,
+        "detection_time": None if detected_at is None else detected_at - started_at,
+        "election_time": None if detected_at is None or converged_at is None else converged_at - detected_at,
+        "convergence_time": None if converged_at is None else converged_at - started_at,
+        "messages": dict(messages),
+        "total_messages": sum(messages.values()),
+    }
+
+
+def run_benchmark(
+    nodes: int = 10,
+    failures: int = 3,
+    interval: float = 5.0,
+    restart: bool = True,
+    server_workers: int = 10,
+    coordinator_status_interval: float = 1.0,
+    failure_detector: str = "fixed",
+) -> Dict[str, Any]:
+    """
+    Starts a local cluster, waits for the first coordinator, then kills the coordinator failures times.
+    With restart=True each killed coordinator is brought back, and its return to coordinator is measured too.
+    Waits interval seconds between events.
+    """
+    logger = logging.getLogger("benchmark")
+    cluster = LocalCluster(nodes, server_workers, coordinator_status_interval, logging.getLogger("benchmark.nodes"), failure_detector)
+    rounds: List[Dict[str, Any]] = []
+    try:
+        started_at = time.monotonic()
+        cluster.start()
+        initial = measure_failover(cluster, started_at, Counter(), max(cluster.nodes))
+
+        for _ in range(failures):
+            time.sleep(interval)
+            coordinator_id = max(cluster.nodes)
+            messages_before = cluster.messages_sent()
+            killed_at = time.monotonic()
+            cluster.kill(coordinator_id)
+            failover = measure_failover(cluster, killed_at, messages_before, max(cluster.nodes))
+            failover["killed"] = coordinator_id
+            rounds.append({"event": "kill", **failover})
+            logger.warning(f"Killed coordinator Node {coordinator_id}: {failover}")
+
+            if restart:
+                time.sleep(interval)
+                messages_before = cluster.messages_sent()
+                restarted_at = time.monotonic()
+                cluster.restart(coordinator_id)
+                recovery = measure_failover(cluster, restarted_at, messages_before, coordinator_id)
+                rounds.append({"event": "restart", "restarted": coordinator_id, **recovery})
+                logger.warning(f"Restarted Node {coordinator_id}: {recovery}")
+    finally:
+        cluster.close()
+
+    kills = [result for result in rounds if result["event"] == "kill" and result["converged"]]
+    return {
+        "config": {
+            "nodes": nodes,
+            "failures": failures,
+            "interval": interval,
+            "restart": restart,
+            "server_workers": server_workers,
+            "coordinator_status_interval": coordinator_status_interval,
+            "failure_detector": failure_detector,
+        },
+        "initial_election": initial,
+        "rounds": rounds,
+        "mean_detection_time": _mean([result["detection_time"] for result in kills]),
+        "mean_election_time": _mean([result["election_time"] for result in kills]),
+        "mean_convergence_time": _mean([result["convergence_time"] for result in kills]),
+        "mean_messages_per_election": _mean([result["total_messages"] for result in kills]),
+    }
+
+
+def _mean(values: List[float]) -> float:
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a local bully cluster and measures its elections.")
+    parser.add_argument("--nodes", type=int, default=10)
+    parser.add_argument("--failures", type=int, default=3, help="number of times the coordinator is killed")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between kills and restarts")
+    parser.add_argument("--no-restart", action="store_true", help="do not restart killed coordinators")
+    parser.add_argument("--server-workers", type=int, default=10)
+    parser.add_argument("--coordinator-status-interval", type=float, default=1.0, help="seconds")
+    parser.add_argument("--failure-detector", choices=FAILURE_DETECTORS, default="fixed")
+    parser.add_argument("--output", help="JSON file to write the results to, instead of stdout")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--node-log-level", default="CRITICAL", help="log level of the nodes themselves, they log every failed call")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    logging.getLogger("benchmark.nodes").setLevel(args.node_log_level)
+    results = run_benchmark(
+        nodes=args.nodes,
+        failures=args.failures,
+        interval=args.interval,
+        restart=not args.no_restart,
+        server_workers=args.server_workers,
+        coordinator_status_interval=args.coordinator_status_interval,
+        failure_detector=args.failure_detector,
+    )
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
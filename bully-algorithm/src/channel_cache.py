@@ -0,0 +1,107 @@
+import grpc
+
+from node_grpc import node_service_pb2_grpc
+from node_grpc.node_service_pb2_grpc import NodeStub
+
+from threading import Lock
+from typing import Callable, Dict, List, Tuple
+
+
+# constants
+BROKEN_CHANNEL_STATES = (grpc.ChannelConnectivity.TRANSIENT_FAILURE, grpc.ChannelConnectivity.SHUTDOWN)
+
+
+class ChannelCache:
+    """
+    One long-lived gRPC channel and stub per peer node, opened lazily on first use and reused by every later call.
+    The connectivity state of every channel is watched. A failed call alone does not close the shared channel,
+    since gRPC reconnects it by itself and other calls may still be using it; only a channel that is in
+    TRANSIENT_FAILURE or SHUTDOWN when a call fails is closed and forgotten, so the next call opens a fresh one
+    instead of waiting out the reconnection backoff of a channel to a node that may have been restarted.
+    At most one channel per peer is ever open, so memory and file descriptors stay flat on long-running nodes.
+    Every call goes through the given client interceptors, e.g. to count them.
+    """
+    def __init__(self, nodes: Dict[int, str], interceptors: List[grpc.UnaryUnaryClientInterceptor] = ()):
+        self.nodes: Dict[int, str] = nodes # node id: host, replaced by set_nodes when nodes join or leave
+        self.interceptors: List[grpc.UnaryUnaryClientInterceptor] = list(interceptors)
+        self.lock: Lock = Lock()
+        self.channels: Dict[int, Tuple[str, grpc.Channel, NodeStub]] = {} # node id: (host, channel, stub)
+        self.watchers: Dict[grpc.Channel, Callable[[grpc.ChannelConnectivity], None]] = {} # channel: connectivity callback
+        self.states: Dict[grpc.Channel, grpc.ChannelConnectivity] = {} # channel: last connectivity state seen
+        self.closed: bool = False
+
+    def get_stub(self, node_id: int) -> Tuple[grpc.Channel, NodeStub]:
+        """
+        Get the channel and stub for a node, opening the channel if there is none yet or if the node host changed.
+        """
+        host = self.nodes[node_id]
+        stale_channel = None
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("channel cache is closed")
+            cached = self.channels.get(node_id)
+            if cached is not None and cached[0] == host:
+                return cached[1], cached[2]
+            if cached is not None:
+                stale_channel = cached[1]
+            channel = grpc.insecure_channel(host)
+            # the raw channel is returned and cached, so invalidate can tell it apart
+            stub = node_service_pb2_grpc.NodeStub(grpc.intercept_channel(channel, *self.interceptors))
+            self.channels[node_id] = (host, channel, stub)
+            self.states[channel] = grpc.ChannelConnectivity.IDLE
+            self.watchers[channel] = lambda state, channel=channel: self._record_state(channel, state)
+        channel.subscribe(self.watchers[channel], try_to_connect=False)
+        if stale_channel is not None:
+            self._close_channel(stale_channel)
+        return channel, stub
+
+    def _record_state(self, channel: grpc.Channel, state: grpc.ChannelConnectivity):
+        with self.lock:
+            if channel in self.states:
+                self.states[channel] = state
+
+    def set_nodes(self, nodes: Dict[int, str]):
+        """
+        Replace the known nodes after a membership change, closing the channels to the nodes that left.
+        """
+        with self.lock:
+            self.nodes = nodes
+            removed = [node_id for node_id in self.channels if node_id not in nodes]
+            channels = [self.channels.pop(node_id)[1] for node_id in removed]
+        for channel in channels:
+            self._close_channel(channel)
+
+    def invalidate(self, node_id: int, channel: grpc.Channel):
+        """
+        Close the channel to a node after one of its calls failed, if the channel is in TRANSIENT_FAILURE or SHUTDOWN.
+        A channel in any other state is kept and left for gRPC to reconnect.
+        Does nothing if the channel was already replaced, so concurrent failures on the same channel only close it once.
+        """
+        with self.lock:
+            cached = self.channels.get(node_id)
+            if cached is None or cached[1] is not channel or self.states.get(channel) not in BROKEN_CHANNEL_STATES:
+                return
+            del self.channels[node_id]
+        self._close_channel(channel)
+
+    def _close_channel(self, channel: grpc.Channel):
+        """
+        Stop watching the connectivity of a channel and close it.
+        """
+        with self.lock:
+            watcher = self.watchers.pop(channel, None)
+            self.states.pop(channel, None)
+        if watcher is not None:
+            channel.unsubscribe(watcher)
+        channel.close()
+
+    def close(self):
+        """
+        Close every channel in the cache. Later calls to get_stub fail.
+        """
+        with self.lock:
+            self.closed = True
+            channels = [channel for _, channel, _ in self.channels.values()]
+            self.channels = {}
+        for channel in channels:
+            self._close_channel(channel)
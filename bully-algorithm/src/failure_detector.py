@@ -0,0 +1,170 @@
+import math
+
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Deque
+
+
+# constants
+FAILURE_DETECTORS = ("fixed", "adaptive", "phi_accrual")
+
+ADAPTIVE_MIN_TIMEOUT = 0.05
+ADAPTIVE_MAX_MISSED_PINGS = 2
+RTT_ALPHA = 1 / 8 # weight of a new sample in the smoothed RTT, as in TCP
+RTT_BETA = 1 / 4 # weight of a new sample in the RTT variation, as in TCP
+
+PHI_THRESHOLD = 8.0
+PHI_WINDOW_SIZE = 100
+PHI_MIN_STD_DEVIATION_RATIO = 0.1 # of the mean interval, so a perfectly regular history is not suspected on the first late ping
+
+
+class FailureDetector(ABC):
+    """
+    Decides when the coordinator should be considered dead, from the results of the periodic status checks.
+    ping_timeout is the timeout of the next check; record_response and record_failure report its outcome.
+    A detector watches a single coordinator, reset is called whenever the coordinator changes.
+    Subclasses must implement every abstract method; ping_timeout defaults to max_timeout.
+    """
+    def __init__(self, max_timeout: float):
+        self.max_timeout: float = max_timeout
+
+    def ping_timeout(self) -> float:
+        return self.max_timeout
+
+    @abstractmethod
+    def record_response(self, rtt: float, now: float):
+        pass
+
+    @abstractmethod
+    def record_failure(self, now: float):
+        pass
+
+    @abstractmethod
+    def is_suspected(self, now: float) -> bool:
+        pass
+
+    @abstractmethod
+    def reset(self):
+        pass
+
+
+class FixedTimeoutFailureDetector(FailureDetector):
+    """
+    Suspects the coordinator as soon as one status check fails or takes longer than max_timeout.
+    """
+    def __init__(self, max_timeout: float):
+        super().__init__(max_timeout)
+        self.failed: bool = False
+
+    def record_response(self, rtt: float, now: float):
+        self.failed = False
+
+    def record_failure(self, now: float):
+        self.failed = True
+
+    def is_suspected(self, now: float) -> bool:
+        return self.failed
+
+    def reset(self):
+        self.failed = False
+
+
+class AdaptiveTimeoutFailureDetector(FailureDetector):
+    """
+    Times status checks out after the smoothed RTT plus four times its variation, like TCP retransmissions,
+    bounded by min_timeout and max_timeout, so checks fail fast when the network is fast.
+    Suspects the coordinator only after max_missed_pings checks in a row failed, so a single jittery ping is not enough.
+    """
+    def __init__(self, max_timeout: float, min_timeout: float = ADAPTIVE_MIN_TIMEOUT, max_missed_pings: int = ADAPTIVE_MAX_MISSED_PINGS):
+        super().__init__(max_timeout)
+        self.min_timeout: float = min_timeout
+        self.max_missed_pings: int = max_missed_pings
+        self.reset()
+
+    def ping_timeout(self) -> float:
+        if self.smoothed_rtt is None:
+            return self.max_timeout
+        # back off after each miss, in case the RTT really grew
+        timeout = (self.smoothed_rtt + 4 * self.rtt_variation) * 2 ** self.missed_pings
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+    def record_response(self, rtt: float, now: float):
+        if self.smoothed_rtt is None:
+            self.smoothed_rtt = rtt
+            self.rtt_variation = rtt / 2
+        else:
+            self.rtt_variation = (1 - RTT_BETA) * self.rtt_variation + RTT_BETA * abs(self.smoothed_rtt - rtt)
+            self.smoothed_rtt = (1 - RTT_ALPHA) * self.smoothed_rtt + RTT_ALPHA * rtt
+        self.missed_pings = 0
+
+    def record_failure(self, now: float):
+        self.missed_pings += 1
+
+    def is_suspected(self, now: float) -> bool:
+        return self.missed_pings >= self.max_missed_pings
+
+    def reset(self):
+        self.smoothed_rtt: float = None
+        self.rtt_variation: float = None
+        self.missed_pings: int = 0
+
+
+class PhiAccrualFailureDetector(FailureDetector):
+    """
+    Phi accrual failure detector (Hayashibara et al.): keeps the intervals between successful status checks and
+    suspects the coordinator when the time since the last one is too unlikely under a normal distribution of them,
+    i.e. when phi = -log10(P(interval > elapsed)) goes above threshold.
+    The history starts with expected_interval, so the first checks are judged against the configured check interval.
+    """
+    def __init__(
+        self,
+        max_timeout: float,
+        expected_interval: float,
+        threshold: float = PHI_THRESHOLD,
+        window_size: int = PHI_WINDOW_SIZE,
+    ):
+        super().__init__(max_timeout)
+        self.expected_interval: float = expected_interval
+        self.threshold: float = threshold
+        self.window_size: int = window_size
+        self.reset()
+
+    def record_response(self, rtt: float, now: float):
+        if self.last_response_at is not None:
+            self.intervals.append(now - self.last_response_at)
+        self.last_response_at = now
+
+    def record_failure(self, now: float):
+        if self.last_response_at is None:
+            # a coordinator that never answered is judged from the first check onwards
+            self.last_response_at = now - self.expected_interval
+
+    def phi(self, now: float) -> float:
+        if self.last_response_at is None:
+            return 0.0
+        mean = sum(self.intervals) / len(self.intervals)
+        variance = sum((interval - mean) ** 2 for interval in self.intervals) / len(self.intervals)
+        std_deviation = max(math.sqrt(variance), mean * PHI_MIN_STD_DEVIATION_RATIO)
+        elapsed = now - self.last_response_at
+        probability_later = 0.5 * math.erfc((elapsed - mean) / (std_deviation * math.sqrt(2)))
+        return -math.log10(max(probability_later, 1e-300))
+
+    def is_suspected(self, now: float) -> bool:
+        return self.phi(now) > self.threshold
+
+    def reset(self):
+        self.intervals: Deque[float] = deque([self.expected_interval], maxlen=self.window_size)
+        self.last_response_at: float = None
+
+
+def create_failure_detector(name: str, max_timeout: float, check_interval: float) -> FailureDetector:
+    """
+    Create one of FAILURE_DETECTORS by name.
+    """
+    if name == "fixed":
+        return FixedTimeoutFailureDetector(max_timeout)
+    if name == "adaptive":
+        return AdaptiveTimeoutFailureDetector(max_timeout)
+    if name == "phi_accrual":
+        return PhiAccrualFailureDetector(max_timeout, expected_interval=check_interval)
+    raise ValueError(f"Unknown failure detector {name}")
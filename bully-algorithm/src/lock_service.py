@@ -0,0 +1,245 @@
+import time
+
+from node_grpc.node_service_pb2 import GRANTED, NOT_COORDINATOR, QUEUED, RELEASED, LockRegistration, LockRequest, LockResponse
+
+from logging import Logger
+from threading import Condition
+from typing import Dict, List, Set, Tuple
+
+
+# constants
+LOCK_QUEUE_ORDERS = ("fifo", "lamport")
+LOCK_LEASE = 10.0
+QUEUE_ENTRY_GRACE = 2.0 # seconds a queued request survives without being polled again, after its wait_timeout
+
+Holder = Tuple[int, int] # (node id, request id)
+
+
+class LockTimeoutError(Exception):
+    """
+    Raised when a lock could not be acquired before the timeout given to Node.acquire_lock.
+    """
+    pass
+
+
+class QueuedRequest:
+    """
+    A request waiting for a key, dropped if its node stops polling for it.
+    """
+    def __init__(self, request: LockRequest, expires_at: float):
+        self.holder: Holder = (request.node_id, request.request_id)
+        self.lamport_timestamp: int = request.lamport_timestamp
+        self.expires_at: float = expires_at
+
+
+class KeyLock:
+    """
+    Lock table entry of one key: its holder, if any, and the requests waiting for it.
+    """
+    def __init__(self):
+        self.holder: Holder = None
+        self.fencing_token: int = 0
+        self.lease_deadline: float = 0.0
+        self.queue: List[QueuedRequest] = []
+
+
+class LockService:
+    """
+    Lock table hosted by the coordinator, so a lock is acquired and released with one call each to it
+    instead of a message exchange with every node.
+    Waiting requests of a key are granted in arrival order ("fifo") or by Lamport timestamp then node id ("lamport").
+    Every grant comes with a fencing token that only grows, and a lease after which the lock is given to the next request.
+    A new coordinator starts with an empty table that the other nodes fill again by registering the locks they hold,
+    and grants nothing until every node registered or a whole lease went by, so no lock held under the old
+    coordinator is granted twice.
+    """
+    def __init__(self, node_id: int, logger: Logger, queue_order: str = "fifo", lease: float = LOCK_LEASE, max_waiters: int = 5):
+        if queue_order not in LOCK_QUEUE_ORDERS:
+            raise ValueError(f"Unknown lock queue order {queue_order}")
+        self.node_id: int = node_id
+        self.logger: Logger = logger
+        self.queue_order: str = queue_order
+        self.lease: float = lease
+        # blocked AcquireLock calls each hold a server worker, the others are kept for elections and status checks
+        self.max_waiters: int = max_waiters
+        self.cv: Condition = Condition()
+        self.active: bool = False
+        self.locks: Dict[int, KeyLock] = {}
+        self.lamport_clock: int = 0
+        self.last_fencing_token: int = 0
+        self.waiters: int = 0
+        self.pending_registrations: Set[int] = set()
+        self.registration_deadline: float = 0.0
+
+    def take_over(self, node_ids: List[int]):
+        """
+        Start serving locks as the new coordinator, waiting for the registrations of node_ids first.
+        """
+        with self.cv:
+            self.active = True
+            self.locks = {}
+            self.pending_registrations = set(node_ids)
+            self.registration_deadline = time.monotonic() + self.lease
+            self.cv.notify_all()
+        self.logger.info(f"Node {self.node_id} is serving locks, waiting for the registrations of Nodes {sorted(node_ids)}")
+
+    def step_down(self):
+        """
+        Stop serving locks after another node became coordinator. Waiting requests are told to ask it instead.
+        """
+        with self.cv:
+            if not self.active:
+                return
+            self.active = False
+            self.locks = {}
+            self.cv.notify_all()
+        self.logger.info(f"Node {self.node_id} stopped serving locks")
+
+    def acquire(self, request: LockRequest) -> LockResponse:
+        """
+        Queue a request for a key, or find it again if it was already queued, and wait up to its wait_timeout for
+        the key to be granted to it. Answers GRANTED with the fencing token and lease of the lock, or QUEUED if the
+        request should be polled again.
+        """
+        holder = (request.node_id, request.request_id)
+        now = time.monotonic()
+        with self.cv:
+            if not self.active:
+                return LockResponse(status=NOT_COORDINATOR)
+            self.lamport_clock = max(self.lamport_clock, request.lamport_timestamp) + 1
+            key_lock = self.locks.setdefault(request.key, KeyLock())
+            if key_lock.holder != holder:
+                self._enqueue(key_lock, request, now)
+            deadline = now + request.wait_timeout
+            is_waiting = False
+            try:
+                while True:
+                    if not self.active:
+                        return LockResponse(status=NOT_COORDINATOR)
+                    if self.locks.get(request.key) is not key_lock:
+                        # the table was rebuilt while waiting, this node stepped down and took over again
+                        key_lock = self.locks.setdefault(request.key, KeyLock())
+                        self._enqueue(key_lock, request, now)
+                    self._grant_next(request.key, key_lock, now)
+                    if key_lock.holder == holder:
+                        return self._response(GRANTED, key_lock, now)
+                    if now >= deadline or (not is_waiting and self.waiters >= self.max_waiters):
+                        return self._response(QUEUED, key_lock, now)
+                    if not is_waiting:
+                        is_waiting = True
+                        self.waiters += 1
+                    self.cv.wait(self._next_wakeup(key_lock, now, deadline) - now)
+                    now = time.monotonic()
+            finally:
+                if is_waiting:
+                    self.waiters -= 1
+
+    def release(self, request: LockRequest) -> LockResponse:
+        """
+        Release a key held by the request, or withdraw the request from the key's queue if it is still waiting.
+        """
+        holder = (request.node_id, request.request_id)
+        with self.cv:
+            if not self.active:
+                return LockResponse(status=NOT_COORDINATOR)
+            self.lamport_clock = max(self.lamport_clock, request.lamport_timestamp) + 1
+            key_lock = self.locks.get(request.key)
+            if key_lock is not None:
+                if key_lock.holder == holder:
+                    key_lock.holder = None
+                    self.logger.debug(f"Node {request.node_id} released lock on key {request.key}")
+                key_lock.queue = [queued for queued in key_lock.queue if queued.holder != holder]
+                self._grant_next(request.key, key_lock, time.monotonic())
+            return LockResponse(status=RELEASED, lamport_timestamp=self.lamport_clock)
+
+    def register(self, registration: LockRegistration) -> LockResponse:
+        """
+        Rebuild the table from the locks a node still holds from the previous coordinator, and let
+        fencing tokens continue after the highest one the node has seen.
+        """
+        now = time.monotonic()
+        with self.cv:
+            if not self.active:
+                return LockResponse(status=NOT_COORDINATOR)
+            self.last_fencing_token = max(self.last_fencing_token, registration.highest_fencing_token)
+            for held in registration.held:
+                self.lamport_clock = max(self.lamport_clock, held.lamport_timestamp)
+                key_lock = self.locks.setdefault(held.key, KeyLock())
+                if key_lock.holder is not None and key_lock.holder[0] != registration.node_id and key_lock.lease_deadline > now:
+                    self.logger.error(f"Node {registration.node_id} registered lock on key {held.key} also held by Node {key_lock.holder[0]}")
+                    continue
+                key_lock.holder = (registration.node_id, held.request_id)
+                key_lock.fencing_token = held.fencing_token
+                key_lock.lease_deadline = now + held.lease
+            self.pending_registrations.discard(registration.node_id)
+            self.logger.info(f"Node {registration.node_id} registered {len(registration.held)} held locks")
+            self.cv.notify_all()
+            return LockResponse(status=GRANTED, lamport_timestamp=self.lamport_clock)
+
+    def forget_node(self, node_id: int):
+        """
+        Stop waiting for the registration of a node that left the cluster.
+        """
+        with self.cv:
+            self.pending_registrations.discard(node_id)
+            self.cv.notify_all()
+
+    def queue_depth(self) -> int:
+        """
+        Number of requests waiting for a key.
+        """
+        with self.cv:
+            return sum(len(key_lock.queue) for key_lock in self.locks.values())
+
+    def _enqueue(self, key_lock: KeyLock, request: LockRequest, now: float):
+        holder = (request.node_id, request.request_id)
+        expires_at = now + request.wait_timeout + QUEUE_ENTRY_GRACE
+        for queued in key_lock.queue:
+            if queued.holder == holder:
+                queued.expires_at = expires_at
+                return
+        key_lock.queue.append(QueuedRequest(request, expires_at))
+        if self.queue_order == "lamport":
+            key_lock.queue.sort(key=lambda queued: (queued.lamport_timestamp, queued.holder[0]))
+
+    def _is_recovering(self, now: float) -> bool:
+        return bool(self.pending_registrations) and now < self.registration_deadline
+
+    def _grant_next(self, key: int, key_lock: KeyLock, now: float):
+        """
+        Expire the lease of the holder, drop abandoned requests and grant the key to the first remaining one.
+        """
+        if key_lock.holder is not None and now >= key_lock.lease_deadline:
+            self.logger.warning(f"Node {self.node_id} lease of Node {key_lock.holder[0]} on key {key} expired")
+            key_lock.holder = None
+        if key_lock.holder is not None or self._is_recovering(now):
+            return
+        key_lock.queue = [queued for queued in key_lock.queue if queued.expires_at > now]
+        if not key_lock.queue:
+            self.locks.pop(key, None)
+            return
+        granted = key_lock.queue.pop(0)
+        self.last_fencing_token += 1
+        key_lock.holder = granted.holder
+        key_lock.fencing_token = self.last_fencing_token
+        key_lock.lease_deadline = now + self.lease
+        self.logger.debug(f"Node {self.node_id} granted lock on key {key} to Node {granted.holder[0]} with fencing token {key_lock.fencing_token}")
+        self.cv.notify_all()
+
+    def _next_wakeup(self, key_lock: KeyLock, now: float, deadline: float) -> float:
+        wakeup = deadline
+        if key_lock.holder is not None:
+            wakeup = min(wakeup, key_lock.lease_deadline)
+        if self._is_recovering(now):
+            wakeup = min(wakeup, self.registration_deadline)
+        return max(wakeup, now)
+
+    def _response(self, status: int, key_lock: KeyLock, now: float) -> LockResponse:
+        if status != GRANTED:
+            return LockResponse(status=status, lamport_timestamp=self.lamport_clock)
+        return LockResponse(
+            status=GRANTED,
+            fencing_token=key_lock.fencing_token,
+            lease=max(key_lock.lease_deadline - now, 0.0),
+            lamport_timestamp=self.lamport_clock,
+        )
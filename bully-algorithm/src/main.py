@@ -1,7 +1,9 @@
 import os
 import logging
+import signal
 
 from node import Node
+from metrics import MetricsServer
 from typing import List, Tuple, Dict
 
 
@@ -18,7 +20,16 @@ def _get_nodes_info(raw_nodes_info: str):
 if __name__ == "__main__":
     node_id = int(os.environ.get("NODE_ID"))
     node_port = os.environ.get("NODE_PORT")
-    other_nodes = _get_nodes_info(os.environ.get("OTHER_NODES"))
+    # a node joining through JOIN_ADDRESS may start without OTHER_NODES, it gets them from the cluster
+    raw_other_nodes = os.environ.get("OTHER_NODES")
+    other_nodes = _get_nodes_info(raw_other_nodes) if raw_other_nodes else {}
+    server_workers = int(os.environ.get("SERVER_WORKERS", "10"))
+    failure_detector = os.environ.get("FAILURE_DETECTOR", "fixed") # fixed, adaptive or phi_accrual
+    node_host = os.environ.get("NODE_HOST") # host:port the other nodes reach this one at, localhost:NODE_PORT by default
+    join_address = os.environ.get("JOIN_ADDRESS") # host:port of a running node to join the cluster through
+    lock_queue_order = os.environ.get("LOCK_QUEUE_ORDER", "fifo") # fifo or lamport, order of the requests waiting for a lock
+    metrics_port = os.environ.get("METRICS_PORT") # serves the node metrics at http://METRICS_HOST:METRICS_PORT/metrics if set
+    metrics_host = os.environ.get("METRICS_HOST", "localhost")
 
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger(f"Node {node_id}")
@@ -28,5 +39,14 @@ if __name__ == "__main__":
         node_port=node_port, 
         other_nodes=other_nodes, 
         logger=logger,
+        server_workers=server_workers,
+        failure_detector=failure_detector,
+        node_host=node_host,
+        join_address=join_address,
+        lock_queue_order=lock_queue_order,
     )
+    if metrics_port:
+        MetricsServer(node.metrics, int(metrics_port), logger, metrics_host)
+    # leave the cluster on shutdown, so a new coordinator is elected right away if needed
+    signal.signal(signal.SIGTERM, lambda signum, frame: node.leave_cluster())
     node.run_node()
@@ -0,0 +1,150 @@
+import random
+
+from node_grpc.node_service_pb2 import ALIVE, LEFT, Member, MembershipView
+
+from channel_cache import ChannelCache
+from logging import Logger
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List
+
+
+# constants
+GOSSIP_INTERVAL = 1.0
+GOSSIP_FANOUT = 2
+GOSSIP_TIMEOUT = 2.0
+
+ChangeListener = Callable[[Dict[int, str], List[int]], None] # (added nodes: host, removed node ids)
+
+
+class Membership:
+    """
+    Versioned view of the nodes in the cluster, kept in sync by gossip.
+    Every node has an entry with its host, whether it is alive or left, and an incarnation that only grows.
+    Two entries for the same node are merged by keeping the higher incarnation, and "left" over "alive" on a tie,
+    so views converge whatever the order in which they are exchanged. The view version is the sum of the
+    incarnations, so it grows with every change.
+    Every GOSSIP_INTERVAL seconds the view is sent to GOSSIP_FANOUT random members, which merge it and answer with theirs.
+    Listeners are called with the nodes that joined and left each time a merge changes the live members.
+    """
+    def __init__(self, node_id: int, nodes: Dict[int, str], channel_cache: ChannelCache, logger: Logger, gossip_interval: float = GOSSIP_INTERVAL):
+        self.node_id: int = node_id
+        self.channel_cache: ChannelCache = channel_cache
+        self.logger: Logger = logger
+        self.gossip_interval: float = gossip_interval
+        self.lock: Lock = Lock()
+        # held while a merge is applied and its listeners run, so listeners see the changes in order
+        self.change_lock: Lock = Lock()
+        self.members: Dict[int, Member] = {
+            member_id: Member(node_id=member_id, host=host, status=ALIVE, incarnation=1)
+            for member_id, host in nodes.items()
+        }
+        self.listeners: List[ChangeListener] = []
+        self.leaving: bool = False
+        self.stopped: Event = Event()
+
+    def add_listener(self, listener: ChangeListener):
+        self.listeners.append(listener)
+
+    def start(self):
+        Thread(target=self._gossip_loop, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def live_members(self) -> Dict[int, str]:
+        """
+        Get the host of every alive node, this one included.
+        """
+        with self.lock:
+            return self._live_hosts()
+
+    def view(self) -> MembershipView:
+        with self.lock:
+            members = [Member(node_id=member.node_id, host=member.host, status=member.status, incarnation=member.incarnation) for member in self.members.values()]
+        return MembershipView(members=members, version=sum(member.incarnation for member in members))
+
+    def merge(self, view: MembershipView) -> MembershipView:
+        """
+        Merge another view into this one, notify the listeners of the changes and return the merged view.
+        """
+        with self.change_lock:
+            with self.lock:
+                before = self._live_hosts()
+                for member in view.members:
+                    self._merge_member(member)
+                after = self._live_hosts()
+            self._notify(before, after)
+        return self.view()
+
+    def _merge_member(self, member: Member):
+        current = self.members.get(member.node_id)
+        if member.node_id == self.node_id and not self.leaving and current is not None and current.status == ALIVE and member.status == LEFT:
+            # an old departure of this node is still going around, outdate it
+            current.incarnation = max(current.incarnation, member.incarnation) + 1
+            return
+        if current is None or (member.incarnation, member.status) > (current.incarnation, current.status):
+            self.members[member.node_id] = Member(node_id=member.node_id, host=member.host, status=member.status, incarnation=member.incarnation)
+
+    def join(self, member: Member) -> MembershipView:
+        """
+        Add a node that asked to join, outdating any previous entry it had, and return the merged view.
+        The new view is pushed to every reachable member before returning, so they all know the new node
+        before it runs its first election.
+        """
+        with self.lock:
+            current = self.members.get(member.node_id)
+            incarnation = max(member.incarnation, 1 if current is None else current.incarnation + 1)
+        self.logger.info(f"Node {self.node_id} adding Node {member.node_id} at {member.host} to the cluster")
+        self.merge(MembershipView(members=[Member(node_id=member.node_id, host=member.host, status=ALIVE, incarnation=incarnation)]))
+        self._exchange([member_id for member_id in self.live_members() if member_id not in (self.node_id, member.node_id)])
+        return self.view()
+
+    def leave(self, node_id: int) -> Member:
+        """
+        Mark a node as left and return its new entry.
+        """
+        with self.lock:
+            self.leaving = self.leaving or node_id == self.node_id
+            current = self.members[node_id]
+            left = Member(node_id=node_id, host=current.host, status=LEFT, incarnation=current.incarnation + 1)
+        self.logger.info(f"Node {self.node_id} removing Node {node_id} from the cluster")
+        self.merge(MembershipView(members=[left]))
+        return left
+
+    def _live_hosts(self) -> Dict[int, str]:
+        return { member_id: member.host for member_id, member in self.members.items() if member.status == ALIVE }
+
+    def _notify(self, before: Dict[int, str], after: Dict[int, str]):
+        added = { member_id: host for member_id, host in after.items() if before.get(member_id) != host and member_id != self.node_id }
+        removed = [member_id for member_id in before if member_id not in after and member_id != self.node_id]
+        if not added and not removed:
+            return
+        self.logger.info(f"Node {self.node_id} membership changed, joined: {sorted(added)}, left: {sorted(removed)}")
+        for listener in self.listeners:
+            listener(added, removed)
+
+    def _gossip_loop(self):
+        while not self.stopped.wait(self.gossip_interval):
+            other_node_ids = [member_id for member_id in self.live_members() if member_id != self.node_id]
+            self._exchange(random.sample(other_node_ids, min(GOSSIP_FANOUT, len(other_node_ids))))
+
+    def _exchange(self, node_ids: List[int]):
+        """
+        Send the view to several nodes at once and merge their answers.
+        Answers are merged on the calling thread, never on a gRPC callback thread, since a change may close
+        the channel the answer came from.
+        """
+        view = self.view()
+        calls = []
+        for node_id in node_ids:
+            try:
+                channel, node_stub = self.channel_cache.get_stub(node_id)
+            except Exception:
+                continue # the node left while the round was starting
+            calls.append((node_id, channel, node_stub.GossipMembership.future(view, timeout=GOSSIP_TIMEOUT)))
+        for node_id, channel, call in calls:
+            if call.exception() is not None:
+                self.channel_cache.invalidate(node_id, channel)
+                self.logger.debug(f"Node {self.node_id} could not exchange membership view with Node {node_id}.")
+                continue
+            self.merge(call.result())
@@ -0,0 +1,258 @@
+import bisect
+import grpc
+import math
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import Logger
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Tuple, Union
+
+
+# the same metrics as lamport-mutual-exclusion/metrics, copied since each project is built into its own image;
+# keep both in sync, the only difference is that MetricsServer logs through the node logger here
+# constants
+HISTOGRAM_MIN_VALUE = 1e-5 # seconds
+HISTOGRAM_MAX_VALUE = 1e3 # seconds
+HISTOGRAM_BUCKETS_PER_DOUBLING = 8
+METRICS_PATH = "/metrics"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """
+    Latency histogram with logarithmic buckets, so every recorded value keeps about the same relative precision
+    (9% with the default of 8 buckets per doubling) from microseconds to minutes, in constant memory.
+    Safe to use from several threads.
+    """
+    def __init__(
+        self,
+        min_value: float = HISTOGRAM_MIN_VALUE,
+        max_value: float = HISTOGRAM_MAX_VALUE,
+        buckets_per_doubling: int = HISTOGRAM_BUCKETS_PER_DOUBLING,
+    ):
+        bucket_count = math.ceil(math.log2(max_value / min_value) * buckets_per_doubling)
+        self.bounds: List[float] = [min_value * 2 ** (i / buckets_per_doubling) for i in range(bucket_count + 1)]
+        self.counts: List[int] = [0] * (len(self.bounds) + 1) # the last bucket holds values above max_value
+        self.lock = Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float):
+        bucket = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    def percentile(self, percent: float) -> float:
+        """
+        Returns the upper bound of the bucket holding the given percentile, or 0 if nothing was recorded.
+        """
+        with self.lock:
+            if self.count == 0:
+                return 0.0
+            rank = math.ceil(self.count * percent / 100)
+            seen = 0
+            for bucket, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen >= max(rank, 1):
+                    return self.max if bucket >= len(self.bounds) else min(self.bounds[bucket], self.max)
+            return self.max
+
+    def merge(self, other: "Histogram"):
+        with other.lock:
+            counts, count, total, maximum = list(other.counts), other.count, other.total, other.max
+        with self.lock:
+            self.counts = [mine + theirs for mine, theirs in zip(self.counts, counts)]
+            self.count += count
+            self.total += total
+            self.max = max(self.max, maximum)
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Returns the count, mean, p50, p90, p99 and max of the recorded values.
+        """
+        with self.lock:
+            count, total, maximum = self.count, self.total, self.max
+        return {
+            "count": count,
+            "mean": total / count if count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": maximum,
+        }
+
+    def buckets(self, step: int = HISTOGRAM_BUCKETS_PER_DOUBLING) -> Tuple[List[Tuple[float, int]], int, float]:
+        """
+        Returns (upper bound, number of values at or below it) for every step-th bucket bound, along with the count and
+        sum of the values, all read at once. With the default step there is one bound per doubling, as exported to Prometheus.
+        """
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.total
+        cumulative = 0
+        buckets: List[Tuple[float, int]] = []
+        for bucket, bound in enumerate(self.bounds):
+            cumulative += counts[bucket]
+            if bucket % step == 0:
+                buckets.append((bound, cumulative))
+        return buckets, count, total
+
+
+class Counter:
+    """
+    Counter with optional labels, e.g. the RPCs sent by method. Safe to use from several threads.
+    """
+    def __init__(self, label_names: Tuple[str, ...] = ()):
+        self.label_names = label_names
+        self.lock = Lock()
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self.lock:
+            return sorted(self.values.items())
+
+
+class Gauge:
+    """
+    Value read from a function when the metrics are rendered, so keeping it up to date costs nothing.
+    """
+    def __init__(self, function: Callable[[], float]):
+        self.function = function
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class MetricsRegistry:
+    """
+    Named counters, gauges and histograms of one node, rendered in the Prometheus text format.
+    Asking for a metric that already exists returns it, so every part of the node can ask for the metrics it updates.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.metrics: Dict[str, Tuple[str, str, Metric]] = {} # name: (type, help, metric)
+
+    def _get_or_add(self, name: str, metric_type: str, help_text: str, create: Callable[[], Metric]) -> Metric:
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = (metric_type, help_text, create())
+            return self.metrics[name][2]
+
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_add(name, "counter", help_text, lambda: Counter(label_names))
+
+    def histogram(self, name: str, help_text: str) -> Histogram:
+        return self._get_or_add(name, "histogram", help_text, Histogram)
+
+    def gauge(self, name: str, help_text: str, function: Callable[[], float], metric_type: str = "gauge"):
+        """
+        Adds a metric read from function, a counter kept elsewhere if metric_type is "counter".
+        """
+        self._get_or_add(name, metric_type, help_text, lambda: Gauge(function))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines: List[str] = []
+        for name, (metric_type, help_text, metric) in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if isinstance(metric, Counter):
+                for label_values, value in metric.samples():
+                    lines.append(f"{name}{_labels(metric.label_names, label_values)} {value}")
+            elif isinstance(metric, Gauge):
+                lines.append(f"{name} {metric.function()}")
+            else:
+                buckets, count, total = metric.buckets()
+                for bound, cumulative in buckets:
+                    lines.append(f'{name}_bucket{{le="{bound:.6g}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{le="+Inf"}} {count}')
+                lines.append(f"{name}_sum {total}")
+                lines.append(f"{name}_count {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...]) -> str:
+    if not label_names:
+        return ""
+    return "{" + ",".join(f'{label}="{value}"' for label, value in zip(label_names, label_values)) + "}"
+
+
+def _method_name(method: str) -> str:
+    # "/node.Node/RunElection" -> "RunElection"
+    return method.rsplit("/", 1)[-1]
+
+
+class ReceivedRpcCounter(grpc.ServerInterceptor):
+    """
+    Server interceptor counting the RPCs received by method in rpc_received_total.
+    """
+    def __init__(self, registry: MetricsRegistry):
+        self.counter = registry.counter("rpc_received_total", "RPCs received, by method.", ("method",))
+
+    def intercept_service(self, continuation, handler_call_details):
+        self.counter.inc(_method_name(handler_call_details.method))
+        return continuation(handler_call_details)
+
+
+class SentRpcCounter(
+    grpc.UnaryUnaryClientInterceptor,
+    grpc.UnaryStreamClientInterceptor,
+    grpc.StreamUnaryClientInterceptor,
+    grpc.StreamStreamClientInterceptor,
+):
+    """
+    Client interceptor counting the RPCs sent by method in rpc_sent_total. A stream counts once, whatever it carries.
+    """
+    def __init__(self, registry: MetricsRegistry):
+        self.counter = registry.counter("rpc_sent_total", "RPCs sent, by method.", ("method",))
+
+    def _intercept(self, continuation, client_call_details, request):
+        self.counter.inc(_method_name(client_call_details.method))
+        return continuation(client_call_details, request)
+
+    intercept_unary_unary = _intercept
+    intercept_unary_stream = _intercept
+    intercept_stream_unary = _intercept
+    intercept_stream_stream = _intercept
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # a line per scrape would flood the node logs
+
+
+class MetricsServer:
+    """
+    Serves the metrics of a registry at http://host:port/metrics from a background thread.
+    Port 0 picks a free port, available in the port attribute.
+    """
+    def __init__(self, registry: MetricsRegistry, port: int, logger: Logger, host: str = "localhost"):
+        self.http_server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.registry = registry
+        self.port = self.http_server.server_address[1]
+        Thread(target=self.http_server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on http://{host}:{self.port}{METRICS_PATH}")
+
+    def close(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
@@ -1,21 +1,36 @@
 import grpc
+import itertools
+import random
 import time
 
 from node_grpc import node_service_pb2_grpc
-from node_grpc.node_service_pb2 import NodeRequest, NodeResponse
-from node_grpc.node_service_pb2_grpc import NodeServicer, NodeStub
+from node_grpc.node_service_pb2 import ALIVE, GRANTED, NOT_COORDINATOR, LockRegistration, LockRequest, LockResponse, Member, MembershipView, NodeRequest, NodeResponse
+from node_grpc.node_service_pb2_grpc import NodeServicer
+
+from channel_cache import ChannelCache
+from failure_detector import FailureDetector, create_failure_detector
+from lock_service import LockService, LockTimeoutError
+from membership import Membership
+from metrics import MetricsRegistry, ReceivedRpcCounter, SentRpcCounter
 
 from logging import Logger
-from threading import Thread, Condition
+from threading import Thread, Condition, Event, Lock
 from concurrent import futures
-from typing import Dict
+from collections import Counter
+from typing import Dict, List, Tuple, Union
 from enum import Enum
 
 
 # constants
 COORDINATOR_MESSAGE_TIMEOUT = 10.0
 NODE_RESPONSE_TIMEOUT = 2.5
+JOIN_ATTEMPTS = 30
+JOIN_RETRY_INTERVAL = 1.0
 COORDINATOR_STATUS_INTERVAL = 5.0
+ELECTION_BACKOFF_SLOT = 0.05 # seconds of backoff per known node with a higher id
+ELECTION_BACKOFF_MAX = 5.0
+LOCK_WAIT_TIMEOUT = 1.0
+LOCK_RETRY_INTERVAL = 0.1
 
 class ElectionState(Enum):
     NOT_RUNNING = 1
@@ -29,83 +44,260 @@ class Node(NodeServicer):
         node_port: str, 
         other_nodes: Dict[int, str],
         logger: Logger,
+        server_workers: int = 10,
+        coordinator_status_interval: float = COORDINATOR_STATUS_INTERVAL,
+        failure_detector: str = "fixed",
+        node_host: str = None,
+        join_address: str = None,
+        lock_queue_order: str = "fifo",
     ):
         self.node_id: int = node_id
         self.node_port: str = node_port
+        self.server_workers: int = server_workers
+        self.coordinator_status_interval: float = coordinator_status_interval
+        self.failure_detector: FailureDetector = create_failure_detector(failure_detector, NODE_RESPONSE_TIMEOUT, coordinator_status_interval)
+
+        # served over HTTP by main.py if METRICS_PORT is set
+        self.metrics: MetricsRegistry = MetricsRegistry()
 
-        self.other_nodes: Dict[int, str] = other_nodes
+        # the live members of the cluster, replaced as a whole on every membership change, so it can be iterated safely
+        self.other_nodes: Dict[int, str] = dict(other_nodes)
+        self.channel_cache: ChannelCache = ChannelCache(self.other_nodes, interceptors=[SentRpcCounter(self.metrics)])
+        # host the other nodes reach this one at, "localhost:<port>" by default
+        self.node_host: str = node_host
+        # node to ask to be added to a running cluster, instead of relying on other_nodes alone
+        self.join_address: str = join_address
 
         self.coordinator_id: int = None
         self.election_state: ElectionState = ElectionState.NOT_RUNNING
+        # elections are numbered by term, and a node takes part in at most one election per term
+        self.term: int = 0 # highest term seen, guarded by election_state_cv
+        self.election_term: int = 0 # term of the last election this node ran, guarded by election_state_cv
+        self.coordinator_term: int = 0 # term in which coordinator_id was elected, guarded by coordinator_id_cv
 
         self.election_state_cv: Condition = Condition()
         self.coordinator_id_cv: Condition = Condition()
         
         self.logger: Logger = logger
 
+        self.membership: Membership = Membership(self.node_id, self.other_nodes, self.channel_cache, self.logger)
+        self.membership.add_listener(self._on_membership_change)
+
+        # locks served while this node is the coordinator, half of the server workers at most wait in AcquireLock
+        self.lock_service: LockService = LockService(self.node_id, self.logger, lock_queue_order, max_waiters=max(server_workers // 2, 1))
+        # locks this node holds, registered again with every new coordinator
+        self.held_locks: Dict[int, Tuple[LockRequest, float]] = {} # key: (granted request, lease deadline)
+        self.lock_acquired_at: Dict[int, float] = {} # key: time.monotonic() the held lock was granted, guarded by held_locks_lock
+        self.held_locks_lock: Lock = Lock()
+        self.lock_clock: int = 0 # Lamport clock of the lock requests
+        self.highest_fencing_token: int = 0
+        # request ids start from the current time, so they never repeat those of a previous run of the node
+        self.lock_request_ids = itertools.count(time.time_ns())
+
+        self.grpc_server_handler: grpc.Server = None
+        self.stopped: Event = Event()
+
+        # instrumentation, read by the election benchmark
+        self.messages_sent: Counter = Counter() # rpc name: calls made
+        self.messages_sent_lock: Lock = Lock()
+        self.failure_detected_at: float = None # time.monotonic() of the last failed coordinator status check
+        self.coordinator_changed_at: float = None # time.monotonic() of the last change of coordinator_id
+        self.election_histogram = self.metrics.histogram("election_duration_seconds", "Time from sending election messages to knowing the coordinator.")
+        self.heartbeat_histogram = self.metrics.histogram("heartbeat_rtt_seconds", "Round trip time of successful coordinator status checks.")
+        self.lock_wait_histogram = self.metrics.histogram("lock_wait_seconds", "Time from requesting a lock to being granted it.")
+        self.lock_hold_histogram = self.metrics.histogram("lock_hold_seconds", "Time from being granted a lock to releasing it.")
+        self.metrics.gauge("lock_queue_depth", "Lock requests waiting at this node while it is the coordinator.", self.lock_service.queue_depth)
+        self.metrics.gauge("election_term", "Highest election term this node has seen.", lambda: self.term)
+        self.metrics.gauge("coordinator_id", "Node id of the coordinator, 0 while there is none.", lambda: self.coordinator_id or 0)
+
 
     def run_node(self):
         """
-        Run the node server-side handler and client-side election cycle.
+        Run the node server-side handler and client-side election cycle, joining the cluster first if join_address is set.
+        """
+        self.start_server()
+        if self.join_address is not None:
+            self.join_cluster(self.join_address)
+        self.start_election_cycle()
+        self.grpc_server_handler.wait_for_termination()
+
+    def start_server(self) -> int:
+        """
+        Start the gRPC server and return the port it is bound to, which is chosen by the OS if node_port is "0".
         """
-        # start gRPC server
-        grpc_server_handler = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
-        node_service_pb2_grpc.add_NodeServicer_to_server(self, grpc_server_handler)
-        grpc_server_handler.add_insecure_port(f"[::]:{self.node_port}")
-        grpc_server_handler.start()
+        self.grpc_server_handler = grpc.server(futures.ThreadPoolExecutor(max_workers=self.server_workers), interceptors=[ReceivedRpcCounter(self.metrics)])
+        node_service_pb2_grpc.add_NodeServicer_to_server(self, self.grpc_server_handler)
+        port = self.grpc_server_handler.add_insecure_port(f"[::]:{self.node_port}")
+        self.grpc_server_handler.start()
         self.logger.info(f"Node {self.node_id} started gRPC server.")
 
-        # run first election
-        self._run_election()
+        if self.node_host is None:
+            self.node_host = f"localhost:{port}"
+        self.membership.merge(MembershipView(members=[Member(node_id=self.node_id, host=self.node_host, status=ALIVE, incarnation=1)]))
+        self.membership.start()
+        return port
+
+    def start_election_cycle(self):
+        """
+        Start the first election, then start checking the coordinator status in the background.
+        """
+        self._schedule_election()
 
-        # check coordinator status loop
         coordinator_status_thread = Thread(target=self._check_coordinator_status, daemon=True)
         coordinator_status_thread.start()
-        
-        grpc_server_handler.wait_for_termination()
 
-    def _run_election(self):
+    def stop(self):
+        """
+        Stop the gRPC server and the coordinator status check loop, as if the node crashed, and close the cached channels.
+        """
+        self.stopped.set()
+        self.membership.stop()
+        if self.grpc_server_handler is not None:
+            self.grpc_server_handler.stop(grace=None)
+        self.channel_cache.close()
+        self.logger.info(f"Node {self.node_id} stopped.")
+
+    def add_nodes(self, nodes: Dict[int, str]):
+        """
+        Add nodes to the membership view, as if they had been given in other_nodes.
+        """
+        self.membership.merge(MembershipView(members=[Member(node_id=node_id, host=host, status=ALIVE, incarnation=1) for node_id, host in nodes.items()]))
+
+    def join_cluster(self, seed_address: str):
+        """
+        Ask the node at seed_address to add this node to the cluster, and merge the view it answers with.
+        The seed may still be starting, so the call is retried up to JOIN_ATTEMPTS times.
+        """
+        member = Member(node_id=self.node_id, host=self.node_host, status=ALIVE, incarnation=1)
+        for attempt in range(1, JOIN_ATTEMPTS + 1):
+            with grpc.insecure_channel(seed_address) as channel:
+                try:
+                    view = node_service_pb2_grpc.NodeStub(channel).Join(member, timeout=NODE_RESPONSE_TIMEOUT)
+                except grpc.RpcError as e:
+                    if attempt == JOIN_ATTEMPTS:
+                        raise
+                    self.logger.error(f"Node {self.node_id} could not join the cluster through {seed_address}. Error: {e.code()}")
+                    time.sleep(JOIN_RETRY_INTERVAL)
+                    continue
+            self.membership.merge(view)
+            self.logger.info(f"Node {self.node_id} joined the cluster at version {view.version} with nodes {sorted(self.other_nodes)}")
+            return
+
+    def leave_cluster(self):
+        """
+        Tell every other node that this one is leaving, so a new coordinator is elected right away if it was the coordinator,
+        then stop the node.
+        """
+        left = self.membership.leave(self.node_id)
+        calls = []
+        for node_id in list(self.other_nodes):
+            try:
+                _, node_stub = self.channel_cache.get_stub(node_id)
+                calls.append((node_id, node_stub.Leave.future(left, timeout=NODE_RESPONSE_TIMEOUT)))
+            except Exception as e:
+                self.logger.error(f"Node {self.node_id} couldn't tell Node {node_id} it is leaving. Error: {e}")
+        for node_id, call in calls:
+            if call.exception() is not None:
+                self.logger.error(f"Node {self.node_id} couldn't tell Node {node_id} it is leaving. Error: {call.exception()}")
+        self.logger.info(f"Node {self.node_id} left the cluster.")
+        self.stop()
+
+    def _on_membership_change(self, added: Dict[int, str], removed: List[int]):
         """
-        Run an election to choose a new coordinator.
+        Make elections follow a membership change: nodes that joined become election candidates, nodes that left are
+        no longer contacted, and if the coordinator left this node forgets it so the status check loop starts an election.
+        """
+        with self.coordinator_id_cv:
+            other_nodes = { node_id: host for node_id, host in self.other_nodes.items() if node_id not in removed }
+            other_nodes.update(added)
+            self.other_nodes = other_nodes
+            self.channel_cache.set_nodes(other_nodes)
+            for node_id in removed:
+                self.lock_service.forget_node(node_id)
+            if self.coordinator_id in removed:
+                self.logger.info(f"Node {self.node_id} coordinator Node {self.coordinator_id} left the cluster.")
+                self._set_coordinator(None)
+
+    def _schedule_election(self, term: int = None) -> bool:
+        """
+        Start an election for term, the term after the highest one seen by default, unless this node is already in an
+        election or already ran the one of that term. Returns True if an election was started.
+        """
+        with self.election_state_cv:
+            if self.election_state == ElectionState.RUNNING:
+                return False
+            if term is None:
+                term = self.term + 1
+            if term <= self.election_term:
+                return False
+            self.term = max(self.term, term)
+            self.election_term = term
+            self.election_state = ElectionState.RUNNING
+            self.election_state_cv.notify_all()
+
+        election_thread = Thread(target=self._run_election_after_backoff, args=(term,), daemon=True)
+        election_thread.start()
+        return True
+
+    def _election_backoff(self) -> float:
+        """
+        Delay before running an election: ELECTION_BACKOFF_SLOT per known node with a higher id, plus up to half a slot
+        of jitter. The highest live node goes first, and its coordinator message usually arrives before any other node
+        is done waiting, so a failover costs about one message per node instead of one per pair of nodes.
+        """
+        higher_nodes = sum(1 for other_node_id in self.other_nodes if self.node_id < other_node_id)
+        return min(higher_nodes * ELECTION_BACKOFF_SLOT, ELECTION_BACKOFF_MAX) + random.uniform(0, ELECTION_BACKOFF_SLOT / 2)
+
+    def _run_election_after_backoff(self, term: int):
+        """
+        Wait for the election backoff, then run the election of term if no coordinator was elected in that term meanwhile.
+        """
+        self.stopped.wait(self._election_backoff())
+        with self.coordinator_id_cv:
+            is_decided = self.coordinator_id is not None and self.coordinator_term >= term
+        if not is_decided and not self.stopped.is_set():
+            self._run_election(term)
+        else:
+            self.logger.info(f"Node {self.node_id} skipped the election of term {term}, Node {self.coordinator_id} was elected meanwhile.")
+
+        # set election_state flag to NOT_RUNNING, even if coordinator was or wasn't elected
+        with self.election_state_cv:
+            self.election_state = ElectionState.NOT_RUNNING
+            self.election_state_cv.notify_all()
+
+    def _run_election(self, term: int):
+        """
+        Run the election of term to choose a new coordinator.
         If no other nodes respond, the current node will coordinator message.
         If any other nodes respond, the current node will wait for a coordinator message to populate coordinator_id variable.
         """
-        
-        # set election_state flag to RUNNING
-        self. election_state_cv.acquire()
-        self.election_state = ElectionState.RUNNING
-        self.election_state_cv.notify_all()
-        self.election_state_cv.release()
-
-        self.logger.info(f"Node {self.node_id} is running an election.")
+        self.logger.info(f"Node {self.node_id} is running the election of term {term}.")
+        started_at = time.monotonic()
 
         is_coordinator = True
-        for other_node_id, other_node_host in self.other_nodes.items():
-            if self.node_id < other_node_id:
-                try:
-                    other_node_stub = self. __create_node_stub(other_node_host)
-                    other_node_stub.RunElection(NodeRequest(node_id=self.node_id), timeout=NODE_RESPONSE_TIMEOUT)
-                    self.logger.info(f"Node {self.node_id} received an answer from Node {other_node_id}, so Node {self.node_id} can't be the coordinator anymore.")
-                    is_coordinator = False
-                except:
-                    self.logger.error(f"Node {self.node_id} didn't get response from Node {other_node_id}.")
+        higher_node_ids = [other_node_id for other_node_id in self.other_nodes if self.node_id < other_node_id]
+        for other_node_id, response in self._broadcast("RunElection", higher_node_ids, term).items():
+            if isinstance(response, Exception):
+                self.logger.error(f"Node {self.node_id} didn't get response from Node {other_node_id}.")
+            elif response.abstained:
+                self.logger.info(f"Node {self.node_id} was told by Node {other_node_id} that it is not taking part in the election.")
+            else:
+                self.logger.info(f"Node {self.node_id} received an answer from Node {other_node_id}, so Node {self.node_id} can't be the coordinator anymore.")
+                is_coordinator = False
 
         self.coordinator_id_cv.acquire()
         if is_coordinator:
-            self.coordinator_id = self.node_id
-            self._send_coordinator_message()
+            self.coordinator_term = term
+            self._set_coordinator(self.node_id)
+            self._send_coordinator_message(term)
         else:
             has_coordinator = lambda : self.coordinator_id is not None
             self.coordinator_id_cv.wait_for(has_coordinator, timeout=COORDINATOR_MESSAGE_TIMEOUT)
         self.coordinator_id_cv.release()
 
-        # set election_state flag to NOT_RUNNING, even if coordinator was or wasn't elected
-        self.election_state_cv.acquire()
-        self.election_state = ElectionState.NOT_RUNNING
-        self.election_state_cv.release()
-
-        self.logger.info(f"Node {self.node_id} finished running an election")
+        self.logger.info(f"Node {self.node_id} finished running the election of term {term}")
         if self.coordinator_id is not None:
+            self.election_histogram.record(time.monotonic() - started_at)
             self.logger.info(f"Node {self.coordinator_id} is the new elected coordinator")
         else:
             self.logger.info(f"Node {self.node_id} couldn't become coordinator, but no Node became coordinator.")
@@ -115,39 +307,222 @@ class Node(NodeServicer):
         """
         Check if the coordinator is still alive.
         If coordinator is alive, do nothing.
-        If coordinator is not alive, start a new election on a new thread.
+        If there is no coordinator or the failure detector suspects it, start a new election unless one is already running.
+        The status check runs without holding coordinator_id_cv, so coordinator messages are never blocked by it.
+        After a failed check that is not enough to suspect the coordinator yet, the next one is sent sooner.
         """
         self.logger.info(f"Node {self.node_id} started coordinator status check loop.")
-        
+
+        monitored_coordinator_id = None
+        while not self.stopped.is_set():
+            with self.coordinator_id_cv:
+                coordinator_id = self.coordinator_id
+            if coordinator_id is None and self._schedule_election():
+                self.logger.info(f"Node {self.node_id} has no coordinator.")
+
+            if coordinator_id != monitored_coordinator_id:
+                self.failure_detector.reset()
+                monitored_coordinator_id = coordinator_id
+
+            next_check_delay = self.coordinator_status_interval
+            if coordinator_id is not None and coordinator_id != self.node_id and not self._ping_coordinator(coordinator_id):
+                if self.failure_detector.is_suspected(time.monotonic()):
+                    with self.coordinator_id_cv:
+                        # a coordinator message may have arrived during the check
+                        if self.coordinator_id == coordinator_id:
+                            self.logger.error(f"Node {self.node_id} suspects coordinator Node {coordinator_id} failed.")
+                            self.failure_detected_at = time.monotonic()
+                            self._set_coordinator(None)
+                    next_check_delay = 0.0
+                else:
+                    next_check_delay = min(next_check_delay, self.failure_detector.ping_timeout())
+            self.stopped.wait(next_check_delay)
+
+    def _ping_coordinator(self, coordinator_id: int) -> bool:
+        """
+        Send one status check to the coordinator and report its outcome to the failure detector.
+        """
+        self.logger.debug(f"Node {self.node_id} checking coordinator Node {coordinator_id} status")
+        channel = None
+        started_at = time.monotonic()
+        try:
+            channel, coordinator_stub = self.channel_cache.get_stub(coordinator_id)
+            self._count_message("GetCoordinatorStatus")
+            coordinator_stub.GetCoordinatorStatus(NodeRequest(node_id=self.node_id), timeout=self.failure_detector.ping_timeout())
+        except Exception as e:
+            self.logger.error(f"Node {self.node_id} could not check coordinator Node {coordinator_id} status. Error: {e}")
+            if channel is not None:
+                self.channel_cache.invalidate(coordinator_id, channel)
+            self.failure_detector.record_failure(time.monotonic())
+            return False
+        now = time.monotonic()
+        self.failure_detector.record_response(now - started_at, now)
+        self.heartbeat_histogram.record(now - started_at)
+        return True
+
+                
+    def _send_coordinator_message(self, term: int):
+        """
+        Sends the coordinator message of term to all other nodes.
+        The lock service does not wait for the locks of the nodes that could not be told, they will not register any.
+        """
+        for node_id, response in self._broadcast("ReceiveCoordinatorMessage", list(self.other_nodes), term).items():
+            if isinstance(response, Exception):
+                self.logger.error(f"Coordinator Node {self.node_id} couldn't send coordinator message to Node {node_id}. Error: {response}")
+                self.lock_service.forget_node(node_id)
+
+    def _broadcast(self, rpc_name: str, node_ids: List[int], term: int) -> Dict[int, Union[NodeResponse, Exception]]:
+        """
+        Calls the same RPC on several nodes at once, with one deadline shared by all the calls,
+        so a broadcast takes at most NODE_RESPONSE_TIMEOUT no matter how many nodes are down.
+        Returns the response of each node that answered, or the error of its call.
+        The channels of the failed calls are dropped from the cache if they are broken.
+        """
+        deadline = time.monotonic() + NODE_RESPONSE_TIMEOUT
+        calls = {}
+        responses: Dict[int, Union[NodeResponse, Exception]] = {}
+        for node_id in node_ids:
+            try:
+                channel, node_stub = self.channel_cache.get_stub(node_id)
+                self._count_message(rpc_name)
+                rpc = getattr(node_stub, rpc_name)
+                calls[node_id] = (channel, rpc.future(NodeRequest(node_id=self.node_id, term=term), timeout=max(deadline - time.monotonic(), 0.0)))
+            except Exception as e:
+                responses[node_id] = e
+
+        for node_id, (channel, call) in calls.items():
+            error = call.exception()
+            if error is not None:
+                responses[node_id] = error
+                self.channel_cache.invalidate(node_id, channel)
+            else:
+                responses[node_id] = call.result()
+        return responses
+
+
+    def acquire_lock(self, key: int, timeout: float = None) -> int:
+        """
+        Acquire the lock on key from the coordinator and return its fencing token, valid for the lease the coordinator gave.
+        Without contention this is a single call to the coordinator. A queued request keeps its place while it is polled
+        again, and is sent as it is to a new coordinator after a failover, so its Lamport timestamp keeps its turn.
+        Raises LockTimeoutError if the lock was not granted within timeout seconds.
+        """
+        started_at = time.monotonic()
+        deadline = None if timeout is None else started_at + timeout
+        with self.held_locks_lock:
+            self.lock_clock += 1
+            request = LockRequest(node_id=self.node_id, key=key, request_id=next(self.lock_request_ids), lamport_timestamp=self.lock_clock)
+        self.logger.debug(f"Node {self.node_id} requesting lock on key {key}")
         while True:
-            self.coordinator_id_cv.acquire()
-            if self.coordinator_id is not None and self.coordinator_id != self.node_id:
-                self.logger.info(f"Node {self.node_id} checking coordinator Node {self.coordinator_id} status")
+            if self.stopped.is_set():
+                raise LockTimeoutError(f"Node {self.node_id} stopped while requesting lock on key {key}")
+            with self.coordinator_id_cv:
+                coordinator_id = self.coordinator_id
+            wait_timeout = LOCK_WAIT_TIMEOUT if deadline is None else min(LOCK_WAIT_TIMEOUT, max(deadline - time.monotonic(), 0.0))
+            request.wait_timeout = wait_timeout
+            response = None
+            if coordinator_id is not None:
                 try:
-                    coordinator_host = self.other_nodes[self.coordinator_id]
-                    coordinator_stub = self. __create_node_stub(coordinator_host)
-                    coordinator_stub.GetCoordinatorStatus(NodeRequest(node_id=self.node_id), timeout=NODE_RESPONSE_TIMEOUT)
+                    response = self._call_lock_service("AcquireLock", coordinator_id, request, wait_timeout + NODE_RESPONSE_TIMEOUT)
                 except Exception as e:
-                    self.logger.error(f"Node {self.node_id} could not check coordinator Node {self.coordinator_id} status. Error: {e}")
-                    self.coordinator_id = None
-            elif self.coordinator_id is None:
-                self.logger.info(f"Node {self.node_id} has no coordinator.")
-                election_thread = Thread(target=self._run_election)
-                election_thread.start()
-            self.coordinator_id_cv.release()
-            time.sleep(COORDINATOR_STATUS_INTERVAL)
+                    self.logger.error(f"Node {self.node_id} couldn't request lock on key {key} from coordinator Node {coordinator_id}. Error: {e}")
+            if response is not None:
+                self._update_lock_clock(response.lamport_timestamp)
+                if response.status == GRANTED:
+                    self.lock_wait_histogram.record(time.monotonic() - started_at)
+                    return self._hold_lock(request, response)
+            if deadline is not None and time.monotonic() >= deadline:
+                self._withdraw_lock_request(coordinator_id, request)
+                raise LockTimeoutError(f"Node {self.node_id} couldn't acquire lock on key {key} within {timeout} seconds")
+            if response is None or response.status == NOT_COORDINATOR:
+                # no coordinator yet, or the election is not over
+                self.stopped.wait(LOCK_RETRY_INTERVAL)
 
-                
-    def _send_coordinator_message(self):
+    def release_lock(self, key: int):
         """
-        Sets coordinator_id and sends a coordinator message request to all other nodes.
+        Release a lock acquired with acquire_lock. If the coordinator cannot be reached, the lock is freed when its lease ends.
         """
-        for node_id, node_host in self.other_nodes.items():
+        with self.held_locks_lock:
+            request, _ = self.held_locks.pop(key)
+            self.lock_hold_histogram.record(time.monotonic() - self.lock_acquired_at.pop(key))
+            self.lock_clock += 1
+            request.lamport_timestamp = self.lock_clock
+        with self.coordinator_id_cv:
+            coordinator_id = self.coordinator_id
+        if coordinator_id is None:
+            return
+        try:
+            response = self._call_lock_service("ReleaseLock", coordinator_id, request, NODE_RESPONSE_TIMEOUT)
+            self._update_lock_clock(response.lamport_timestamp)
+        except Exception as e:
+            self.logger.error(f"Node {self.node_id} couldn't release lock on key {key} at coordinator Node {coordinator_id}. Error: {e}")
+            return
+        self.logger.debug(f"Node {self.node_id} released lock on key {key}")
+
+    def _hold_lock(self, request: LockRequest, response: LockResponse) -> int:
+        with self.held_locks_lock:
+            request.fencing_token = response.fencing_token
+            self.lock_acquired_at[request.key] = time.monotonic()
+            self.held_locks[request.key] = (request, self.lock_acquired_at[request.key] + response.lease)
+            self.highest_fencing_token = max(self.highest_fencing_token, response.fencing_token)
+        self.logger.debug(f"Node {self.node_id} acquired lock on key {request.key} with fencing token {response.fencing_token}")
+        return response.fencing_token
+
+    def _withdraw_lock_request(self, coordinator_id: int, request: LockRequest):
+        if coordinator_id is None:
+            return
+        try:
+            self._call_lock_service("ReleaseLock", coordinator_id, request, NODE_RESPONSE_TIMEOUT)
+        except Exception as e:
+            self.logger.error(f"Node {self.node_id} couldn't withdraw lock request on key {request.key}. Error: {e}")
+
+    def _update_lock_clock(self, lamport_timestamp: int):
+        with self.held_locks_lock:
+            self.lock_clock = max(self.lock_clock, lamport_timestamp)
+
+    def _register_locks(self, coordinator_id: int):
+        """
+        Register the locks this node holds with a new coordinator, so it can rebuild its lock table.
+        Retried until the coordinator accepts them or another node becomes coordinator.
+        """
+        while not self.stopped.is_set() and self.coordinator_id == coordinator_id:
+            now = time.monotonic()
+            with self.held_locks_lock:
+                self.held_locks = { key: (request, lease_deadline) for key, (request, lease_deadline) in self.held_locks.items() if lease_deadline > now }
+                held = [
+                    LockRequest(
+                        node_id=self.node_id,
+                        key=key,
+                        request_id=request.request_id,
+                        lamport_timestamp=request.lamport_timestamp,
+                        fencing_token=request.fencing_token,
+                        lease=lease_deadline - now,
+                    )
+                    for key, (request, lease_deadline) in self.held_locks.items()
+                ]
+                registration = LockRegistration(node_id=self.node_id, held=held, highest_fencing_token=self.highest_fencing_token)
             try:
-                node_stub = self. __create_node_stub(node_host)
-                node_stub.ReceiveCoordinatorMessage(NodeRequest(node_id=self.node_id), timeout=NODE_RESPONSE_TIMEOUT)
+                response = self._call_lock_service("RegisterLocks", coordinator_id, registration, NODE_RESPONSE_TIMEOUT)
+                if response.status != NOT_COORDINATOR:
+                    self.logger.info(f"Node {self.node_id} registered {len(held)} held locks with coordinator Node {coordinator_id}")
+                    return
             except Exception as e:
-                self.logger.error(f"Coordinator Node {self.node_id} couldn't send coordinator message to Node {node_id}. Error: {e}")
+                self.logger.error(f"Node {self.node_id} couldn't register its locks with coordinator Node {coordinator_id}. Error: {e}")
+            self.stopped.wait(LOCK_RETRY_INTERVAL)
+
+    def _call_lock_service(self, rpc_name: str, coordinator_id: int, message, timeout: float):
+        """
+        Call the lock service of the coordinator, directly when this node is the coordinator.
+        """
+        if coordinator_id == self.node_id:
+            return getattr(self, rpc_name)(message, None)
+        channel, node_stub = self.channel_cache.get_stub(coordinator_id)
+        self._count_message(rpc_name)
+        try:
+            return getattr(node_stub, rpc_name)(message, timeout=timeout)
+        except grpc.RpcError:
+            self.channel_cache.invalidate(coordinator_id, channel)
+            raise
 
 
     # ========================
@@ -157,33 +532,64 @@ class Node(NodeServicer):
     def RunElection(self, request: NodeRequest, context):
         """
         gRPC method to receive an election request from another node.
-        Answer an election request from another node.
-        If the current node is not running an election, it will answer ok and start an election.
-        If the current node is running an election, it will answer ok.
+        Answer an election request from another node, which then waits for a coordinator message.
+        If the current node is the coordinator, it sends its coordinator message to that node only.
+        If it knows a coordinator with a higher id, it answers that it is not taking part, which the caller does not count
+        as an answer to its election: the election request also went to that coordinator, which answers it if alive.
+        The coordinator is pinged in the background, and if it does not answer this node joins the election.
+        Otherwise it joins the election of that term, unless it already ran it or is running another one.
         """
-        self. election_state_cv.acquire()
-        if self.election_state == ElectionState.RUNNING:
-            self.logger.info(f"Node {self.node_id} is already running an election. Received election request from node {request.node_id}.")
-        else:
-            election_thread = Thread(target=self._run_election)
-            election_thread.start()
-            is_running = lambda : self.election_state == ElectionState.RUNNING
-            self.election_state_cv.wait_for(is_running)
-        self.election_state_cv.release()
+        with self.election_state_cv:
+            self.term = max(self.term, request.term)
+
+        with self.coordinator_id_cv:
+            coordinator_id = self.coordinator_id
+            coordinator_term = self.coordinator_term
+        if coordinator_id == self.node_id:
+            self.logger.info(f"Coordinator Node {self.node_id} received election request from node {request.node_id}.")
+            Thread(target=self._broadcast, args=("ReceiveCoordinatorMessage", [request.node_id], coordinator_term), daemon=True).start()
+        elif coordinator_id is not None and coordinator_id > self.node_id:
+            self.logger.info(f"Node {self.node_id} received election request from node {request.node_id}, coordinator Node {coordinator_id} will answer it.")
+            Thread(target=self._verify_coordinator, args=(coordinator_id, request.term), daemon=True).start()
+            return NodeResponse(abstained=True)
+        elif not self._schedule_election(request.term):
+            self.logger.info(f"Node {self.node_id} is already running or ran an election. Received election request from node {request.node_id} for term {request.term}.")
 
         return NodeResponse()
     
+    def _verify_coordinator(self, coordinator_id: int, term: int):
+        """
+        Ping the coordinator that another node's election request of term suggests may have failed,
+        and run an election if it does not answer.
+        The lower node that sent the request may have elected itself meanwhile, so the election is for a later term,
+        which this node wins over it.
+        """
+        if self._ping_coordinator(coordinator_id):
+            return
+        with self.coordinator_id_cv:
+            if self.coordinator_id is not None and self.coordinator_id != coordinator_id and self.coordinator_id > self.node_id:
+                return # a higher coordinator was elected during the check
+            self.logger.error(f"Node {self.node_id} could not reach coordinator Node {coordinator_id} after an election request of term {term}, running an election.")
+            if self.coordinator_id == coordinator_id:
+                self._set_coordinator(None)
+        self._schedule_election()
+
     def ReceiveCoordinatorMessage(self, request: NodeRequest, context):
         """
         gRPC method to receive a coordinator message request from another node.
-        Process a coordinator message request from another node and sets it as the current coordinator, if node is still running an election.
-        Then, notifies condition variable to wake up threads waiting for a coordinator.
-        If it is not running an election anymore, ignores message and logs a message.
+        Sets the sender as the current coordinator and notifies condition variable to wake up threads waiting for a coordinator.
+        A message from a lower node elected in an older term than the current coordinator is late and ignored.
         """
-        self.coordinator_id_cv.acquire()
-        self.coordinator_id = request.node_id
-        self.coordinator_id_cv.notify_all()
-        self.coordinator_id_cv.release()
+        with self.election_state_cv:
+            self.term = max(self.term, request.term)
+
+        with self.coordinator_id_cv:
+            if self.coordinator_id is not None and request.node_id < self.coordinator_id and request.term < self.coordinator_term:
+                self.logger.info(f"Node {self.node_id} ignored coordinator message of Node {request.node_id} from older term {request.term}.")
+                return NodeResponse()
+            self.coordinator_term = request.term
+            self._set_coordinator(request.node_id)
+            self.coordinator_id_cv.notify_all()
 
         self.logger.info(f"Node {request.node_id} is the new elected leader/coordinator.")
 
@@ -193,18 +599,68 @@ class Node(NodeServicer):
         """
         gRPC method to receive a status check request from another node.
         """
-        self.logger.info(f"Coordinator Node {self.node_id} status was checked by Node {request.node_id}.")
+        self.logger.debug(f"Coordinator Node {self.node_id} status was checked by Node {request.node_id}.")
         return NodeResponse()
+
+    def Join(self, request: Member, context):
+        """
+        gRPC method to add a new node to the cluster. Answers with the whole membership view.
+        """
+        return self.membership.join(request)
+
+    def Leave(self, request: Member, context):
+        """
+        gRPC method to remove a node that is leaving the cluster.
+        """
+        return self.membership.merge(MembershipView(members=[request]))
+
+    def GossipMembership(self, request: MembershipView, context):
+        """
+        gRPC method to merge the membership view of another node. Answers with the merged view.
+        """
+        return self.membership.merge(request)
+
+    def AcquireLock(self, request: LockRequest, context):
+        """
+        gRPC method to acquire a lock from this node while it is the coordinator.
+        Answers once the lock is granted or after the request's wait_timeout, in which case the request stays queued.
+        """
+        return self.lock_service.acquire(request)
+
+    def ReleaseLock(self, request: LockRequest, context):
+        """
+        gRPC method to release a lock, or withdraw a queued request, while this node is the coordinator.
+        """
+        return self.lock_service.release(request)
+
+    def RegisterLocks(self, request: LockRegistration, context):
+        """
+        gRPC method to register the locks a node held under the previous coordinator.
+        """
+        return self.lock_service.register(request)
     
 
     # ========================
     #      helper methods
     # ========================
 
-    def  __create_node_stub(self, node_host: int) -> NodeStub:
+    def _set_coordinator(self, coordinator_id: int):
         """
-        Get the gRPC client stub for the node with the given id.
+        Set coordinator_id, recording when it changed. Must be called with coordinator_id_cv held.
+        The lock service moves with the coordinator, and the locks this node holds are registered with the new one.
         """
-        channel = grpc.insecure_channel(node_host)
-        grpc_stub = node_service_pb2_grpc.NodeStub(channel)
-        return grpc_stub
\ No newline at end of file
+        if coordinator_id == self.coordinator_id:
+            return
+        previous_coordinator_id = self.coordinator_id
+        self.coordinator_changed_at = time.monotonic()
+        self.coordinator_id = coordinator_id
+        if previous_coordinator_id == self.node_id:
+            self.lock_service.step_down()
+        if coordinator_id == self.node_id:
+            self.lock_service.take_over(list(self.other_nodes) + [self.node_id])
+        if coordinator_id is not None:
+            Thread(target=self._register_locks, args=(coordinator_id,), daemon=True).start()
+
+    def _count_message(self, rpc_name: str):
+        with self.messages_sent_lock:
+            self.messages_sent[rpc_name] += 1
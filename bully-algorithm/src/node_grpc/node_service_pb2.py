@@ -14,17 +14,31 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x12node_service.proto\x12\x0cnode_service\"\x1e\n\x0bNodeRequest\x12\x0f\n\x07node_id\x18\x01 \x01(\x05\"\x0e\n\x0cNodeResponse2\xf5\x01\n\x04Node\x12\x46\n\x0bRunElection\x12\x19.node_service.NodeRequest\x1a\x1a.node_service.NodeResponse\"\x00\x12T\n\x19ReceiveCoordinatorMessage\x12\x19.node_service.NodeRequest\x1a\x1a.node_service.NodeResponse\"\x00\x12O\n\x14GetCoordinatorStatus\x12\x19.node_service.NodeRequest\x1a\x1a.node_service.NodeResponse\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x12node_service.proto\x12\x0cnode_service\",\n\x0bNodeRequest\x12\x0f\n\x07node_id\x18\x01 \x01(\x05\x12\x0c\n\x04term\x18\x02 \x01(\x03\"!\n\x0cNodeResponse\x12\x11\n\tabstained\x18\x01 \x01(\x08\"h\n\x06Member\x12\x0f\n\x07node_id\x18\x01 \x01(\x05\x12\x0c\n\x04host\x18\x02 \x01(\t\x12*\n\x06status\x18\x03 \x01(\x0e\x32\x1a.node_service.MemberStatus\x12\x13\n\x0bincarnation\x18\x04 \x01(\x03\"H\n\x0eMembershipView\x12%\n\x07members\x18\x01 \x03(\x0b\x32\x14.node_service.Member\x12\x0f\n\x07version\x18\x02 \x01(\x03\"\x96\x01\n\x0bLockRequest\x12\x0f\n\x07node_id\x18\x01 \x01(\x05\x12\x0b\n\x03key\x18\x02 \x01(\x03\x12\x12\n\nrequest_id\x18\x03 \x01(\x03\x12\x19\n\x11lamport_timestamp\x18\x04 \x01(\x03\x12\x15\n\rfencing_token\x18\x05 \x01(\x03\x12\x14\n\x0cwait_timeout\x18\x06 \x01(\x01\x12\r\n\x05lease\x18\x07 \x01(\x01\"y\n\x0cLockResponse\x12(\n\x06status\x18\x01 \x01(\x0e\x32\x18.node_service.LockStatus\x12\x15\n\rfencing_token\x18\x02 \x01(\x03\x12\r\n\x05lease\x18\x03 \x01(\x01\x12\x19\n\x11lamport_timestamp\x18\x04 \x01(\x03\"k\n\x10LockRegistration\x12\x0f\n\x07node_id\x18\x01 \x01(\x05\x12\'\n\x04held\x18\x02 \x03(\x0b\x32\x19.node_service.LockRequest\x12\x1d\n\x15highest_fencing_token\x18\x03 \x01(\x03*#\n\x0cMemberStatus\x12\t\n\x05\x41LIVE\x10\x00\x12\x08\n\x04LEFT\x10\x01*H\n\nLockStatus\x12\x13\n\x0fNOT_COORDINATOR\x10\x00\x12\x0b\n\x07GRANTED\x10\x01\x12\n\n\x06QUEUED\x10\x02\x12\x0c\n\x08RELEASED\x10\x03\x32\xa3\x05\n\x04Node\x12\x46\n\x0bRunElection\x12\x19.node_service.NodeRequest\x1a\x1a.node_service.NodeResponse\"\x00\x12T\n\x19ReceiveCoordinatorMessage\x12\x19.node_service.NodeRequest\x1a\x1a.node_service.NodeResponse\"\x00\x12O\n\x14GetCoordinatorStatus\x12\x19.node_service.NodeRequest\x1a\x1a.node_service.NodeResponse\"\x00\x12<\n\x04Join\x12\x14.node_service.Member\x1a\x1c.node_service.MembershipView\"\x00\x12=\n\x05Leave\x12\x14.node_service.Member\x1a\x1c.node_service.MembershipView\"\x00\x12P\n\x10GossipMembership\x12\x1c.node_service.MembershipView\x1a\x1c.node_service.MembershipView\"\x00\x12\x46\n\x0b\x41\x63quireLock\x12\x19.node_service.LockRequest\x1a\x1a.node_service.LockResponse\"\x00\x12\x46\n\x0bReleaseLock\x12\x19.node_service.LockRequest\x1a\x1a.node_service.LockResponse\"\x00\x12M\n\rRegisterLocks\x12\x1e.node_service.LockRegistration\x1a\x1a.node_service.LockResponse\"\x00\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'node_service_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
+  _globals['_MEMBERSTATUS']._serialized_start=682
+  _globals['_MEMBERSTATUS']._serialized_end=717
+  _globals['_LOCKSTATUS']._serialized_start=719
+  _globals['_LOCKSTATUS']._serialized_end=791
   _globals['_NODEREQUEST']._serialized_start=36
-  _globals['_NODEREQUEST']._serialized_end=66
-  _globals['_NODERESPONSE']._serialized_start=68
-  _globals['_NODERESPONSE']._serialized_end=82
-  _globals['_NODE']._serialized_start=85
-  _globals['_NODE']._serialized_end=330
+  _globals['_NODEREQUEST']._serialized_end=80
+  _globals['_NODERESPONSE']._serialized_start=82
+  _globals['_NODERESPONSE']._serialized_end=115
+  _globals['_MEMBER']._serialized_start=117
+  _globals['_MEMBER']._serialized_end=221
+  _globals['_MEMBERSHIPVIEW']._serialized_start=223
+  _globals['_MEMBERSHIPVIEW']._serialized_end=295
+  _globals['_LOCKREQUEST']._serialized_start=298
+  _globals['_LOCKREQUEST']._serialized_end=448
+  _globals['_LOCKRESPONSE']._serialized_start=450
+  _globals['_LOCKRESPONSE']._serialized_end=571
+  _globals['_LOCKREGISTRATION']._serialized_start=573
+  _globals['_LOCKREGISTRATION']._serialized_end=680
+  _globals['_NODE']._serialized_start=794
+  _globals['_NODE']._serialized_end=1469
 # @@protoc_insertion_point(module_scope)
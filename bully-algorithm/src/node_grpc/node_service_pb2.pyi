@@ -1,15 +1,99 @@
+from google.protobuf.internal import containers as _containers
+from google.protobuf.internal import enum_type_wrapper as _enum_type_wrapper
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
-from typing import ClassVar as _ClassVar, Optional as _Optional
+from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional, Union as _Union
 
 DESCRIPTOR: _descriptor.FileDescriptor
 
+class MemberStatus(int, metaclass=_enum_type_wrapper.EnumTypeWrapper):
+    __slots__ = ()
+    ALIVE: _ClassVar[MemberStatus]
+    LEFT: _ClassVar[MemberStatus]
+
+class LockStatus(int, metaclass=_enum_type_wrapper.EnumTypeWrapper):
+    __slots__ = ()
+    NOT_COORDINATOR: _ClassVar[LockStatus]
+    GRANTED: _ClassVar[LockStatus]
+    QUEUED: _ClassVar[LockStatus]
+    RELEASED: _ClassVar[LockStatus]
+ALIVE: MemberStatus
+LEFT: MemberStatus
+NOT_COORDINATOR: LockStatus
+GRANTED: LockStatus
+QUEUED: LockStatus
+RELEASED: LockStatus
+
 class NodeRequest(_message.Message):
-    __slots__ = ("node_id",)
+    __slots__ = ("node_id", "term")
     NODE_ID_FIELD_NUMBER: _ClassVar[int]
+    TERM_FIELD_NUMBER: _ClassVar[int]
     node_id: int
-    def __init__(self, node_id: _Optional[int] = ...) -> None: ...
+    term: int
+    def __init__(self, node_id: _Optional[int] = ..., term: _Optional[int] = ...) -> None: ...
 
 class NodeResponse(_message.Message):
-    __slots__ = ()
-    def __init__(self) -> None: ...
+    __slots__ = ("abstained",)
+    ABSTAINED_FIELD_NUMBER: _ClassVar[int]
+    abstained: bool
+    def __init__(self, abstained: _Optional[bool] = ...) -> None: ...
+
+class Member(_message.Message):
+    __slots__ = ("node_id", "host", "status", "incarnation")
+    NODE_ID_FIELD_NUMBER: _ClassVar[int]
+    HOST_FIELD_NUMBER: _ClassVar[int]
+    STATUS_FIELD_NUMBER: _ClassVar[int]
+    INCARNATION_FIELD_NUMBER: _ClassVar[int]
+    node_id: int
+    host: str
+    status: MemberStatus
+    incarnation: int
+    def __init__(self, node_id: _Optional[int] = ..., host: _Optional[str] = ..., status: _Optional[_Union[MemberStatus, str]] = ..., incarnation: _Optional[int] = ...) -> None: ...
+
+class MembershipView(_message.Message):
+    __slots__ = ("members", "version")
+    MEMBERS_FIELD_NUMBER: _ClassVar[int]
+    VERSION_FIELD_NUMBER: _ClassVar[int]
+    members: _containers.RepeatedCompositeFieldContainer[Member]
+    version: int
+    def __init__(self, members: _Optional[_Iterable[_Union[Member, _Mapping]]] = ..., version: _Optional[int] = ...) -> None: ...
+
+class LockRequest(_message.Message):
+    __slots__ = ("node_id", "key", "request_id", "lamport_timestamp", "fencing_token", "wait_timeout", "lease")
+    NODE_ID_FIELD_NUMBER: _ClassVar[int]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    REQUEST_ID_FIELD_NUMBER: _ClassVar[int]
+    LAMPORT_TIMESTAMP_FIELD_NUMBER: _ClassVar[int]
+    FENCING_TOKEN_FIELD_NUMBER: _ClassVar[int]
+    WAIT_TIMEOUT_FIELD_NUMBER: _ClassVar[int]
+    LEASE_FIELD_NUMBER: _ClassVar[int]
+    node_id: int
+    key: int
+    request_id: int
+    lamport_timestamp: int
+    fencing_token: int
+    wait_timeout: float
+    lease: float
+    def __init__(self, node_id: _Optional[int] = ..., key: _Optional[int] = ..., request_id: _Optional[int] = ..., lamport_timestamp: _Optional[int] = ..., fencing_token: _Optional[int] = ..., wait_timeout: _Optional[float] = ..., lease: _Optional[float] = ...) -> None: ...
+
+class LockResponse(_message.Message):
+    __slots__ = ("status", "fencing_token", "lease", "lamport_timestamp")
+    STATUS_FIELD_NUMBER: _ClassVar[int]
+    FENCING_TOKEN_FIELD_NUMBER: _ClassVar[int]
+    LEASE_FIELD_NUMBER: _ClassVar[int]
+    LAMPORT_TIMESTAMP_FIELD_NUMBER: _ClassVar[int]
+    status: LockStatus
+    fencing_token: int
+    lease: float
+    lamport_timestamp: int
+    def __init__(self, status: _Optional[_Union[LockStatus, str]] = ..., fencing_token: _Optional[int] = ..., lease: _Optional[float] = ..., lamport_timestamp: _Optional[int] = ...) -> None: ...
+
+class LockRegistration(_message.Message):
+    __slots__ = ("node_id", "held", "highest_fencing_token")
+    NODE_ID_FIELD_NUMBER: _ClassVar[int]
+    HELD_FIELD_NUMBER: _ClassVar[int]
+    HIGHEST_FENCING_TOKEN_FIELD_NUMBER: _ClassVar[int]
+    node_id: int
+    held: _containers.RepeatedCompositeFieldContainer[LockRequest]
+    highest_fencing_token: int
+    def __init__(self, node_id: _Optional[int] = ..., held: _Optional[_Iterable[_Union[LockRequest, _Mapping]]] = ..., highest_fencing_token: _Optional[int] = ...) -> None: ...
@@ -54,6 +54,36 @@ class NodeStub(object):
                 request_serializer=node__service__pb2.NodeRequest.SerializeToString,
                 response_deserializer=node__service__pb2.NodeResponse.FromString,
                 _registered_method=True)
+        self.Join = channel.unary_unary(
+                '/node_service.Node/Join',
+                request_serializer=node__service__pb2.Member.SerializeToString,
+                response_deserializer=node__service__pb2.MembershipView.FromString,
+                _registered_method=True)
+        self.Leave = channel.unary_unary(
+                '/node_service.Node/Leave',
+                request_serializer=node__service__pb2.Member.SerializeToString,
+                response_deserializer=node__service__pb2.MembershipView.FromString,
+                _registered_method=True)
+        self.GossipMembership = channel.unary_unary(
+                '/node_service.Node/GossipMembership',
+                request_serializer=node__service__pb2.MembershipView.SerializeToString,
+                response_deserializer=node__service__pb2.MembershipView.FromString,
+                _registered_method=True)
+        self.AcquireLock = channel.unary_unary(
+                '/node_service.Node/AcquireLock',
+                request_serializer=node__service__pb2.LockRequest.SerializeToString,
+                response_deserializer=node__service__pb2.LockResponse.FromString,
+                _registered_method=True)
+        self.ReleaseLock = channel.unary_unary(
+                '/node_service.Node/ReleaseLock',
+                request_serializer=node__service__pb2.LockRequest.SerializeToString,
+                response_deserializer=node__service__pb2.LockResponse.FromString,
+                _registered_method=True)
+        self.RegisterLocks = channel.unary_unary(
+                '/node_service.Node/RegisterLocks',
+                request_serializer=node__service__pb2.LockRegistration.SerializeToString,
+                response_deserializer=node__service__pb2.LockResponse.FromString,
+                _registered_method=True)
 
 
 class NodeServicer(object):
@@ -77,6 +107,42 @@ class NodeServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def Join(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Leave(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GossipMembership(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def AcquireLock(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ReleaseLock(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def RegisterLocks(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_NodeServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -95,6 +161,36 @@ def add_NodeServicer_to_server(servicer, server):
                     request_deserializer=node__service__pb2.NodeRequest.FromString,
                     response_serializer=node__service__pb2.NodeResponse.SerializeToString,
             ),
+            'Join': grpc.unary_unary_rpc_method_handler(
+                    servicer.Join,
+                    request_deserializer=node__service__pb2.Member.FromString,
+                    response_serializer=node__service__pb2.MembershipView.SerializeToString,
+            ),
+            'Leave': grpc.unary_unary_rpc_method_handler(
+                    servicer.Leave,
+                    request_deserializer=node__service__pb2.Member.FromString,
+                    response_serializer=node__service__pb2.MembershipView.SerializeToString,
+            ),
+            'GossipMembership': grpc.unary_unary_rpc_method_handler(
+                    servicer.GossipMembership,
+                    request_deserializer=node__service__pb2.MembershipView.FromString,
+                    response_serializer=node__service__pb2.MembershipView.SerializeToString,
+            ),
+            'AcquireLock': grpc.unary_unary_rpc_method_handler(
+                    servicer.AcquireLock,
+                    request_deserializer=node__service__pb2.LockRequest.FromString,
+                    response_serializer=node__service__pb2.LockResponse.SerializeToString,
+            ),
+            'ReleaseLock': grpc.unary_unary_rpc_method_handler(
+                    servicer.ReleaseLock,
+                    request_deserializer=node__service__pb2.LockRequest.FromString,
+                    response_serializer=node__service__pb2.LockResponse.SerializeToString,
+            ),
+            'RegisterLocks': grpc.unary_unary_rpc_method_handler(
+                    servicer.RegisterLocks,
+                    request_deserializer=node__service__pb2.LockRegistration.FromString,
+                    response_serializer=node__service__pb2.LockResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'node_service.Node', rpc_method_handlers)
@@ -186,3 +282,165 @@ class Node(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def Join(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node_service.Node/Join',
+            node__service__pb2.Member.SerializeToString,
+            node__service__pb2.MembershipView.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Leave(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node_service.Node/Leave',
+            node__service__pb2.Member.SerializeToString,
+            node__service__pb2.MembershipView.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GossipMembership(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node_service.Node/GossipMembership',
+            node__service__pb2.MembershipView.SerializeToString,
+            node__service__pb2.MembershipView.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def AcquireLock(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node_service.Node/AcquireLock',
+            node__service__pb2.LockRequest.SerializeToString,
+            node__service__pb2.LockResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ReleaseLock(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node_service.Node/ReleaseLock',
+            node__service__pb2.LockRequest.SerializeToString,
+            node__service__pb2.LockResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def RegisterLocks(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node_service.Node/RegisterLocks',
+            node__service__pb2.LockRegistration.SerializeToString,
+            node__service__pb2.LockResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -0,0 +1,257 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent import futures
+from threading import Thread
+from typing import Any, Dict, List
+
+import grpc
+import protobuf.service_pb2_grpc as service_pb2_grpc
+
+from load_generator.load_generator import LoadGenerator
+from lock_stream.lock_stream import lock_stream_server_workers
+from metrics.histogram import Histogram
+from metrics.registry import MetricsRegistry, ReceivedRpcCounter
+from storage.storage import Storage
+
+
+"""
+Benchmarks a whole storage cluster inside one process, without Docker.
+Run from the lamport-mutual-exclusion directory, e.g.:
+
+    python -m benchmark.benchmark --nodes 5 --pattern zipfian --duration 10 --output results.json
+"""
+
+
+# constants
+PATTERNS = ("hot", "uniform", "zipfian")
+STREAM_CONNECT_TIMEOUT = 5.0
+
+
+def key_weights(pattern: str, keys: int, zipf_exponent: float) -> List[float]:
+    """
+    Returns the probability weight of each key for a contention pattern:
+    "hot" sends every write to the first key, "uniform" spreads them evenly,
+    and "zipfian" makes the i-th key 1/i^zipf_exponent as likely as the first one.
+    """
+    if pattern == "hot":
+        return [1.0] + [0.0] * (keys - 1)
+    if pattern == "uniform":
+        return [1.0] * keys
+    if pattern == "zipfian":
+        return [1.0 / (rank ** zipf_exponent) for rank in range(1, keys + 1)]
+    raise ValueError(f"Unknown contention pattern {pattern}")
+
+
+class LocalCluster:
+    """
+    N storage servers on ephemeral localhost ports, each one with its own data file.
+    The ports are bound before the servers are created, so every server knows the addresses of all the others.
+    """
+    def __init__(self, nodes: int, data_dir: str, server_workers: int, **storage_options):
+        self.servers: Dict[int, grpc.Server] = {}
+        self.addresses: Dict[int, str] = {}
+        self.metrics: Dict[int, MetricsRegistry] = {}
+        for server_id in range(1, nodes + 1):
+            self.metrics[server_id] = MetricsRegistry()
+            server = grpc.server(futures.ThreadPoolExecutor(max_workers=server_workers), interceptors=[ReceivedRpcCounter(self.metrics[server_id])])
+            port = server.add_insecure_port("localhost:0")
+            self.servers[server_id] = server
+            self.addresses[server_id] = f"localhost:{port}"
+
+        self.storages: Dict[int, Storage] = {}
+        for server_id, server in self.servers.items():
+            storage = Storage(
+                server_id,
+                addresses=self.addresses,
+                data_path=os.path.join(data_dir, f"server{server_id}.log"),
+                metrics=self.metrics[server_id],
+                server_workers=server_workers,
+                **storage_options,
+            )
+            service_pb2_grpc.add_NodeCommunicationServiceServicer_to_server(storage, server)
+            server.start()
+            self.storages[server_id] = storage
+
+    def wait_for_lock_streams(self, timeout: float = STREAM_CONNECT_TIMEOUT):
+        """
+        Waits until every lock stream is open, so the measurement does not start on the unary fallback.
+        """
+        deadline = time.monotonic() + timeout
+        for storage in self.storages.values():
+            if storage.lock_streams is None:
+                continue
+            for link in storage.lock_streams.links.values():
+                while not link.is_connected() and time.monotonic() < deadline:
+                    time.sleep(0.01)
+
+    def close(self):
+        for storage in self.storages.values():
+            storage.close()
+        for server in self.servers.values():
+            server.stop(grace=None)
+
+
+def run_benchmark(
+    nodes: int = 5,
+    clients: int = 4,
+    duration: float = 10.0,
+    keys: int = 16,
+    pattern: str = "uniform",
+    zipf_exponent: float = 1.0,
+    rate: float = None,
+    mutex_algorithm: str = "ricart_agrawala",
+    shard_replicas: int = 3,
+    lock_transport: str = "unary",
+    piggyback_oks: bool = False,
+    critical_section_delay: float = 0.0,
+    server_workers: int = 16,
+) -> Dict[str, Any]:
+    """
+    Starts a local cluster, runs a load generator on every server for duration seconds and returns the results:
+    throughput, acquisition (lock wait) latency, end-to-end write latency and lock messages sent per acquisition.
+    clients and rate are per server; without a rate the load is closed loop.
+    """
+    if lock_transport == "stream":
+        # every lock stream accepted from a peer holds a server worker for its whole life
+        stream_server_workers = lock_stream_server_workers(nodes - 1, server_workers)
+        if stream_server_workers > server_workers:
+            logging.warning(f"Raising server workers from {server_workers} to {stream_server_workers}, so lock streams do not starve unary calls")
+            server_workers = stream_server_workers
+    config = {
+        "nodes": nodes,
+        "clients": clients,
+        "duration": duration,
+        "keys": keys,
+        "pattern": pattern,
+        "zipf_exponent": zipf_exponent,
+        "rate": rate,
+        "mutex_algorithm": mutex_algorithm,
+        "shard_replicas": shard_replicas,
+        "lock_transport": lock_transport,
+        "piggyback_oks": piggyback_oks,
+        "critical_section_delay": critical_section_delay,
+        "server_workers": server_workers,
+    }
+    weights = key_weights(pattern, keys, zipf_exponent)
+    with tempfile.TemporaryDirectory(prefix="lamport-benchmark-") as data_dir:
+        cluster = LocalCluster(
+            nodes,
+            data_dir,
+            server_workers,
+            use_lock_streams=lock_transport == "stream",
+            piggyback_oks=piggyback_oks,
+            mutex_algorithm=mutex_algorithm,
+            shard_replicas=shard_replicas,
+        )
+        try:
+            cluster.wait_for_lock_streams()
+            generators: Dict[int, LoadGenerator] = {}
+            for server_id, storage in cluster.storages.items():
+                storage.critical_section_delay = critical_section_delay
+                generators[server_id] = LoadGenerator(
+                    storage,
+                    keys=list(range(keys)),
+                    clients=clients,
+                    rate=rate,
+                    report_interval=duration,
+                    key_weights=weights,
+                )
+            reports: Dict[int, Dict[str, Any]] = {}
+
+            def run_generator(server_id: int):
+                reports[server_id] = generators[server_id].run(duration)
+
+            threads = [Thread(target=run_generator, args=(server_id,)) for server_id in generators]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return summarize(config, cluster, generators, reports)
+        finally:
+            cluster.close()
+
+
+def summarize(config: Dict[str, Any], cluster: LocalCluster, generators: Dict[int, LoadGenerator], reports: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+    acquisition_latency = Histogram()
+    lock_hold = Histogram()
+    end_to_end = Histogram()
+    for server_id, storage in cluster.storages.items():
+        acquisition_latency.merge(storage.lock_wait_histogram)
+        lock_hold.merge(storage.lock_hold_histogram)
+        end_to_end.merge(generators[server_id].end_to_end_histogram)
+
+    elapsed = max(report["elapsed"] for report in reports.values())
+    writes = sum(report["writes"] for report in reports.values())
+    messages = sum(storage.lock_messages_sent for storage in cluster.storages.values())
+    return {
+        "config": config,
+        "elapsed": elapsed,
+        "writes": writes,
+        "errors": sum(report["errors"] for report in reports.values()),
+        "throughput": writes / elapsed if elapsed > 0 else 0.0,
+        "acquisitions": acquisition_latency.count,
+        "acquisition_latency": acquisition_latency.summary(),
+        "lock_hold": lock_hold.summary(),
+        "end_to_end": end_to_end.summary(),
+        "lock_messages": messages,
+        "messages_per_acquisition": messages / acquisition_latency.count if acquisition_latency.count else 0.0,
+        "servers": {
+            server_id: {
+                "writes": report["writes"],
+                "throughput": report["throughput"],
+                "lock_messages": cluster.storages[server_id].lock_messages_sent,
+            }
+            for server_id, report in sorted(reports.items())
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a local storage cluster and measures its mutual exclusion protocol.")
+    parser.add_argument("--nodes", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=4, help="closed loop clients, or open loop threads, per server")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--keys", type=int, default=16)
+    parser.add_argument("--pattern", choices=PATTERNS, default="uniform")
+    parser.add_argument("--zipf-exponent", type=float, default=1.0)
+    parser.add_argument("--rate", type=float, default=None, help="open loop writes per second per server")
+    parser.add_argument("--mutex-algorithm", choices=("ricart_agrawala", "maekawa", "suzuki_kasami", "sharded"), default="ricart_agrawala")
+    parser.add_argument("--shard-replicas", type=int, default=3, help="servers per key with --mutex-algorithm sharded")
+    parser.add_argument("--lock-transport", choices=("unary", "stream"), default="unary")
+    parser.add_argument("--piggyback-oks", action="store_true")
+    parser.add_argument("--critical-section-delay", type=float, default=0.0, help="seconds")
+    parser.add_argument("--server-workers", type=int, default=16)
+    parser.add_argument("--output", help="JSON file to write the results to, instead of stdout")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+    results = run_benchmark(
+        nodes=args.nodes,
+        clients=args.clients,
+        duration=args.duration,
+        keys=args.keys,
+        pattern=args.pattern,
+        zipf_exponent=args.zipf_exponent,
+        rate=args.rate,
+        mutex_algorithm=args.mutex_algorithm,
+        shard_replicas=args.shard_replicas,
+        lock_transport=args.lock_transport,
+        piggyback_oks=args.piggyback_oks,
+        critical_section_delay=args.critical_section_delay,
+        server_workers=args.server_workers,
+    )
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import logging
+import time
+from threading import Event, Lock, Thread
+from typing import Dict, List
+
+import grpc
+import protobuf.service_pb2_grpc as service_pb2_grpc
+
+
+# constants
+HEALTH_CHECK_INTERVAL = 5.0
+RECONNECT_AFTER_FAILURE = 15.0
+
+
+class PeerConnection:
+    """
+    A single long-lived gRPC channel and stub to another storage server.
+    The channel connectivity state is tracked through a subscription, so the health checks never block on it.
+    """
+    def __init__(self, peer_id: int, address: str, unhealthy_since: float = None, interceptors: List = ()):
+        self.peer_id = peer_id
+        self.address = address
+        self.channel = grpc.insecure_channel(address)
+        # interceptors only wrap the stub, the connectivity subscription stays on the raw channel
+        self.stub = service_pb2_grpc.NodeCommunicationServiceStub(grpc.intercept_channel(self.channel, *interceptors))
+        self.state = grpc.ChannelConnectivity.IDLE
+        self.created_at = time.monotonic()
+        self.unhealthy_since = unhealthy_since # only a successful connection clears it
+        self.channel.subscribe(self._on_state_change, try_to_connect=True)
+
+    def _on_state_change(self, state: grpc.ChannelConnectivity):
+        if state == grpc.ChannelConnectivity.READY:
+            self.unhealthy_since = None
+        elif state != grpc.ChannelConnectivity.IDLE and self.unhealthy_since is None:
+            self.unhealthy_since = time.monotonic()
+        self.state = state
+
+    def close(self):
+        self.channel.unsubscribe(self._on_state_change)
+        self.channel.close()
+
+
+class ChannelPool:
+    """
+    Pool of persistent channels and stubs to the other storage servers, keyed by peer id.
+    Channels are created once and reused by every outgoing call.
+    A background thread checks their health and rebuilds channels that stay broken, keeping reconnection off the hot path.
+    Every call goes through the given client interceptors, e.g. to count them.
+    """
+    def __init__(self, server_id: int, addresses: Dict[int, str], health_check_interval: float = HEALTH_CHECK_INTERVAL, interceptors: List = ()):
+        self.id = server_id
+        self.health_check_interval = health_check_interval
+        self.interceptors = list(interceptors)
+        self.lock = Lock()
+        self.connections: Dict[int, PeerConnection] = {
+            peer_id: PeerConnection(peer_id, address, interceptors=self.interceptors)
+            for peer_id, address in addresses.items()
+            if peer_id != server_id
+        }
+        self.stopped = Event()
+        self.health_check_thread = Thread(target=self._health_check_loop, daemon=True)
+        self.health_check_thread.start()
+
+    def get_stub(self, peer_id: int) -> service_pb2_grpc.NodeCommunicationServiceStub:
+        """
+        Returns the shared stub for a peer.
+        """
+        with self.lock:
+            return self.connections[peer_id].stub
+
+    def unreachable_for(self, peer_id: int) -> float:
+        """
+        Returns for how many seconds the peer has been unreachable, or 0 if it is reachable or no longer in the pool.
+        """
+        with self.lock:
+            connection = self.connections.get(peer_id)
+        if connection is None or connection.unhealthy_since is None:
+            return 0.0
+        return time.monotonic() - connection.unhealthy_since
+
+    def add_peer(self, peer_id: int, address: str):
+        """
+        Opens a channel to a new peer, or to a new address of a known one.
+        """
+        with self.lock:
+            previous = self.connections.get(peer_id)
+            if previous is not None and previous.address == address:
+                return
+            self.connections[peer_id] = PeerConnection(peer_id, address, interceptors=self.interceptors)
+        if previous is not None:
+            previous.close()
+
+    def remove_peer(self, peer_id: int):
+        """
+        Closes the channel to a peer that left the cluster.
+        """
+        with self.lock:
+            connection = self.connections.pop(peer_id, None)
+        if connection is not None:
+            connection.close()
+
+    def _health_check_loop(self):
+        """
+        Periodically rebuilds channels that have been failing for longer than RECONNECT_AFTER_FAILURE.
+        gRPC already retries broken connections by itself, so rebuilding is only needed when a peer
+        comes back under a new address resolution (e.g. a restarted container).
+        """
+        while not self.stopped.wait(self.health_check_interval):
+            with self.lock:
+                connections = list(self.connections.values())
+            for connection in connections:
+                unhealthy_since = connection.unhealthy_since
+                if unhealthy_since is None or time.monotonic() - max(unhealthy_since, connection.created_at) < RECONNECT_AFTER_FAILURE:
+                    continue
+                logging.warning(f"Server {self.id} rebuilding channel to server {connection.peer_id} ({connection.state})")
+                new_connection = PeerConnection(connection.peer_id, connection.address, unhealthy_since, self.interceptors)
+                with self.lock:
+                    # the peer may have left or moved while the new channel was being opened
+                    if self.connections.get(connection.peer_id) is not connection:
+                        new_connection.close()
+                        continue
+                    self.connections[connection.peer_id] = new_connection
+                connection.close()
+
+    def close(self):
+        """
+        Stops the health check loop and closes every channel in the pool.
+        """
+        self.stopped.set()
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections = {}
+        for connection in connections:
+            connection.close()
+
+
+class AsyncChannelPool:
+    """
+    Pool of persistent grpc.aio channels and stubs to the other storage servers, keyed by peer id.
+    Channels are opened lazily on the event loop that uses them and reused by every outgoing call;
+    grpc.aio reconnects broken channels by itself.
+    """
+    def __init__(self, server_id: int, addresses: Dict[int, str]):
+        self.id = server_id
+        self.addresses = { peer_id: address for peer_id, address in addresses.items() if peer_id != server_id }
+        self.channels: Dict[int, grpc.aio.Channel] = {}
+        self.stubs: Dict[int, service_pb2_grpc.NodeCommunicationServiceStub] = {}
+        self.unhealthy_since: Dict[int, float] = {}
+
+    def get_stub(self, peer_id: int) -> service_pb2_grpc.NodeCommunicationServiceStub:
+        stub = self.stubs.get(peer_id)
+        if stub is None:
+            channel = grpc.aio.insecure_channel(self.addresses[peer_id])
+            stub = service_pb2_grpc.NodeCommunicationServiceStub(channel)
+            self.channels[peer_id] = channel
+            self.stubs[peer_id] = stub
+        return stub
+
+    def unreachable_for(self, peer_id: int) -> float:
+        """
+        Returns for how many seconds the peer has been seen unreachable, or 0 if it is reachable or was never called.
+        grpc.aio channels cannot be subscribed to, so the state is sampled on each call.
+        """
+        channel = self.channels.get(peer_id)
+        if channel is None:
+            return 0.0
+        state = channel.get_state()
+        if state == grpc.ChannelConnectivity.READY:
+            self.unhealthy_since.pop(peer_id, None)
+        elif state != grpc.ChannelConnectivity.IDLE:
+            self.unhealthy_since.setdefault(peer_id, time.monotonic())
+        unhealthy_since = self.unhealthy_since.get(peer_id)
+        return 0.0 if unhealthy_since is None else time.monotonic() - unhealthy_since
+
+    async def close(self):
+        for channel in self.channels.values():
+            await channel.close()
+        self.channels = {}
+        self.stubs = {}
@@ -0,0 +1,44 @@
+import bisect
+import hashlib
+from typing import List, Tuple
+
+
+# constants
+VIRTUAL_NODES = 64
+
+
+def _position(label: str) -> int:
+    # a stable hash, unlike hash(), so every server places keys and servers at the same positions
+    return int.from_bytes(hashlib.md5(label.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring over the servers of the cluster.
+    Each server is placed at VIRTUAL_NODES positions on the ring, so keys spread evenly and a server that joins
+    or leaves only moves about 1/N of the keys. The replica group of a key is the first servers found walking
+    the ring clockwise from the key's position.
+    """
+    def __init__(self, server_ids: List[int], virtual_nodes: int = VIRTUAL_NODES):
+        self.server_ids = sorted(server_ids)
+        self.points: List[Tuple[int, int]] = sorted( # (position, server id)
+            (_position(f"server-{server_id}-{replica}"), server_id)
+            for server_id in self.server_ids
+            for replica in range(virtual_nodes)
+        )
+        self.positions = [position for position, _ in self.points]
+
+    def replica_group(self, key: int, size: int) -> List[int]:
+        """
+        Returns the size servers that own key, the first one being its primary.
+        Every server computes the same group for a key as long as they agree on the members of the cluster.
+        """
+        size = min(size, len(self.server_ids))
+        group: List[int] = []
+        index = bisect.bisect(self.positions, _position(f"key-{key}"))
+        while len(group) < size:
+            _, server_id = self.points[index % len(self.points)]
+            if server_id not in group:
+                group.append(server_id)
+            index += 1
+        return group
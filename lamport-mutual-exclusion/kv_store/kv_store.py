@@ -0,0 +1,342 @@
+import logging
+import os
+import pickle
+import struct
+import zlib
+from threading import Condition, Lock
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+# constants
+RECORD_HEADER = struct.Struct("<II") # payload length, payload crc32
+PUT_OPERATION = 1
+DELETE_OPERATION = 2
+BATCH_OPERATION = 3
+FENCE_OPERATION = 4
+COMPACTION_MIN_DEAD_BYTES = 1 << 20
+
+
+class StaleFencingTokenError(Exception):
+    """
+    Raised when a write carries a fencing token older than one already seen for its key.
+    """
+    pass
+
+
+class KeyValueStore:
+    """
+    Embedded key-value store made of an append-only log file and an in-memory index.
+    Every write appends one record and moves one index entry, so its cost does not depend on the size of the data.
+    Each record is checksummed; on startup the log is replayed and a torn or corrupted tail left by a crash is truncated.
+    A batch of writes is a single record, so after a crash either all of its keys are stored or none of them.
+    Concurrent writers share fsync calls (group commit), and the log is compacted once most of it is dead records.
+    Writes may carry a fencing token: the store keeps the highest token seen for each key and rejects older ones,
+    so a writer whose lock lease expired cannot overwrite the writes of the next lock holder.
+    Fencing tokens are durable: a token raised without a write is logged as a fence record, and compaction keeps a
+    fence record for every key whose highest token is not carried by its live record, deleted keys included.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = Lock()
+        self.index: Dict[Hashable, Tuple[int, int, int]] = {} # key: (payload offset, payload length, record bytes charged to the key)
+        self.fencing_tokens: Dict[Hashable, int] = {} # key: highest fencing token seen
+        self.live_bytes = 0
+        self.dead_bytes = 0
+
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.write_offset = self._recover()
+
+        # group commit state, records are numbered in append order
+        self.sync_cv = Condition()
+        self.appended_records = 0
+        self.synced_records = 0
+        self.is_syncing = False
+
+    def _recover(self) -> int:
+        """
+        Rebuilds the index from the log and truncates everything after the last valid record.
+        Returns the offset where the next record will be written.
+        """
+        offset = 0
+        file_size = os.fstat(self.fd).st_size
+        while offset + RECORD_HEADER.size <= file_size:
+            length, checksum = RECORD_HEADER.unpack(os.pread(self.fd, RECORD_HEADER.size, offset))
+            payload = os.pread(self.fd, length, offset + RECORD_HEADER.size)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            record = pickle.loads(payload)
+            operation, key = record[0], record[1]
+            if operation == BATCH_OPERATION:
+                self._apply_batch_to_index(record[2], offset + RECORD_HEADER.size, length)
+            elif operation == FENCE_OPERATION:
+                self._raise_fence(key, record[3])
+                self.dead_bytes += RECORD_HEADER.size + length
+            else:
+                self._apply_to_index(operation, key, offset + RECORD_HEADER.size, length)
+                if len(record) > 3 and record[3] is not None:
+                    self._raise_fence(key, record[3])
+            offset += RECORD_HEADER.size + length
+
+        if offset < file_size:
+            logging.warning(f"Discarding {file_size - offset} bytes of incomplete records at the end of {self.path}")
+            os.ftruncate(self.fd, offset)
+            os.fsync(self.fd)
+        return offset
+
+    def _apply_to_index(self, operation: int, key: Hashable, payload_offset: int, payload_length: int, record_size: int = None):
+        if record_size is None:
+            record_size = RECORD_HEADER.size + payload_length
+        previous = self.index.pop(key, None)
+        if previous is not None:
+            self.live_bytes -= previous[2]
+            self.dead_bytes += previous[2]
+        if operation == PUT_OPERATION:
+            self.index[key] = (payload_offset, payload_length, record_size)
+            self.live_bytes += record_size
+        else:
+            self.dead_bytes += record_size
+
+    def _apply_batch_to_index(self, entries: Dict[Hashable, Tuple[Any, Optional[int]]], payload_offset: int, payload_length: int):
+        """
+        Points every key of a batch record at the record, charging each key an equal share of the record size.
+        """
+        share, remainder = divmod(RECORD_HEADER.size + payload_length, len(entries))
+        for position, (key, (_, fencing_token)) in enumerate(entries.items()):
+            self._apply_to_index(PUT_OPERATION, key, payload_offset, payload_length, share + (1 if position < remainder else 0))
+            if fencing_token is not None:
+                self._raise_fence(key, fencing_token)
+
+    def _raise_fence(self, key: Hashable, fencing_token: int):
+        if key not in self.fencing_tokens or fencing_token > self.fencing_tokens[key]:
+            self.fencing_tokens[key] = fencing_token
+
+    def _append(self, operation: int, key: Hashable, value: Any, fencing_token: Optional[int] = None) -> int:
+        """
+        Appends one record to the log and updates the index. Must be called with self.lock held.
+        Returns the sequence number of the record, to be passed to _sync.
+        """
+        payload = pickle.dumps((operation, key, value, fencing_token), protocol=pickle.HIGHEST_PROTOCOL)
+        payload_offset = self._write_record(payload)
+        self._apply_to_index(operation, key, payload_offset, len(payload))
+        return self.appended_records
+
+    def _append_batch(self, entries: Dict[Hashable, Tuple[Any, Optional[int]]]) -> int:
+        """
+        Appends one record holding every (value, fencing token) of entries and updates the index. Must be called with self.lock held.
+        Returns the sequence number of the record, to be passed to _sync.
+        """
+        payload = pickle.dumps((BATCH_OPERATION, None, entries, None), protocol=pickle.HIGHEST_PROTOCOL)
+        payload_offset = self._write_record(payload)
+        self._apply_batch_to_index(entries, payload_offset, len(payload))
+        return self.appended_records
+
+    def _write_record(self, payload: bytes) -> int:
+        """
+        Writes a checksummed record at the end of the log. Must be called with self.lock held.
+        Returns the offset of the payload.
+        """
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        os.pwrite(self.fd, record, self.write_offset)
+        payload_offset = self.write_offset + RECORD_HEADER.size
+        self.write_offset += len(record)
+        self.appended_records += 1
+        return payload_offset
+
+    def _sync(self, record_number: int):
+        """
+        Waits until the log is durable up to the given record.
+        Only one thread calls fsync at a time, and a single fsync covers every record appended before it started.
+        """
+        with self.sync_cv:
+            while self.synced_records < record_number:
+                if self.is_syncing:
+                    self.sync_cv.wait()
+                    continue
+                self.is_syncing = True
+                with self.lock:
+                    fd, target_record = self.fd, self.appended_records
+                self.sync_cv.release()
+                try:
+                    os.fsync(fd)
+                finally:
+                    self.sync_cv.acquire()
+                    self.is_syncing = False
+                    self.synced_records = max(self.synced_records, target_record)
+                    self.sync_cv.notify_all()
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Point read of a key. Raises KeyError if the key is not stored.
+        """
+        with self.lock:
+            payload_offset, payload_length, _ = self.index[key]
+            payload = os.pread(self.fd, payload_length, payload_offset)
+        return self._decode(payload, key)[0]
+
+    def get_with_token(self, key: Hashable) -> Tuple[Any, Optional[int]]:
+        """
+        Point read of a key that also returns the fencing token its value was written with, None if it had none.
+        Raises KeyError if the key is not stored.
+        """
+        with self.lock:
+            payload_offset, payload_length, _ = self.index[key]
+            payload = os.pread(self.fd, payload_length, payload_offset)
+        return self._decode(payload, key)
+
+    @staticmethod
+    def _decode(payload: bytes, key: Hashable) -> Tuple[Any, Optional[int]]:
+        """
+        Returns the value and fencing token that the record in payload holds for key.
+        """
+        record = pickle.loads(payload)
+        if record[0] == BATCH_OPERATION:
+            return record[2][key]
+        return record[2], (record[3] if len(record) > 3 else None)
+
+    def put(self, key: Hashable, value: Any, sync: bool = True, fencing_token: Optional[int] = None):
+        """
+        Stores value under key. With sync=True, returns only after the record is on disk.
+        Raises StaleFencingTokenError if fencing_token is lower than the highest token seen for key.
+        """
+        with self.lock:
+            if fencing_token is not None:
+                self._check_fence(key, fencing_token)
+                self._raise_fence(key, fencing_token)
+            record_number = self._append(PUT_OPERATION, key, value, fencing_token)
+        if sync:
+            self._sync(record_number)
+        self._compact_if_needed()
+
+    def put_many(self, items: Dict[Hashable, Any], sync: bool = True, fencing_tokens: Dict[Hashable, int] = None):
+        """
+        Stores several values as one batch record, written with a single fsync.
+        Every fencing token is checked before anything is written, so a stale token rejects the whole batch,
+        and the record is checksummed as a whole, so a crash during the call keeps all of the batch or none of it.
+        """
+        if not items:
+            return
+        fencing_tokens = fencing_tokens or {}
+        with self.lock:
+            for key, fencing_token in fencing_tokens.items():
+                self._check_fence(key, fencing_token)
+            record_number = self._append_batch({ key: (value, fencing_tokens.get(key)) for key, value in items.items() })
+        if sync:
+            self._sync(record_number)
+        self._compact_if_needed()
+
+    def _check_fence(self, key: Hashable, fencing_token: int):
+        highest_token = self.fencing_tokens.get(key)
+        if highest_token is not None and fencing_token < highest_token:
+            raise StaleFencingTokenError(f"Fencing token {fencing_token} for key {key} is older than {highest_token}")
+
+    def fence(self, key: Hashable, fencing_token: int, sync: bool = True):
+        """
+        Records that a lock holder with fencing_token exists for key, without writing a value,
+        so writes with older tokens are rejected from now on, also after a restart.
+        A fence record is only appended if the token is higher than the one already seen.
+        """
+        with self.lock:
+            highest_token = self.fencing_tokens.get(key)
+            if highest_token is not None and fencing_token <= highest_token:
+                return
+            self._raise_fence(key, fencing_token)
+            payload = pickle.dumps((FENCE_OPERATION, key, None, fencing_token), protocol=pickle.HIGHEST_PROTOCOL)
+            self._write_record(payload)
+            # superseded by the next write or fence of the key, compaction keeps a single fence record if needed
+            self.dead_bytes += RECORD_HEADER.size + len(payload)
+            record_number = self.appended_records
+        if sync:
+            self._sync(record_number)
+        self._compact_if_needed()
+
+    def highest_fencing_token(self) -> int:
+        with self.lock:
+            return max(self.fencing_tokens.values(), default=0)
+
+    def delete(self, key: Hashable, sync: bool = True):
+        with self.lock:
+            if key not in self.index:
+                raise KeyError(key)
+            record_number = self._append(DELETE_OPERATION, key, None)
+        if sync:
+            self._sync(record_number)
+        self._compact_if_needed()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.lock:
+            return key in self.index
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.index)
+
+    def items(self) -> Dict[Hashable, Any]:
+        """
+        Returns a snapshot of every stored key and value.
+        """
+        with self.lock:
+            keys = list(self.index)
+        return { key: self.get(key) for key in keys if key in self }
+
+    def _compact_if_needed(self):
+        with self.lock:
+            needs_compaction = self.dead_bytes > COMPACTION_MIN_DEAD_BYTES and self.dead_bytes > self.live_bytes
+        if needs_compaction:
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrites the log with only the live records and atomically replaces the old file.
+        Keys written by a batch record are rewritten as records of their own, and a fence record is written for
+        every key whose highest fencing token is not the one of its live record, so no token is lost.
+        """
+        compacted_path = f"{self.path}.compact"
+        with self.sync_cv:
+            self.sync_cv.wait_for(lambda: not self.is_syncing)
+            with self.lock:
+                compacted_fd = os.open(compacted_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+                compacted_index: Dict[Hashable, Tuple[int, int, int]] = {}
+                live_tokens: Dict[Hashable, Optional[int]] = {}
+                offset = 0
+                for key, (payload_offset, payload_length, _) in self.index.items():
+                    payload = os.pread(self.fd, payload_length, payload_offset)
+                    value, live_tokens[key] = self._decode(payload, key)
+                    if pickle.loads(payload)[0] == BATCH_OPERATION:
+                        payload = pickle.dumps((PUT_OPERATION, key, value, live_tokens[key]), protocol=pickle.HIGHEST_PROTOCOL)
+                    record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+                    os.pwrite(compacted_fd, record, offset)
+                    compacted_index[key] = (offset + RECORD_HEADER.size, len(payload), len(record))
+                    offset += len(record)
+                for key, fencing_token in self.fencing_tokens.items():
+                    if live_tokens.get(key) == fencing_token:
+                        continue
+                    payload = pickle.dumps((FENCE_OPERATION, key, None, fencing_token), protocol=pickle.HIGHEST_PROTOCOL)
+                    record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+                    os.pwrite(compacted_fd, record, offset)
+                    offset += len(record)
+                os.fsync(compacted_fd)
+                os.replace(compacted_path, self.path)
+                self._fsync_directory()
+
+                os.close(self.fd)
+                self.fd = compacted_fd
+                self.index = compacted_index
+                self.write_offset = offset
+                self.synced_records = self.appended_records
+                self.live_bytes = offset
+                self.dead_bytes = 0
+        logging.info(f"Compacted {self.path} to {offset} bytes")
+
+    def _fsync_directory(self):
+        directory_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+    def close(self):
+        with self.sync_cv:
+            self.sync_cv.wait_for(lambda: not self.is_syncing)
+            with self.lock:
+                os.fsync(self.fd)
+                os.close(self.fd)
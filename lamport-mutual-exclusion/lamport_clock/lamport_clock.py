@@ -1,16 +1,24 @@
+from threading import Lock
+
 
 class LamportClock:
+    """
+    Lamport logical clock. Safe to use from several threads.
+    """
     def __init__(self):
         self.clock = 0
+        self.lock = Lock()
 
     def tick(self):
-        self.clock += 1
+        with self.lock:
+            self.clock += 1
 
     def update_clock(self, received_clock):
-        if received_clock > self.clock:
-            self.clock = received_clock + 1
-        else:
-            self.clock += 1
+        with self.lock:
+            if received_clock > self.clock:
+                self.clock = received_clock + 1
+            else:
+                self.clock += 1
 
     def get_clock(self):
         return self.clock
@@ -0,0 +1,134 @@
+import logging
+import random
+import time
+from concurrent import futures
+from threading import Event, Lock, Thread
+from typing import Any, Dict, List
+
+from kv_store.kv_store import StaleFencingTokenError
+from metrics.histogram import Histogram
+from storage.storage import LeaseExpiredError, Storage
+
+
+# constants
+REPORT_INTERVAL = 10.0
+
+
+class LoadGenerator:
+    """
+    Drives Storage.set_value as fast as the mutual exclusion protocol allows, in one of two modes:
+    - closed loop (rate=None): each of the clients threads starts a new write as soon as its previous one finished;
+    - open loop: writes are started at a fixed rate per second on a pool of clients threads. Latency is measured
+      from the time each write was scheduled, so writes queued behind a slow protocol count as slow too.
+    Keys are picked uniformly, or following key_weights if given.
+    Records the end-to-end latency of each write; lock wait and hold times come from the storage histograms.
+    A write that fails for any reason is logged and counted in errors, and the load goes on.
+    """
+    def __init__(
+        self,
+        storage: Storage,
+        keys: List[int],
+        clients: int,
+        rate: float = None,
+        report_interval: float = REPORT_INTERVAL,
+        key_weights: List[float] = None,
+    ):
+        self.storage = storage
+        self.keys = keys
+        self.key_weights = key_weights
+        self.clients = clients
+        self.rate = rate
+        self.report_interval = report_interval
+        self.end_to_end_histogram = Histogram()
+        self.lock = Lock()
+        self.writes = 0
+        self.errors = 0
+        self.stopped = Event()
+        self.started_at = None
+
+    def _write(self, scheduled_at: float):
+        key = random.choices(self.keys, weights=self.key_weights)[0]
+        try:
+            self.storage.set_value(key, random.randint(1, 10))
+        except (LeaseExpiredError, StaleFencingTokenError) as e:
+            logging.error(f"Server {self.storage.id} load generator write of key {key} was rejected: {e}")
+            with self.lock:
+                self.errors += 1
+            return
+        except Exception as e:
+            # anything else, e.g. a peer error while replicating, must neither end a closed-loop client thread
+            # nor vanish inside an open-loop future
+            logging.exception(f"Server {self.storage.id} load generator write of key {key} failed: {e}")
+            with self.lock:
+                self.errors += 1
+            return
+        self.end_to_end_histogram.record(time.monotonic() - scheduled_at)
+        with self.lock:
+            self.writes += 1
+
+    def _run_client(self):
+        while not self.stopped.is_set():
+            self._write(time.monotonic())
+
+    def _run_scheduler(self, executor: futures.ThreadPoolExecutor):
+        interval = 1.0 / self.rate
+        next_write_at = time.monotonic()
+        while not self.stopped.is_set():
+            delay = next_write_at - time.monotonic()
+            if delay > 0 and self.stopped.wait(delay):
+                break
+            executor.submit(self._write, next_write_at)
+            next_write_at += interval
+
+    def run(self, duration: float = None) -> Dict[str, Any]:
+        """
+        Generates load for duration seconds, or until stop is called if duration is None, logging a report
+        every report_interval seconds. Returns the final report.
+        """
+        self.started_at = time.monotonic()
+        executor = None
+        if self.rate is None:
+            threads = [Thread(target=self._run_client, daemon=True) for _ in range(self.clients)]
+        else:
+            executor = futures.ThreadPoolExecutor(max_workers=self.clients)
+            threads = [Thread(target=self._run_scheduler, args=(executor,), daemon=True)]
+        for thread in threads:
+            thread.start()
+
+        deadline = None if duration is None else self.started_at + duration
+        while not self.stopped.is_set():
+            wait = self.report_interval if deadline is None else min(self.report_interval, deadline - time.monotonic())
+            if wait <= 0 or self.stopped.wait(wait):
+                break
+            logging.info(f"Server {self.storage.id} load report: {self.report()}")
+        self.stop()
+        for thread in threads:
+            thread.join()
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        report = self.report()
+        logging.info(f"Server {self.storage.id} final load report: {report}")
+        return report
+
+    def stop(self):
+        self.stopped.set()
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Returns the throughput so far and the end-to-end, lock wait and lock hold latency summaries, in seconds.
+        """
+        elapsed = time.monotonic() - self.started_at
+        with self.lock:
+            writes, errors = self.writes, self.errors
+        return {
+            "mode": "closed" if self.rate is None else "open",
+            "clients": self.clients,
+            "target_rate": self.rate,
+            "elapsed": elapsed,
+            "writes": writes,
+            "errors": errors,
+            "throughput": writes / elapsed if elapsed > 0 else 0.0,
+            "end_to_end": self.end_to_end_histogram.summary(),
+            "lock_wait": self.storage.lock_wait_histogram.summary(),
+            "lock_hold": self.storage.lock_hold_histogram.summary(),
+        }
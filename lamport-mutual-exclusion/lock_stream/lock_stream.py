@@ -0,0 +1,289 @@
+import logging
+from collections import OrderedDict
+from threading import Condition, Event, Lock, Thread
+from typing import Callable, Dict, Iterator, List
+
+import grpc
+import protobuf.service_pb2 as service_pb2
+
+from channel_pool.channel_pool import ChannelPool
+
+
+# constants
+MAX_BATCH_SIZE = 256
+STREAM_IDLE_TIMEOUT = 1.0
+STREAM_RETRY_INTERVAL = 1.0
+RESERVED_UNARY_WORKERS = 4 # workers of a threaded server that accepted lock streams never take, so unary calls always get one
+
+MessagesHandler = Callable[[int, List[service_pb2.LockMessage]], None]
+
+
+def lock_stream_server_workers(peers: int, server_workers: int) -> int:
+    """
+    Returns how many workers a threaded gRPC server needs to accept a lock stream from each of peers servers and
+    still answer unary calls: every accepted stream holds one worker for its whole life.
+    That is server_workers, raised if it is too small.
+    """
+    return max(server_workers, peers + RESERVED_UNARY_WORKERS)
+
+
+class LockStream:
+    """
+    State of one open stream in one direction: the messages waiting to be sent, the batches sent but not yet
+    acknowledged by the peer, and the event that stops it.
+    Every batch carries a sequence number, and every batch going the other way acknowledges the highest one
+    handled so far, so the batches lost when the stream breaks are exactly those still unacknowledged.
+    """
+    def __init__(self):
+        self.cv = Condition()
+        self.outgoing: List[service_pb2.LockMessage] = []
+        self.unacked: "OrderedDict[int, List[service_pb2.LockMessage]]" = OrderedDict() # sequence: messages
+        self.sent_sequence = 0
+        self.received_sequence = 0 # highest sequence handled from the peer
+        self.acked_sequence = 0 # highest sequence of the peer acknowledged back to it
+        self.stopped = Event()
+
+    def put(self, message: service_pb2.LockMessage) -> bool:
+        """
+        Queues a message. Returns False if the stream was already stopped.
+        """
+        with self.cv:
+            if self.stopped.is_set():
+                return False
+            self.outgoing.append(message)
+            self.cv.notify()
+            return True
+
+    def batches(self) -> Iterator[service_pb2.LockBatch]:
+        """
+        Yields the queued messages in batches: everything queued while the previous batch was being sent goes in the next one.
+        A batch without messages is sent to acknowledge the peer's batches when there is nothing else to send.
+        """
+        while True:
+            with self.cv:
+                self.cv.wait_for(
+                    lambda: self.stopped.is_set() or self.outgoing or self.received_sequence > self.acked_sequence,
+                    timeout=STREAM_IDLE_TIMEOUT,
+                )
+                if self.stopped.is_set():
+                    return
+                if not self.outgoing and self.received_sequence == self.acked_sequence:
+                    continue
+                batch = service_pb2.LockBatch(ack=self.received_sequence)
+                self.acked_sequence = self.received_sequence
+                if self.outgoing:
+                    messages = self.outgoing[:MAX_BATCH_SIZE]
+                    del self.outgoing[:MAX_BATCH_SIZE]
+                    self.sent_sequence += 1
+                    self.unacked[self.sent_sequence] = messages
+                    batch.sequence = self.sent_sequence
+                    batch.messages.extend(messages)
+            yield batch
+
+    def acknowledge_received(self, sequence: int):
+        """
+        Records that the peer's batch with this sequence was handled, so the next batch acknowledges it.
+        """
+        with self.cv:
+            self.received_sequence = max(self.received_sequence, sequence)
+            self.cv.notify()
+
+    def acknowledge_sent(self, ack: int):
+        """
+        Forgets the batches the peer acknowledged.
+        """
+        with self.cv:
+            while self.unacked and next(iter(self.unacked)) <= ack:
+                self.unacked.popitem(last=False)
+
+    def stop(self) -> List[service_pb2.LockMessage]:
+        """
+        Stops the stream and returns the messages the peer may not have received: the unacknowledged ones, then the queued ones.
+        Returns nothing if the stream was already stopped.
+        """
+        with self.cv:
+            if self.stopped.is_set():
+                return []
+            self.stopped.set()
+            undelivered = [message for messages in self.unacked.values() for message in messages] + self.outgoing
+            self.unacked.clear()
+            self.outgoing = []
+            self.cv.notify_all()
+            return undelivered
+
+
+class LockStreamLink:
+    """
+    The bidirectional ExchangeLockMessages stream between this server and a peer.
+    The server with the lower id opens the stream and the other one accepts it, so each pair of servers shares
+    a single stream and frames flow both ways on it.
+    When the stream breaks, every message the peer did not acknowledge goes to on_undelivered, so nothing handed
+    to the stream is lost; a message may then arrive twice, which the lock protocols tolerate.
+    """
+    def __init__(self, server_id: int, peer_id: int, on_messages: MessagesHandler, on_undelivered: MessagesHandler):
+        self.id = server_id
+        self.peer_id = peer_id
+        self.on_messages = on_messages
+        self.on_undelivered = on_undelivered
+        self.lock = Lock()
+        self.active_stream: LockStream = None
+        self.closed = Event()
+
+    def is_connected(self) -> bool:
+        with self.lock:
+            return self.active_stream is not None
+
+    def send(self, message: service_pb2.LockMessage) -> bool:
+        """
+        Queues a message on the stream. Returns False if the stream is down and the message must be sent in another way.
+        """
+        with self.lock:
+            stream = self.active_stream
+        return stream is not None and stream.put(message)
+
+    def _attach(self, stream: LockStream):
+        with self.lock:
+            previous_stream = self.active_stream
+            self.active_stream = stream
+        if previous_stream is not None:
+            self._detach(previous_stream)
+
+    def _detach(self, stream: LockStream):
+        """
+        Stops a stream and hands every message that the peer did not acknowledge to on_undelivered.
+        """
+        with self.lock:
+            if self.active_stream is stream:
+                self.active_stream = None
+        undelivered = stream.stop()
+        if undelivered:
+            logging.warning(f"Server {self.id} lock stream to server {self.peer_id} is down, {len(undelivered)} messages fall back to unary calls")
+            self.on_undelivered(self.peer_id, undelivered)
+
+    def _read_batches(self, batches: Iterator[service_pb2.LockBatch], stream: LockStream):
+        try:
+            for batch in batches:
+                if batch.ack:
+                    stream.acknowledge_sent(batch.ack)
+                if batch.sequence:
+                    self.on_messages(self.peer_id, list(batch.messages))
+                    stream.acknowledge_received(batch.sequence)
+        except grpc.RpcError as e:
+            # on the accepting side the request iterator raises a bare RpcError, without a status code
+            if not self.closed.is_set():
+                error = e.code() if isinstance(e, grpc.Call) else "stream closed"
+                logging.error(f"Server {self.id} lock stream with server {self.peer_id} failed. Error: {error}")
+        finally:
+            self._detach(stream)
+
+    def run_client(self, channel_pool: ChannelPool):
+        """
+        Keeps a stream open to the peer, reopening it after failures. Runs on its own thread.
+        Messages are only routed to the stream once the peer has accepted it.
+        """
+        while not self.closed.is_set():
+            stream = LockStream()
+            stub = channel_pool.get_stub(self.peer_id)
+            responses = stub.ExchangeLockMessages(stream.batches(), metadata=(("server-id", str(self.id)),), wait_for_ready=True)
+            try:
+                responses.initial_metadata()
+            except grpc.RpcError as e:
+                logging.error(f"Server {self.id} could not open lock stream to server {self.peer_id}. Error: {e.code()}")
+                stream.stop()
+            else:
+                logging.info(f"Server {self.id} opened lock stream to server {self.peer_id}")
+                self._attach(stream)
+                self._read_batches(responses, stream)
+            self.closed.wait(STREAM_RETRY_INTERVAL)
+
+    def serve(self, request_iterator: Iterator[service_pb2.LockBatch], context: grpc.ServicerContext) -> Iterator[service_pb2.LockBatch]:
+        """
+        Accepts the stream opened by the peer. Incoming batches are read on a separate thread
+        while the returned iterator feeds outgoing batches to the response stream.
+        """
+        stream = LockStream()
+        context.send_initial_metadata((("server-id", str(self.id)),))
+        context.add_callback(lambda: self._detach(stream))
+        self._attach(stream)
+        logging.info(f"Server {self.id} accepted lock stream from server {self.peer_id}")
+        Thread(target=self._read_batches, args=(request_iterator, stream), daemon=True).start()
+        return stream.batches()
+
+    def close(self):
+        self.closed.set()
+        with self.lock:
+            stream = self.active_stream
+        if stream is not None:
+            self._detach(stream)
+
+
+class LockStreams:
+    """
+    The lock streams of this server with every peer, added and removed as peers join and leave the cluster.
+    With server_workers, the size of the thread pool of the gRPC server, at most server_workers - RESERVED_UNARY_WORKERS
+    streams are accepted, since each one holds a worker; the peers refused keep their link on unary calls and retry.
+    """
+    def __init__(
+        self,
+        server_id: int,
+        peer_ids: List[int],
+        channel_pool: ChannelPool,
+        on_messages: MessagesHandler,
+        on_undelivered: MessagesHandler,
+        server_workers: int = None,
+    ):
+        self.id = server_id
+        self.channel_pool = channel_pool
+        self.on_messages = on_messages
+        self.on_undelivered = on_undelivered
+        self.max_accepted_streams = None if server_workers is None else max(server_workers - RESERVED_UNARY_WORKERS, 0)
+        self.accepted_streams = 0
+        self.accepted_streams_lock = Lock()
+        self.links: Dict[int, LockStreamLink] = {}
+        for peer_id in peer_ids:
+            self.add_peer(peer_id)
+
+    def add_peer(self, peer_id: int):
+        """
+        Adds the stream with a peer, opening it if this server has the lower id.
+        """
+        if peer_id == self.id or peer_id in self.links:
+            return
+        link = LockStreamLink(self.id, peer_id, self.on_messages, self.on_undelivered)
+        self.links = { **self.links, peer_id: link }
+        if self.id < peer_id:
+            Thread(target=link.run_client, args=(self.channel_pool,), daemon=True).start()
+
+    def remove_peer(self, peer_id: int):
+        """
+        Closes the stream with a peer that left the cluster.
+        """
+        links = dict(self.links)
+        link = links.pop(peer_id, None)
+        self.links = links
+        if link is not None:
+            link.close()
+
+    def send(self, peer_id: int, message: service_pb2.LockMessage) -> bool:
+        link = self.links.get(peer_id)
+        return link is not None and link.send(message)
+
+    def serve(self, request_iterator, context) -> Iterator[service_pb2.LockBatch]:
+        peer_id = dict(context.invocation_metadata()).get("server-id")
+        if peer_id is None or int(peer_id) not in self.links:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "unknown lock stream peer")
+        with self.accepted_streams_lock:
+            if self.max_accepted_streams is not None and self.accepted_streams >= self.max_accepted_streams:
+                logging.warning(f"Server {self.id} refused lock stream from server {peer_id}, {self.accepted_streams} streams already hold server workers")
+                context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "no server worker left for another lock stream")
+            self.accepted_streams += 1
+        context.add_callback(self._stream_ended)
+        return self.links[int(peer_id)].serve(request_iterator, context)
+
+    def _stream_ended(self):
+        with self.accepted_streams_lock:
+            self.accepted_streams -= 1
+
+    def close(self):
+        for link in self.links.values():
+            link.close()
@@ -0,0 +1,247 @@
+from enum import Enum
+from threading import Condition, Lock
+from typing import Callable, Dict, List, Set
+
+import protobuf.service_pb2 as service_pb2
+
+from lamport_clock.lamport_clock import LamportClock
+
+
+# constants
+FENCING_SERVER_ID_RANGE = 1 << 16
+
+
+def fencing_token(timestamp: int, server_id: int) -> int:
+    """
+    Packs the Lamport timestamp at which a server got a lock and the server id into one fencing token.
+    Conflicting critical sections happen in (timestamp, server id) order, so their tokens only grow.
+    """
+    return timestamp * FENCING_SERVER_ID_RANGE + server_id
+
+
+class KeyState(Enum):
+    RELEASED = 1
+    WANTED = 2
+    HELD = 3
+
+
+class PendingRequest:
+    """
+    Completion primitive for one resource request, keyed by the request Lamport timestamp.
+    Ok messages are recorded per server, so a duplicated ok is only counted once.
+    """
+    def __init__(self, key: int, request_time: int, required_servers: Set[int]):
+        self.key = key
+        self.request_time = request_time
+        self.required_servers = set(required_servers)
+        self.received_ok: Set[int] = set()
+        self.cv = Condition()
+
+    def add_ok(self, server_id: int):
+        with self.cv:
+            self.received_ok.add(server_id)
+            self.cv.notify_all()
+
+    def add_required_server(self, server_id: int) -> bool:
+        """
+        Also waits for an ok from a server that joined the cluster while the request was pending.
+        Returns False if the request was already complete, so the server does not need to be asked.
+        """
+        with self.cv:
+            if self.is_complete():
+                return False
+            self.required_servers.add(server_id)
+            return True
+
+    def set_required_servers(self, server_ids: Set[int]):
+        """
+        Replaces the servers to wait for, before the request has been sent to any of them.
+        """
+        with self.cv:
+            self.required_servers = set(server_ids)
+            self.cv.notify_all()
+
+    def remove_required_server(self, server_id: int):
+        """
+        Stops waiting for an ok from a server that left the cluster.
+        """
+        with self.cv:
+            self.required_servers.discard(server_id)
+            self.cv.notify_all()
+
+    def is_complete(self) -> bool:
+        return self.required_servers <= self.received_ok
+
+    def missing_servers(self) -> Set[int]:
+        with self.cv:
+            return self.required_servers - self.received_ok
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Blocks until every required server has sent an ok message.
+        """
+        with self.cv:
+            return self.cv.wait_for(self.is_complete, timeout=timeout)
+
+
+class KeyLock:
+    """
+    Ricart-Agrawala state of a single key on this server.
+    """
+    def __init__(self, key: int, table_lock: Lock):
+        self.key = key
+        self.state = KeyState.RELEASED
+        self.request_time = 0
+        self.pending_request: PendingRequest = None
+        self.deferred: List[service_pb2.UsageRequest] = []
+        # set once the lease of the held key expired, from then on requests are granted as if it was released
+        self.lease_expired = False
+        # local threads waiting for this server to release the key
+        self.waiters = 0
+        self.waiters_cv = Condition(table_lock)
+
+
+class LockTable:
+    """
+    Lock table keyed by the UsageRequest.key field.
+    Every key has its own Lamport request time, deferred reply queue and local waiter set,
+    so the server can hold and request many keys at once and unrelated keys never block each other.
+    Methods only update state; sending messages is left to the caller.
+    The pending request factory lets callers choose how a request is waited on (threads or asyncio).
+    """
+    def __init__(
+        self,
+        server_id: int,
+        lamport_clock: LamportClock,
+        pending_request_factory: Callable[[int, int, Set[int]], PendingRequest] = PendingRequest,
+    ):
+        self.id = server_id
+        self.lamport_clock = lamport_clock
+        self.pending_request_factory = pending_request_factory
+        self.lock = Lock()
+        self.keys: Dict[int, KeyLock] = {}
+
+    def _get_key_lock(self, key: int) -> KeyLock:
+        key_lock = self.keys.get(key)
+        if key_lock is None:
+            key_lock = KeyLock(key, self.lock)
+            self.keys[key] = key_lock
+        return key_lock
+
+    def _discard_if_unused(self, key_lock: KeyLock):
+        if key_lock.state == KeyState.RELEASED and key_lock.waiters == 0 and not key_lock.deferred:
+            self.keys.pop(key_lock.key, None)
+
+    def begin_request(self, key: int, required_servers: Set[int]) -> PendingRequest:
+        """
+        Marks the key as wanted and stamps the request with the Lamport clock.
+        If another local thread already wants or holds the key, waits for it to release the key first.
+        """
+        with self.lock:
+            key_lock = self._get_key_lock(key)
+            key_lock.waiters += 1
+            key_lock.waiters_cv.wait_for(lambda: key_lock.state == KeyState.RELEASED)
+            key_lock.waiters -= 1
+
+            self.lamport_clock.tick()
+            key_lock.state = KeyState.WANTED
+            key_lock.lease_expired = False
+            key_lock.request_time = self.lamport_clock.get_clock()
+            key_lock.pending_request = self.pending_request_factory(key, key_lock.request_time, required_servers)
+            return key_lock.pending_request
+
+    def mark_held(self, key: int):
+        with self.lock:
+            key_lock = self.keys[key]
+            key_lock.state = KeyState.HELD
+            key_lock.pending_request = None
+
+    def release(self, key: int) -> List[service_pb2.UsageRequest]:
+        """
+        Releases the key and returns the requests that were deferred while it was wanted or held.
+        The caller must answer each of them with an ok message.
+        """
+        with self.lock:
+            key_lock = self.keys[key]
+            deferred = key_lock.deferred
+            key_lock.deferred = []
+            key_lock.state = KeyState.RELEASED
+            key_lock.lease_expired = False
+            key_lock.pending_request = None
+            key_lock.waiters_cv.notify()
+            self._discard_if_unused(key_lock)
+            return deferred
+
+    def receive_request(self, request: service_pb2.UsageRequest) -> bool:
+        """
+        Updates the Lamport clock with a request from another server and decides how to answer it.
+        Returns True if the request can be answered with an ok now, or False if it was deferred
+        because this server holds the key or wants it with an earlier (timestamp, server id).
+        A request that already got every ok it waits for counts as held: a server that joined after it was sent
+        was never asked, so it must not be let in first. A held key whose lease expired no longer defers anything.
+        A request sent again while it is deferred is only deferred once.
+        """
+        with self.lock:
+            self.lamport_clock.update_clock(request.lamport_timestamp)
+            self.lamport_clock.tick()
+
+            key_lock = self.keys.get(request.key)
+            if key_lock is None or key_lock.state == KeyState.RELEASED:
+                return True
+            if key_lock.state == KeyState.HELD and key_lock.lease_expired:
+                return True
+            if (
+                key_lock.state == KeyState.WANTED
+                and not key_lock.pending_request.is_complete()
+                and (request.lamport_timestamp, request.server_id) < (key_lock.request_time, self.id)
+            ):
+                return True
+            if not any(
+                deferred.server_id == request.server_id and deferred.lamport_timestamp == request.lamport_timestamp
+                for deferred in key_lock.deferred
+            ):
+                key_lock.deferred.append(request)
+            return False
+
+    def expire_lease(self, key: int, request_time: int) -> List[service_pb2.UsageRequest]:
+        """
+        Gives up the permissions this server holds on key after the lease of its request made at request_time expired,
+        even if it is still in the critical section: its writes are refused from then on by the lease check and the
+        fencing tokens. Returns the requests deferred so far, which the caller must answer with an ok message.
+        """
+        with self.lock:
+            key_lock = self.keys.get(key)
+            if key_lock is None or key_lock.state != KeyState.HELD or key_lock.request_time != request_time:
+                return []
+            key_lock.lease_expired = True
+            deferred = key_lock.deferred
+            key_lock.deferred = []
+            return deferred
+
+    def queue_depth(self) -> int:
+        """
+        Returns how many requests are waiting on this server: deferred requests of other servers and local threads
+        waiting for another one to release a key.
+        """
+        with self.lock:
+            return sum(len(key_lock.deferred) + key_lock.waiters for key_lock in self.keys.values())
+
+    def pending_requests(self) -> List[PendingRequest]:
+        """
+        Returns the requests of this server that are still waiting for ok messages.
+        """
+        with self.lock:
+            return [key_lock.pending_request for key_lock in self.keys.values() if key_lock.pending_request is not None]
+
+    def receive_ok(self, key: int, request_time: int, server_id: int) -> bool:
+        """
+        Records an ok message for this server's request on key made at request_time.
+        Returns False if no such request is pending.
+        """
+        with self.lock:
+            key_lock = self.keys.get(key)
+            if key_lock is None or key_lock.pending_request is None or key_lock.request_time != request_time:
+                return False
+            pending_request = key_lock.pending_request
+        pending_request.add_ok(server_id)
+        return True
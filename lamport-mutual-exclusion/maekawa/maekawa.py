@@ -0,0 +1,286 @@
+import heapq
+import logging
+import math
+from threading import Condition, Lock
+from typing import Callable, Dict, List, Set, Tuple
+
+import protobuf.service_pb2 as service_pb2
+
+from lamport_clock.lamport_clock import LamportClock
+
+
+Priority = Tuple[int, int] # (request lamport timestamp, server id), lower goes first
+Outgoing = List[Tuple[int, service_pb2.LockMessage]]
+
+
+def grid_quorum(server_ids: List[int], server_id: int) -> Set[int]:
+    """
+    Places the servers row by row on a ceil(sqrt(N)) wide grid and returns the row and column of server_id.
+    Any two such quorums intersect, and each one has about 2*sqrt(N) servers.
+    """
+    ordered_ids = sorted(server_ids)
+    width = math.ceil(math.sqrt(len(ordered_ids)))
+    position = ordered_ids.index(server_id)
+    row, column = divmod(position, width)
+    return {
+        other_id
+        for other_position, other_id in enumerate(ordered_ids)
+        if other_position // width == row or other_position % width == column
+    }
+
+
+class Vote:
+    """
+    Voter side state of one key: the request this server voted for and the requests waiting for its vote.
+    """
+    def __init__(self):
+        self.voted_for: Priority = None
+        self.queue: List[Priority] = []
+        self.inquired = False
+        self.failed_sent: Set[Priority] = set()
+
+
+class QuorumRequest:
+    """
+    Requester side state of one key.
+    """
+    def __init__(self, request_time: int, quorum: Set[int]):
+        self.request_time = request_time
+        self.quorum = quorum
+        self.granted: Set[int] = set()
+        self.failed = False
+        self.deferred_inquiries: Set[int] = set()
+        self.in_critical_section = False
+
+
+class MaekawaEngine:
+    """
+    Maekawa mutual exclusion over grid quorums, with the inquire/relinquish messages that avoid deadlocks.
+    A server enters the critical section for a key once every member of its quorum voted for it,
+    so each entry costs about 3*sqrt(N) messages (request, locked, release) instead of 2(N-1).
+    Each server holds one vote per key; a vote given to a request with lower priority is reclaimed with an inquire.
+    With quorum_for, the quorum depends on the key instead: every requester of a key asks the same servers,
+    e.g. the replica group of the key's shard, so a key's lock traffic stays within those servers.
+    """
+    def __init__(
+        self,
+        server_id: int,
+        server_ids: List[int],
+        lamport_clock: LamportClock,
+        send: Callable[[int, service_pb2.LockMessage], None],
+        quorum_for: Callable[[int], Set[int]] = None,
+    ):
+        self.id = server_id
+        self.quorum_for = quorum_for
+        self.quorum: Set[int] = None
+        self.lamport_clock = lamport_clock
+        self.send = send
+        self.lock = Lock()
+        self.cv = Condition(self.lock)
+        self.votes: Dict[int, Vote] = {}
+        self.requests: Dict[int, QuorumRequest] = {}
+        self._set_quorum(server_ids)
+
+    def _set_quorum(self, server_ids: List[int]):
+        if self.quorum_for is not None:
+            return
+        self.quorum = grid_quorum(server_ids, self.id)
+        logging.info(f"Server {self.id} uses quorum {sorted(self.quorum)}")
+
+    def _message(self, message_type: int, key: int, request_time: int, server_id: int = None) -> service_pb2.LockMessage:
+        return service_pb2.LockMessage(
+            type=message_type,
+            key=key,
+            lamport_timestamp=self.lamport_clock.get_clock(),
+            server_id=self.id if server_id is None else server_id,
+            request_timestamp=request_time,
+        )
+
+    def _dispatch(self, outgoing: Outgoing):
+        """
+        Sends messages collected while holding the lock. Messages to this same server are handled right away.
+        """
+        for server_id, message in outgoing:
+            if server_id == self.id:
+                self.receive(message)
+            else:
+                self.send(server_id, message)
+
+    # ========================
+    #      requester side
+    # ========================
+
+    def acquire(self, key: int) -> int:
+        """
+        Requests the votes of the quorum for key and waits until all of them are granted.
+        Returns the Lamport timestamp at which the critical section was entered.
+        """
+        with self.lock:
+            self.cv.wait_for(lambda: key not in self.requests)
+            self.lamport_clock.tick()
+            quorum = self.quorum if self.quorum_for is None else self.quorum_for(key)
+            request = QuorumRequest(self.lamport_clock.get_clock(), set(quorum))
+            self.requests[key] = request
+        logging.debug(f"Server {self.id} requesting votes for key {key} from quorum {sorted(request.quorum)}")
+        self._dispatch([
+            (member_id, self._message(service_pb2.REQUEST, key, request.request_time))
+            for member_id in request.quorum
+        ])
+        with self.lock:
+            self.cv.wait_for(lambda: request.in_critical_section)
+            return self.lamport_clock.get_clock()
+
+    def release(self, key: int):
+        with self.lock:
+            request = self.requests.pop(key)
+            self.cv.notify_all()
+        self._dispatch([
+            (member_id, self._message(service_pb2.RELEASE, key, request.request_time))
+            for member_id in request.quorum
+        ])
+
+    def set_members(self, server_ids: List[int]):
+        """
+        Recomputes the quorum of this server for its next requests after servers joined or left the cluster.
+        Votes given to servers that left go to the next requester, and their votes are no longer waited for.
+        Requests already sent keep their quorum. Quorums computed from different views are not guaranteed to
+        intersect, so two servers can enter the critical section of a key at once until every server has seen
+        the change; Storage keeps the membership static with this engine and never calls this.
+        """
+        members = set(server_ids)
+        outgoing: Outgoing = []
+        with self.lock:
+            self._set_quorum(server_ids)
+            for key, vote in list(self.votes.items()):
+                vote.queue = [priority for priority in vote.queue if priority[1] in members]
+                heapq.heapify(vote.queue)
+                vote.failed_sent = { priority for priority in vote.failed_sent if priority[1] in members }
+                if vote.voted_for[1] not in members:
+                    self._grant_next(key, vote, outgoing)
+            for request in self.requests.values():
+                request.quorum &= members
+                if not request.in_critical_section and request.granted >= request.quorum:
+                    request.in_critical_section = True
+                    request.deferred_inquiries.clear()
+                    self.cv.notify_all()
+        self._dispatch(outgoing)
+
+    def queue_depth(self) -> int:
+        """
+        Returns how many requests are waiting for a vote of this server.
+        """
+        with self.lock:
+            return sum(len(vote.queue) for vote in self.votes.values())
+
+    def _relinquish(self, key: int, request: QuorumRequest, voter_id: int, outgoing: Outgoing):
+        request.granted.discard(voter_id)
+        outgoing.append((voter_id, self._message(service_pb2.RELINQUISH, key, request.request_time)))
+
+    def _receive_reply(self, message: service_pb2.LockMessage, outgoing: Outgoing):
+        """
+        Handles the answer of a voter. A vote for a request this server no longer has, given because a late duplicate
+        of that request reached the voter after its release, is handed back right away with a release.
+        """
+        request = self.requests.get(message.key)
+        if request is None or request.request_time != message.request_timestamp:
+            if message.type == service_pb2.OK:
+                outgoing.append((message.server_id, self._message(service_pb2.RELEASE, message.key, message.request_timestamp)))
+            return
+        if request.in_critical_section:
+            return
+        voter_id = message.server_id
+
+        if message.type == service_pb2.OK:
+            request.granted.add(voter_id)
+            if request.granted >= request.quorum:
+                request.in_critical_section = True
+                request.deferred_inquiries.clear()
+                self.cv.notify_all()
+            elif request.failed and voter_id in request.deferred_inquiries:
+                # the inquire overtook this grant
+                request.deferred_inquiries.discard(voter_id)
+                self._relinquish(message.key, request, voter_id, outgoing)
+        elif message.type == service_pb2.FAILED:
+            request.failed = True
+            for inquiring_voter_id in request.deferred_inquiries & request.granted:
+                request.deferred_inquiries.discard(inquiring_voter_id)
+                self._relinquish(message.key, request, inquiring_voter_id, outgoing)
+        elif message.type == service_pb2.INQUIRE:
+            if request.failed and voter_id in request.granted:
+                self._relinquish(message.key, request, voter_id, outgoing)
+            else:
+                request.deferred_inquiries.add(voter_id)
+
+    # ========================
+    #        voter side
+    # ========================
+
+    def _grant_next(self, key: int, vote: Vote, outgoing: Outgoing):
+        vote.inquired = False
+        if not vote.queue:
+            vote.voted_for = None
+            del self.votes[key]
+            return
+        vote.voted_for = heapq.heappop(vote.queue)
+        vote.failed_sent.discard(vote.voted_for)
+        request_time, requester_id = vote.voted_for
+        outgoing.append((requester_id, self._message(service_pb2.OK, key, request_time)))
+
+    def _receive_request(self, message: service_pb2.LockMessage, outgoing: Outgoing):
+        """
+        Votes for a request or queues it. A request delivered twice, e.g. by a retried unary call, is only counted once
+        while it is waiting or voted for. A duplicate that arrives after the release gets a vote that its requester
+        hands back, see _receive_reply.
+        """
+        priority = (message.request_timestamp, message.server_id)
+        vote = self.votes.setdefault(message.key, Vote())
+        if priority == vote.voted_for or priority in vote.queue:
+            return
+        if vote.voted_for is None:
+            vote.voted_for = priority
+            outgoing.append((message.server_id, self._message(service_pb2.OK, message.key, message.request_timestamp)))
+            return
+
+        heapq.heappush(vote.queue, priority)
+        head = vote.queue[0]
+        # every waiting request except the best one is told it cannot get this vote for now
+        for waiting in vote.queue:
+            if waiting != head and waiting not in vote.failed_sent:
+                vote.failed_sent.add(waiting)
+                outgoing.append((waiting[1], self._message(service_pb2.FAILED, message.key, waiting[0])))
+        if head < vote.voted_for:
+            if not vote.inquired:
+                vote.inquired = True
+                outgoing.append((vote.voted_for[1], self._message(service_pb2.INQUIRE, message.key, vote.voted_for[0])))
+        elif head not in vote.failed_sent:
+            vote.failed_sent.add(head)
+            outgoing.append((head[1], self._message(service_pb2.FAILED, message.key, head[0])))
+
+    def _receive_release(self, message: service_pb2.LockMessage, outgoing: Outgoing):
+        priority = (message.request_timestamp, message.server_id)
+        vote = self.votes.get(message.key)
+        if vote is None:
+            return
+        if vote.voted_for != priority:
+            if priority in vote.queue:
+                vote.queue.remove(priority)
+                heapq.heapify(vote.queue)
+            return
+        if message.type == service_pb2.RELINQUISH:
+            heapq.heappush(vote.queue, priority)
+        self._grant_next(message.key, vote, outgoing)
+
+    def receive(self, message: service_pb2.LockMessage):
+        """
+        Handles a lock message from another server, or from this one.
+        """
+        outgoing: Outgoing = []
+        with self.lock:
+            self.lamport_clock.update_clock(message.lamport_timestamp)
+            if message.type == service_pb2.REQUEST:
+                self._receive_request(message, outgoing)
+            elif message.type in (service_pb2.RELEASE, service_pb2.RELINQUISH):
+                self._receive_release(message, outgoing)
+            else:
+                self._receive_reply(message, outgoing)
+        self._dispatch(outgoing)
@@ -1,15 +1,23 @@
+import asyncio
 import grpc
-import time
 import os
 import logging
 import random
+import signal
+import sys
 
 # Import the generated classes
 import protobuf.service_pb2_grpc as service_pb2_grpc
 import protobuf.service_pb2 as service_pb2
 
 from concurrent import futures
-from storage.storage import Storage
+from threading import Event, Thread
+from kv_store.kv_store import StaleFencingTokenError
+from load_generator.load_generator import LoadGenerator
+from lock_stream.lock_stream import lock_stream_server_workers
+from metrics.registry import MetricsRegistry, MetricsServer, ReceivedRpcCounter
+from storage.storage import STORAGE_ADDRESSES, LeaseExpiredError, ReplicationError, Storage
+from storage.async_storage import AsyncStorage
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,8 +30,43 @@ This file creates a gRPC server that communicates with other servers.
 def serve():
     # Create a gRPC server
     server_id = int(os.getenv('SERVER_ID'))
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
-    service = Storage(server_id)
+    server_workers = int(os.getenv('SERVER_WORKERS', '10'))
+    # a joining server is not in STORAGE_ADDRESSES, so the others could never reach it
+    if os.getenv('JOIN_ADDRESS') and not os.getenv('SERVER_ADDRESS'):
+        raise ValueError("JOIN_ADDRESS requires SERVER_ADDRESS, the address the other servers reach this one at")
+    use_lock_streams = os.getenv('LOCK_TRANSPORT', 'unary') == 'stream'
+    if use_lock_streams:
+        # every lock stream accepted from a peer holds a server worker for its whole life
+        stream_server_workers = lock_stream_server_workers(len(STORAGE_ADDRESSES) - 1, server_workers)
+        if stream_server_workers > server_workers:
+            logging.warning(f"Raising SERVER_WORKERS from {server_workers} to {stream_server_workers}, so lock streams do not starve unary calls")
+            server_workers = stream_server_workers
+    metrics = MetricsRegistry()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=server_workers), interceptors=[ReceivedRpcCounter(metrics)])
+    # LOCK_TRANSPORT=stream batches lock traffic on one stream per peer instead of one unary call per message
+    # PIGGYBACK_OKS=1 makes peers grant uncontended requests in the response instead of a separate ok call
+    # MUTEX_ALGORITHM=maekawa only asks a quorum of servers for each key instead of all of them
+    # MUTEX_ALGORITHM=suzuki_kasami passes a token per key, its holder writes again without any message
+    # MUTEX_ALGORITHM=sharded splits the keys over a hash ring, each key is locked and stored by SHARD_REPLICAS servers only
+    # JOIN_ADDRESS=host:port joins a running cluster through that server, which others reach this one at SERVER_ADDRESS
+    # (not with maekawa or sharded, whose membership is static)
+    service = Storage(
+        server_id,
+        use_lock_streams=use_lock_streams,
+        piggyback_oks=os.getenv('PIGGYBACK_OKS', '0') == '1',
+        mutex_algorithm=os.getenv('MUTEX_ALGORITHM', 'ricart_agrawala'),
+        address=os.getenv('SERVER_ADDRESS'),
+        join_address=os.getenv('JOIN_ADDRESS'),
+        shard_replicas=int(os.getenv('SHARD_REPLICAS', '3')),
+        metrics=metrics,
+        server_workers=server_workers,
+    )
+    # METRICS_PORT serves the metrics at http://METRICS_HOST:METRICS_PORT/metrics in the Prometheus text format
+    metrics_port = os.getenv('METRICS_PORT')
+    if metrics_port:
+        MetricsServer(metrics, int(metrics_port), os.getenv('METRICS_HOST', 'localhost'))
+    # CRITICAL_SECTION_DELAY emulates slower work while holding a key, in seconds
+    service.critical_section_delay = float(os.getenv('CRITICAL_SECTION_DELAY', '0'))
     service_pb2_grpc.add_NodeCommunicationServiceServicer_to_server(service, server)
     
     # Determine the server's port
@@ -32,17 +75,118 @@ def serve():
     server.start()
     logging.info(f"Server started, listening on port {port}")
 
-    # Periodically try to set a valut in a key
-    keys_to_use = [3]
+    # on shutdown the writers stop starting new writes, and once the running ones are done this server
+    # leaves the cluster, so the other servers stop waiting for it without a key being left held
+    stopping = Event()
+    load_generator = None
+    def stop_writers(signum, frame):
+        logging.info(f"Server {server_id} shutting down, waiting for the running writes to finish")
+        stopping.set()
+        if load_generator is not None:
+            load_generator.stop()
+    signal.signal(signal.SIGTERM, stop_writers)
+
+    stopping.wait(5)
+    # LOAD_MODE=closed runs LOAD_CLIENTS writers back to back, LOAD_MODE=open starts LOAD_RATE writes per second
+    load_mode = os.getenv('LOAD_MODE')
+    if load_mode in ('closed', 'open'):
+        load_generator = LoadGenerator(
+            service,
+            keys=list(range(1, int(os.getenv('LOAD_KEYS', '5')) + 1)),
+            clients=int(os.getenv('LOAD_CLIENTS', '8')),
+            rate=float(os.getenv('LOAD_RATE', '10')) if load_mode == 'open' else None,
+        )
+        if stopping.is_set():
+            load_generator.stop()
+        load_duration = os.getenv('LOAD_DURATION')
+        load_generator.run(float(load_duration) if load_duration else None)
+        # keep answering the other servers after the load run is over, until shutdown
+        stopping.wait()
+    else:
+        # Periodically try to set a valut in a key, from several writers at once
+        # WRITE_BATCH_SIZE>1 makes each writer set that many keys in one critical section entry
+        writer_threads = int(os.getenv('WRITER_THREADS', '3'))
+        write_batch_size = int(os.getenv('WRITE_BATCH_SIZE', '1'))
+        writers = [Thread(target=write_values, args=(service, stopping, write_batch_size), daemon=True) for _ in range(writer_threads)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+
+    service.leave_cluster()
+    server.stop(None)
+    sys.exit(0)
+
+
+def write_values(service: Storage, stopping: Event, batch_size: int = 1):
+    keys_to_use = [1, 2, 3, 4, 5]
+    values_to_use = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+    while True:
+        keys = random.sample(keys_to_use, min(batch_size, len(keys_to_use)))
+        if stopping.wait(random.randint(10, 25)):
+            return
+        try:
+            if len(keys) == 1:
+                service.set_value(keys[0], random.choice(values_to_use))
+            else:
+                service.set_values({ key: random.choice(values_to_use) for key in keys })
+        except (LeaseExpiredError, StaleFencingTokenError) as e:
+            logging.error(f"Server {service.id} write of keys {keys} was rejected: {e}")
+        except ReplicationError as e:
+            logging.error(f"Server {service.id} write of keys {keys} was not replicated: {e}")
+        if stopping.wait(2):
+            return
+
+
+async def serve_async():
+    # Create a grpc.aio server, every handler and writer runs on this event loop
+    # the asyncio server only runs Ricart-Agrawala over unary calls with a static membership and no metrics
+    unsupported = [
+        setting for setting, is_set in (
+            ('LOCK_TRANSPORT=stream', os.getenv('LOCK_TRANSPORT', 'unary') == 'stream'),
+            ('MUTEX_ALGORITHM', os.getenv('MUTEX_ALGORITHM', 'ricart_agrawala') != 'ricart_agrawala'),
+            ('JOIN_ADDRESS', os.getenv('JOIN_ADDRESS') is not None),
+            ('METRICS_PORT', bool(os.getenv('METRICS_PORT'))),
+            ('LOAD_MODE', os.getenv('LOAD_MODE') is not None),
+            ('WRITE_BATCH_SIZE', int(os.getenv('WRITE_BATCH_SIZE', '1')) > 1),
+        )
+        if is_set
+    ]
+    if unsupported:
+        raise ValueError(f"STORAGE_MODE=asyncio does not support {', '.join(unsupported)}")
+    server_id = int(os.getenv('SERVER_ID'))
+    server = grpc.aio.server()
+    service = AsyncStorage(server_id, piggyback_oks=os.getenv('PIGGYBACK_OKS', '0') == '1')
+    service.critical_section_delay = float(os.getenv('CRITICAL_SECTION_DELAY', '0'))
+    service_pb2_grpc.add_NodeCommunicationServiceServicer_to_server(service, server)
+
+    port = os.getenv('SERVER_PORT')
+    server.add_insecure_port(f'[::]:{port}')
+    await server.start()
+    logging.info(f"Asyncio server started, listening on port {port}")
+
+    writers = int(os.getenv('WRITER_THREADS', '3'))
+    await asyncio.sleep(5)
+    await asyncio.gather(*[write_values_async(service) for _ in range(writers)])
+
+
+async def write_values_async(service: AsyncStorage):
+    keys_to_use = [1, 2, 3, 4, 5]
     values_to_use = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
-    time.sleep(5)
     while True:
         key = random.choice(keys_to_use)
         value = random.choice(values_to_use)
-        time.sleep(random.randint(10, 25))
-        service.set_value(key, value)
-        time.sleep(2)
+        await asyncio.sleep(random.randint(10, 25))
+        try:
+            await service.set_value(key, value)
+        except (LeaseExpiredError, StaleFencingTokenError) as e:
+            logging.error(f"Server {service.id} write of key {key} was rejected: {e}")
+        await asyncio.sleep(2)
 
 
 if __name__ == '__main__':
-    serve()
+    # STORAGE_MODE selects the threaded (default) or the asyncio implementation
+    if os.getenv('STORAGE_MODE', 'threaded') == 'asyncio':
+        asyncio.run(serve_async())
+    else:
+        serve()
@@ -0,0 +1,168 @@
+import logging
+import random
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Tuple
+
+import protobuf.service_pb2 as service_pb2
+
+from channel_pool.channel_pool import ChannelPool
+
+
+# constants
+GOSSIP_INTERVAL = 1.0
+GOSSIP_FANOUT = 2
+GOSSIP_TIMEOUT = 2.0
+
+ChangeListener = Callable[[Dict[int, str], List[int]], None] # (added servers: address, removed server ids)
+
+
+class Membership:
+    """
+    Versioned view of the servers in the cluster, kept in sync by gossip.
+    Every server has an entry with its address, whether it is alive or left, and an incarnation that only grows.
+    Two entries for the same server are merged by keeping the higher incarnation, and "left" over "alive" on a tie,
+    so views converge whatever the order in which they are exchanged. The view version is the sum of the
+    incarnations, so it grows with every change.
+    Every GOSSIP_INTERVAL seconds the view is sent to GOSSIP_FANOUT random members, which merge it and answer with theirs.
+    Listeners are called with the servers that joined and left each time a merge changes the live members.
+    """
+    def __init__(self, server_id: int, addresses: Dict[int, str], channel_pool: ChannelPool, gossip_interval: float = GOSSIP_INTERVAL):
+        self.id = server_id
+        self.channel_pool = channel_pool
+        self.gossip_interval = gossip_interval
+        self.lock = Lock()
+        # held while a merge is applied and its listeners run, so listeners see the changes in order
+        self.change_lock = Lock()
+        self.members: Dict[int, service_pb2.Member] = {
+            member_id: service_pb2.Member(server_id=member_id, address=address, status=service_pb2.ALIVE, incarnation=1)
+            for member_id, address in addresses.items()
+        }
+        self.listeners: List[ChangeListener] = []
+        self.leaving = False
+        self.stopped = Event()
+        self.gossip_thread: Thread = None
+
+    def add_listener(self, listener: ChangeListener):
+        self.listeners.append(listener)
+
+    def start(self):
+        self.gossip_thread = Thread(target=self._gossip_loop, daemon=True)
+        self.gossip_thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def live_members(self) -> Dict[int, str]:
+        """
+        Returns the address of every alive server, this one included.
+        """
+        with self.lock:
+            return { member_id: member.address for member_id, member in self.members.items() if member.status == service_pb2.ALIVE }
+
+    def view(self) -> service_pb2.MembershipView:
+        with self.lock:
+            return self._view()
+
+    def _view(self) -> service_pb2.MembershipView:
+        members = [service_pb2.Member(server_id=member.server_id, address=member.address, status=member.status, incarnation=member.incarnation) for member in self.members.values()]
+        return service_pb2.MembershipView(members=members, version=sum(member.incarnation for member in members))
+
+    def merge(self, view: service_pb2.MembershipView) -> service_pb2.MembershipView:
+        """
+        Merges another view into this one, notifies the listeners of the changes and returns the merged view.
+        """
+        with self.change_lock:
+            with self.lock:
+                before = self._live_addresses()
+                for member in view.members:
+                    self._merge_member(member)
+                changes = self._changes(before)
+                merged = self._view()
+            self._notify(changes)
+        return merged
+
+    def _merge_member(self, member: service_pb2.Member):
+        current = self.members.get(member.server_id)
+        if member.server_id == self.id and not self.leaving and current is not None and current.status == service_pb2.ALIVE and member.status == service_pb2.LEFT:
+            # an old departure of this server is still going around, outdate it
+            current.incarnation = max(current.incarnation, member.incarnation) + 1
+            return
+        if current is None or (member.incarnation, member.status) > (current.incarnation, current.status):
+            self.members[member.server_id] = service_pb2.Member(
+                server_id=member.server_id,
+                address=member.address,
+                status=member.status,
+                incarnation=member.incarnation,
+            )
+
+    def join(self, member: service_pb2.Member) -> service_pb2.MembershipView:
+        """
+        Adds a server that asked to join, outdating any previous entry it had, and returns the merged view.
+        The new view is pushed to every reachable member before returning, so the new server is known to them
+        before it can send them any request.
+        """
+        with self.lock:
+            current = self.members.get(member.server_id)
+            incarnation = max(member.incarnation, 1 if current is None else current.incarnation + 1)
+        logging.info(f"Server {self.id} adding server {member.server_id} at {member.address} to the cluster")
+        self.merge(service_pb2.MembershipView(members=[
+            service_pb2.Member(server_id=member.server_id, address=member.address, status=service_pb2.ALIVE, incarnation=incarnation),
+        ]))
+        self._exchange([peer_id for peer_id in self.live_members() if peer_id not in (self.id, member.server_id)])
+        return self.view()
+
+    def leave(self, server_id: int) -> service_pb2.Member:
+        """
+        Marks a server as left and returns its new entry.
+        """
+        with self.lock:
+            self.leaving = self.leaving or server_id == self.id
+            current = self.members[server_id]
+            left = service_pb2.Member(server_id=server_id, address=current.address, status=service_pb2.LEFT, incarnation=current.incarnation + 1)
+        logging.info(f"Server {self.id} removing server {server_id} from the cluster")
+        self.merge(service_pb2.MembershipView(members=[left]))
+        return left
+
+    def _live_addresses(self) -> Dict[int, str]:
+        return { member_id: member.address for member_id, member in self.members.items() if member.status == service_pb2.ALIVE }
+
+    def _changes(self, before: Dict[int, str]) -> Tuple[Dict[int, str], List[int]]:
+        after = self._live_addresses()
+        added = { member_id: address for member_id, address in after.items() if before.get(member_id) != address }
+        removed = [member_id for member_id in before if member_id not in after]
+        return added, removed
+
+    def _notify(self, changes: Tuple[Dict[int, str], List[int]]):
+        added, removed = changes
+        added.pop(self.id, None)
+        if self.id in removed:
+            removed.remove(self.id)
+        if not added and not removed:
+            return
+        logging.info(f"Server {self.id} membership changed, joined: {sorted(added)}, left: {sorted(removed)}")
+        for listener in self.listeners:
+            listener(added, removed)
+
+    def _gossip_loop(self):
+        while not self.stopped.wait(self.gossip_interval):
+            peers = [member_id for member_id in self.live_members() if member_id != self.id]
+            self._exchange(random.sample(peers, min(GOSSIP_FANOUT, len(peers))))
+
+    def _exchange(self, peer_ids: List[int]):
+        """
+        Sends the view to several members at once and merges their answers.
+        Answers are merged on the calling thread, never on a gRPC callback thread, since a change may close
+        the channel the answer came from.
+        """
+        calls = []
+        view = self.view()
+        for peer_id in peer_ids:
+            try:
+                calls.append((peer_id, self.channel_pool.get_stub(peer_id).GossipMembership.future(view, timeout=GOSSIP_TIMEOUT)))
+            except KeyError:
+                continue # the peer left while the round was starting
+        for peer_id, call in calls:
+            if call.exception() is not None:
+                logging.debug(f"Server {self.id} could not exchange membership view with server {peer_id}. Error: {call.code()}")
+                continue
+            self.merge(call.result())
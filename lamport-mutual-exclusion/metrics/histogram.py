@@ -0,0 +1,93 @@
+import bisect
+import math
+from threading import Lock
+from typing import Dict, List, Tuple
+
+
+# constants
+HISTOGRAM_MIN_VALUE = 1e-5 # seconds
+HISTOGRAM_MAX_VALUE = 1e3 # seconds
+HISTOGRAM_BUCKETS_PER_DOUBLING = 8
+
+
+class Histogram:
+    """
+    Latency histogram with logarithmic buckets, so every recorded value keeps about the same relative precision
+    (9% with the default of 8 buckets per doubling) from microseconds to minutes, in constant memory.
+    Safe to use from several threads.
+    """
+    def __init__(
+        self,
+        min_value: float = HISTOGRAM_MIN_VALUE,
+        max_value: float = HISTOGRAM_MAX_VALUE,
+        buckets_per_doubling: int = HISTOGRAM_BUCKETS_PER_DOUBLING,
+    ):
+        bucket_count = math.ceil(math.log2(max_value / min_value) * buckets_per_doubling)
+        self.bounds: List[float] = [min_value * 2 ** (i / buckets_per_doubling) for i in range(bucket_count + 1)]
+        self.counts: List[int] = [0] * (len(self.bounds) + 1) # the last bucket holds values above max_value
+        self.lock = Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float):
+        bucket = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    def percentile(self, percent: float) -> float:
+        """
+        Returns the upper bound of the bucket holding the given percentile, or 0 if nothing was recorded.
+        """
+        with self.lock:
+            if self.count == 0:
+                return 0.0
+            rank = math.ceil(self.count * percent / 100)
+            seen = 0
+            for bucket, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen >= max(rank, 1):
+                    return self.max if bucket >= len(self.bounds) else min(self.bounds[bucket], self.max)
+            return self.max
+
+    def merge(self, other: "Histogram"):
+        with other.lock:
+            counts, count, total, maximum = list(other.counts), other.count, other.total, other.max
+        with self.lock:
+            self.counts = [mine + theirs for mine, theirs in zip(self.counts, counts)]
+            self.count += count
+            self.total += total
+            self.max = max(self.max, maximum)
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Returns the count, mean, p50, p90, p99 and max of the recorded values.
+        """
+        with self.lock:
+            count, total, maximum = self.count, self.total, self.max
+        return {
+            "count": count,
+            "mean": total / count if count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": maximum,
+        }
+
+    def buckets(self, step: int = HISTOGRAM_BUCKETS_PER_DOUBLING) -> Tuple[List[Tuple[float, int]], int, float]:
+        """
+        Returns (upper bound, number of values at or below it) for every step-th bucket bound, along with the count and
+        sum of the values, all read at once. With the default step there is one bound per doubling, as exported to Prometheus.
+        """
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.total
+        cumulative = 0
+        buckets: List[Tuple[float, int]] = []
+        for bucket, bound in enumerate(self.bounds):
+            cumulative += counts[bucket]
+            if bucket % step == 0:
+                buckets.append((bound, cumulative))
+        return buckets, count, total
@@ -0,0 +1,170 @@
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Tuple, Union
+
+import grpc
+
+from metrics.histogram import Histogram
+
+
+# constants
+METRICS_PATH = "/metrics"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Counter:
+    """
+    Counter with optional labels, e.g. the RPCs sent by method. Safe to use from several threads.
+    """
+    def __init__(self, label_names: Tuple[str, ...] = ()):
+        self.label_names = label_names
+        self.lock = Lock()
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self.lock:
+            return sorted(self.values.items())
+
+
+class Gauge:
+    """
+    Value read from a function when the metrics are rendered, so keeping it up to date costs nothing.
+    """
+    def __init__(self, function: Callable[[], float]):
+        self.function = function
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class MetricsRegistry:
+    """
+    Named counters, gauges and histograms of one server, rendered in the Prometheus text format.
+    Asking for a metric that already exists returns it, so every part of the server can ask for the metrics it updates.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.metrics: Dict[str, Tuple[str, str, Metric]] = {} # name: (type, help, metric)
+
+    def _get_or_add(self, name: str, metric_type: str, help_text: str, create: Callable[[], Metric]) -> Metric:
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = (metric_type, help_text, create())
+            return self.metrics[name][2]
+
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_add(name, "counter", help_text, lambda: Counter(label_names))
+
+    def histogram(self, name: str, help_text: str) -> Histogram:
+        return self._get_or_add(name, "histogram", help_text, Histogram)
+
+    def gauge(self, name: str, help_text: str, function: Callable[[], float], metric_type: str = "gauge"):
+        """
+        Adds a metric read from function, a counter kept elsewhere if metric_type is "counter".
+        """
+        self._get_or_add(name, metric_type, help_text, lambda: Gauge(function))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines: List[str] = []
+        for name, (metric_type, help_text, metric) in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if isinstance(metric, Counter):
+                for label_values, value in metric.samples():
+                    lines.append(f"{name}{_labels(metric.label_names, label_values)} {value}")
+            elif isinstance(metric, Gauge):
+                lines.append(f"{name} {metric.function()}")
+            else:
+                buckets, count, total = metric.buckets()
+                for bound, cumulative in buckets:
+                    lines.append(f'{name}_bucket{{le="{bound:.6g}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{le="+Inf"}} {count}')
+                lines.append(f"{name}_sum {total}")
+                lines.append(f"{name}_count {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...]) -> str:
+    if not label_names:
+        return ""
+    return "{" + ",".join(f'{label}="{value}"' for label, value in zip(label_names, label_values)) + "}"
+
+
+def _method_name(method: str) -> str:
+    # "/myservice.NodeCommunicationService/ReceiveOkMessage" -> "ReceiveOkMessage"
+    return method.rsplit("/", 1)[-1]
+
+
+class ReceivedRpcCounter(grpc.ServerInterceptor):
+    """
+    Server interceptor counting the RPCs received by method in rpc_received_total.
+    """
+    def __init__(self, registry: MetricsRegistry):
+        self.counter = registry.counter("rpc_received_total", "RPCs received, by method.", ("method",))
+
+    def intercept_service(self, continuation, handler_call_details):
+        self.counter.inc(_method_name(handler_call_details.method))
+        return continuation(handler_call_details)
+
+
+class SentRpcCounter(
+    grpc.UnaryUnaryClientInterceptor,
+    grpc.UnaryStreamClientInterceptor,
+    grpc.StreamUnaryClientInterceptor,
+    grpc.StreamStreamClientInterceptor,
+):
+    """
+    Client interceptor counting the RPCs sent by method in rpc_sent_total. A stream counts once, whatever it carries.
+    """
+    def __init__(self, registry: MetricsRegistry):
+        self.counter = registry.counter("rpc_sent_total", "RPCs sent, by method.", ("method",))
+
+    def _intercept(self, continuation, client_call_details, request):
+        self.counter.inc(_method_name(client_call_details.method))
+        return continuation(client_call_details, request)
+
+    intercept_unary_unary = _intercept
+    intercept_unary_stream = _intercept
+    intercept_stream_unary = _intercept
+    intercept_stream_stream = _intercept
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # a line per scrape would flood the server logs
+
+
+class MetricsServer:
+    """
+    Serves the metrics of a registry at http://host:port/metrics from a background thread.
+    Port 0 picks a free port, available in the port attribute.
+    """
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = "localhost"):
+        self.http_server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.registry = registry
+        self.port = self.http_server.server_address[1]
+        Thread(target=self.http_server.serve_forever, daemon=True).start()
+        logging.info(f"Serving metrics on http://{host}:{self.port}{METRICS_PATH}")
+
+    def close(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
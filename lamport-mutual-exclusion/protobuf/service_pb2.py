@@ -14,19 +14,43 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\rservice.proto\x12\tmyservice\"I\n\x0cUsageRequest\x12\x0b\n\x03key\x18\x01 \x01(\x03\x12\x19\n\x11lamport_timestamp\x18\x02 \x01(\x03\x12\x11\n\tserver_id\x18\x03 \x01(\x03\"!\n\rUsageResponse\x12\x10\n\x08response\x18\x01 \x01(\t\"5\n\tokMessage\x12\x16\n\x0e\x66rom_server_id\x18\x01 \x01(\x03\x12\x10\n\x08response\x18\x02 \x01(\t2\xb4\x01\n\x18NodeCommunicationService\x12R\n\x1bReceiveRequestResourceUsage\x12\x17.myservice.UsageRequest\x1a\x18.myservice.UsageResponse\"\x00\x12\x44\n\x10ReceiveOkMessage\x12\x14.myservice.okMessage\x1a\x18.myservice.UsageResponse\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\rservice.proto\x12\tmyservice\"_\n\x0cUsageRequest\x12\x0b\n\x03key\x18\x01 \x01(\x03\x12\x19\n\x11lamport_timestamp\x18\x02 \x01(\x03\x12\x11\n\tserver_id\x18\x03 \x01(\x03\x12\x14\n\x0cpiggyback_ok\x18\x04 \x01(\x08\"d\n\rUsageResponse\x12\x10\n\x08response\x18\x01 \x01(\t\x12&\n\x06status\x18\x02 \x01(\x0e\x32\x16.myservice.GrantStatus\x12\x19\n\x11lamport_timestamp\x18\x03 \x01(\x03\"]\n\tokMessage\x12\x16\n\x0e\x66rom_server_id\x18\x01 \x01(\x03\x12\x10\n\x08response\x18\x02 \x01(\t\x12\x19\n\x11request_timestamp\x18\x03 \x01(\x03\x12\x0b\n\x03key\x18\x04 \x01(\x03\"=\n\nKeyVersion\x12\x0b\n\x03key\x18\x01 \x01(\x03\x12\x0f\n\x07version\x18\x02 \x01(\x03\x12\x11\n\tserver_id\x18\x03 \x01(\x03\"\x8f\x02\n\x0bLockMessage\x12(\n\x04type\x18\x01 \x01(\x0e\x32\x1a.myservice.LockMessageType\x12\x0b\n\x03key\x18\x02 \x01(\x03\x12\x19\n\x11lamport_timestamp\x18\x03 \x01(\x03\x12\x11\n\tserver_id\x18\x04 \x01(\x03\x12\x19\n\x11request_timestamp\x18\x05 \x01(\x03\x12=\n\x0clast_granted\x18\x06 \x03(\x0b\x32\'.myservice.LockMessage.LastGrantedEntry\x12\r\n\x05queue\x18\x07 \x03(\x03\x1a\x32\n\x10LastGrantedEntry\x12\x0b\n\x03key\x18\x01 \x01(\x03\x12\r\n\x05value\x18\x02 \x01(\x03:\x02\x38\x01\"T\n\tLockBatch\x12(\n\x08messages\x18\x01 \x03(\x0b\x32\x16.myservice.LockMessage\x12\x10\n\x08sequence\x18\x02 \x01(\x03\x12\x0b\n\x03\x61\x63k\x18\x03 \x01(\x03\"j\n\x06Member\x12\x11\n\tserver_id\x18\x01 \x01(\x03\x12\x0f\n\x07\x61\x64\x64ress\x18\x02 \x01(\t\x12\'\n\x06status\x18\x03 \x01(\x0e\x32\x17.myservice.MemberStatus\x12\x13\n\x0bincarnation\x18\x04 \x01(\x03\"E\n\x0eMembershipView\x12\"\n\x07members\x18\x01 \x03(\x0b\x32\x11.myservice.Member\x12\x0f\n\x07version\x18\x02 \x01(\x03\"_\n\x08KeyValue\x12\x0b\n\x03key\x18\x01 \x01(\x03\x12\r\n\x05value\x18\x02 \x01(\x03\x12\x15\n\rfencing_token\x18\x03 \x01(\x03\x12\x11\n\tserver_id\x18\x04 \x01(\x03\x12\r\n\x05\x66ound\x18\x05 \x01(\x08\"4\n\rKeyValueBatch\x12#\n\x06values\x18\x01 \x03(\x0b\x32\x13.myservice.KeyValue*=\n\x0bGrantStatus\x12\x13\n\x0fNOT_PIGGYBACKED\x10\x00\x12\x0b\n\x07GRANTED\x10\x01\x12\x0c\n\x08\x44\x45\x46\x45RRED\x10\x02*g\n\x0fLockMessageType\x12\x0b\n\x07REQUEST\x10\x00\x12\x06\n\x02OK\x10\x01\x12\x0b\n\x07RELEASE\x10\x02\x12\n\n\x06\x46\x41ILED\x10\x03\x12\x0b\n\x07INQUIRE\x10\x04\x12\x0e\n\nRELINQUISH\x10\x05\x12\t\n\x05TOKEN\x10\x06*#\n\x0cMemberStatus\x12\t\n\x05\x41LIVE\x10\x00\x12\x08\n\x04LEFT\x10\x01\x32\xce\x05\n\x18NodeCommunicationService\x12R\n\x1bReceiveRequestResourceUsage\x12\x17.myservice.UsageRequest\x1a\x18.myservice.UsageResponse\"\x00\x12\x44\n\x10ReceiveOkMessage\x12\x14.myservice.okMessage\x1a\x18.myservice.UsageResponse\"\x00\x12G\n\x12\x41nnounceKeyVersion\x12\x15.myservice.KeyVersion\x1a\x18.myservice.UsageResponse\"\x00\x12H\n\x14\x45xchangeLockMessages\x12\x14.myservice.LockBatch\x1a\x14.myservice.LockBatch\"\x00(\x01\x30\x01\x12H\n\x12ReceiveLockMessage\x12\x16.myservice.LockMessage\x1a\x18.myservice.UsageResponse\"\x00\x12\x36\n\x04Join\x12\x11.myservice.Member\x1a\x19.myservice.MembershipView\"\x00\x12\x37\n\x05Leave\x12\x11.myservice.Member\x1a\x19.myservice.MembershipView\"\x00\x12J\n\x10GossipMembership\x12\x19.myservice.MembershipView\x1a\x19.myservice.MembershipView\"\x00\x12G\n\x0fReplicateWrites\x12\x18.myservice.KeyValueBatch\x1a\x18.myservice.UsageResponse\"\x00\x12\x35\n\x07ReadKey\x12\x13.myservice.KeyValue\x1a\x13.myservice.KeyValue\"\x00\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'service_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
+  _globals['_LOCKMESSAGE_LASTGRANTEDENTRY']._loaded_options = None
+  _globals['_LOCKMESSAGE_LASTGRANTEDENTRY']._serialized_options = b'8\001'
+  _globals['_GRANTSTATUS']._serialized_start=1075
+  _globals['_GRANTSTATUS']._serialized_end=1136
+  _globals['_LOCKMESSAGETYPE']._serialized_start=1138
+  _globals['_LOCKMESSAGETYPE']._serialized_end=1241
+  _globals['_MEMBERSTATUS']._serialized_start=1243
+  _globals['_MEMBERSTATUS']._serialized_end=1278
   _globals['_USAGEREQUEST']._serialized_start=28
-  _globals['_USAGEREQUEST']._serialized_end=101
-  _globals['_USAGERESPONSE']._serialized_start=103
-  _globals['_USAGERESPONSE']._serialized_end=136
-  _globals['_OKMESSAGE']._serialized_start=138
-  _globals['_OKMESSAGE']._serialized_end=191
-  _globals['_NODECOMMUNICATIONSERVICE']._serialized_start=194
-  _globals['_NODECOMMUNICATIONSERVICE']._serialized_end=374
+  _globals['_USAGEREQUEST']._serialized_end=123
+  _globals['_USAGERESPONSE']._serialized_start=125
+  _globals['_USAGERESPONSE']._serialized_end=225
+  _globals['_OKMESSAGE']._serialized_start=227
+  _globals['_OKMESSAGE']._serialized_end=320
+  _globals['_KEYVERSION']._serialized_start=322
+  _globals['_KEYVERSION']._serialized_end=383
+  _globals['_LOCKMESSAGE']._serialized_start=386
+  _globals['_LOCKMESSAGE']._serialized_end=657
+  _globals['_LOCKMESSAGE_LASTGRANTEDENTRY']._serialized_start=607
+  _globals['_LOCKMESSAGE_LASTGRANTEDENTRY']._serialized_end=657
+  _globals['_LOCKBATCH']._serialized_start=659
+  _globals['_LOCKBATCH']._serialized_end=743
+  _globals['_MEMBER']._serialized_start=745
+  _globals['_MEMBER']._serialized_end=851
+  _globals['_MEMBERSHIPVIEW']._serialized_start=853
+  _globals['_MEMBERSHIPVIEW']._serialized_end=922
+  _globals['_KEYVALUE']._serialized_start=924
+  _globals['_KEYVALUE']._serialized_end=1019
+  _globals['_KEYVALUEBATCH']._serialized_start=1021
+  _globals['_KEYVALUEBATCH']._serialized_end=1073
+  _globals['_NODECOMMUNICATIONSERVICE']._serialized_start=1281
+  _globals['_NODECOMMUNICATIONSERVICE']._serialized_end=1999
 # @@protoc_insertion_point(module_scope)
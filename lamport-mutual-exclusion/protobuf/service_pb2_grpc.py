@@ -3,7 +3,7 @@
 import grpc
 import warnings
 
-import service_pb2 as service__pb2
+from . import service_pb2 as service__pb2
 
 GRPC_GENERATED_VERSION = '1.64.1'
 GRPC_VERSION = grpc.__version__
@@ -49,6 +49,46 @@ class NodeCommunicationServiceStub(object):
                 request_serializer=service__pb2.okMessage.SerializeToString,
                 response_deserializer=service__pb2.UsageResponse.FromString,
                 _registered_method=True)
+        self.AnnounceKeyVersion = channel.unary_unary(
+                '/myservice.NodeCommunicationService/AnnounceKeyVersion',
+                request_serializer=service__pb2.KeyVersion.SerializeToString,
+                response_deserializer=service__pb2.UsageResponse.FromString,
+                _registered_method=True)
+        self.ExchangeLockMessages = channel.stream_stream(
+                '/myservice.NodeCommunicationService/ExchangeLockMessages',
+                request_serializer=service__pb2.LockBatch.SerializeToString,
+                response_deserializer=service__pb2.LockBatch.FromString,
+                _registered_method=True)
+        self.ReceiveLockMessage = channel.unary_unary(
+                '/myservice.NodeCommunicationService/ReceiveLockMessage',
+                request_serializer=service__pb2.LockMessage.SerializeToString,
+                response_deserializer=service__pb2.UsageResponse.FromString,
+                _registered_method=True)
+        self.Join = channel.unary_unary(
+                '/myservice.NodeCommunicationService/Join',
+                request_serializer=service__pb2.Member.SerializeToString,
+                response_deserializer=service__pb2.MembershipView.FromString,
+                _registered_method=True)
+        self.Leave = channel.unary_unary(
+                '/myservice.NodeCommunicationService/Leave',
+                request_serializer=service__pb2.Member.SerializeToString,
+                response_deserializer=service__pb2.MembershipView.FromString,
+                _registered_method=True)
+        self.GossipMembership = channel.unary_unary(
+                '/myservice.NodeCommunicationService/GossipMembership',
+                request_serializer=service__pb2.MembershipView.SerializeToString,
+                response_deserializer=service__pb2.MembershipView.FromString,
+                _registered_method=True)
+        self.ReplicateWrites = channel.unary_unary(
+                '/myservice.NodeCommunicationService/ReplicateWrites',
+                request_serializer=service__pb2.KeyValueBatch.SerializeToString,
+                response_deserializer=service__pb2.UsageResponse.FromString,
+                _registered_method=True)
+        self.ReadKey = channel.unary_unary(
+                '/myservice.NodeCommunicationService/ReadKey',
+                request_serializer=service__pb2.KeyValue.SerializeToString,
+                response_deserializer=service__pb2.KeyValue.FromString,
+                _registered_method=True)
 
 
 class NodeCommunicationServiceServicer(object):
@@ -66,6 +106,54 @@ class NodeCommunicationServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def AnnounceKeyVersion(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ExchangeLockMessages(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ReceiveLockMessage(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Join(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Leave(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GossipMembership(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ReplicateWrites(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ReadKey(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_NodeCommunicationServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -79,6 +167,46 @@ def add_NodeCommunicationServiceServicer_to_server(servicer, server):
                     request_deserializer=service__pb2.okMessage.FromString,
                     response_serializer=service__pb2.UsageResponse.SerializeToString,
             ),
+            'AnnounceKeyVersion': grpc.unary_unary_rpc_method_handler(
+                    servicer.AnnounceKeyVersion,
+                    request_deserializer=service__pb2.KeyVersion.FromString,
+                    response_serializer=service__pb2.UsageResponse.SerializeToString,
+            ),
+            'ExchangeLockMessages': grpc.stream_stream_rpc_method_handler(
+                    servicer.ExchangeLockMessages,
+                    request_deserializer=service__pb2.LockBatch.FromString,
+                    response_serializer=service__pb2.LockBatch.SerializeToString,
+            ),
+            'ReceiveLockMessage': grpc.unary_unary_rpc_method_handler(
+                    servicer.ReceiveLockMessage,
+                    request_deserializer=service__pb2.LockMessage.FromString,
+                    response_serializer=service__pb2.UsageResponse.SerializeToString,
+            ),
+            'Join': grpc.unary_unary_rpc_method_handler(
+                    servicer.Join,
+                    request_deserializer=service__pb2.Member.FromString,
+                    response_serializer=service__pb2.MembershipView.SerializeToString,
+            ),
+            'Leave': grpc.unary_unary_rpc_method_handler(
+                    servicer.Leave,
+                    request_deserializer=service__pb2.Member.FromString,
+                    response_serializer=service__pb2.MembershipView.SerializeToString,
+            ),
+            'GossipMembership': grpc.unary_unary_rpc_method_handler(
+                    servicer.GossipMembership,
+                    request_deserializer=service__pb2.MembershipView.FromString,
+                    response_serializer=service__pb2.MembershipView.SerializeToString,
+            ),
+            'ReplicateWrites': grpc.unary_unary_rpc_method_handler(
+                    servicer.ReplicateWrites,
+                    request_deserializer=service__pb2.KeyValueBatch.FromString,
+                    response_serializer=service__pb2.UsageResponse.SerializeToString,
+            ),
+            'ReadKey': grpc.unary_unary_rpc_method_handler(
+                    servicer.ReadKey,
+                    request_deserializer=service__pb2.KeyValue.FromString,
+                    response_serializer=service__pb2.KeyValue.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'myservice.NodeCommunicationService', rpc_method_handlers)
@@ -143,3 +271,219 @@ class NodeCommunicationService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def AnnounceKeyVersion(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/myservice.NodeCommunicationService/AnnounceKeyVersion',
+            service__pb2.KeyVersion.SerializeToString,
+            service__pb2.UsageResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ExchangeLockMessages(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/myservice.NodeCommunicationService/ExchangeLockMessages',
+            service__pb2.LockBatch.SerializeToString,
+            service__pb2.LockBatch.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ReceiveLockMessage(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/myservice.NodeCommunicationService/ReceiveLockMessage',
+            service__pb2.LockMessage.SerializeToString,
+            service__pb2.UsageResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Join(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/myservice.NodeCommunicationService/Join',
+            service__pb2.Member.SerializeToString,
+            service__pb2.MembershipView.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Leave(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/myservice.NodeCommunicationService/Leave',
+            service__pb2.Member.SerializeToString,
+            service__pb2.MembershipView.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GossipMembership(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/myservice.NodeCommunicationService/GossipMembership',
+            service__pb2.MembershipView.SerializeToString,
+            service__pb2.MembershipView.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ReplicateWrites(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/myservice.NodeCommunicationService/ReplicateWrites',
+            service__pb2.KeyValueBatch.SerializeToString,
+            service__pb2.UsageResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ReadKey(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/myservice.NodeCommunicationService/ReadKey',
+            service__pb2.KeyValue.SerializeToString,
+            service__pb2.KeyValue.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
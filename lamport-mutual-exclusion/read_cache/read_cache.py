@@ -0,0 +1,51 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Hashable, Tuple
+
+
+class ReadCache:
+    """
+    Size-bounded LRU cache of stored values.
+    It is only coherent with the local store of this server: writes that other servers make to their own stores
+    are not reflected, and keys are only replaced or dropped when the local store changes.
+    Values read from disk are only inserted if no key was written while they were being read,
+    so a slow reader can never put back a value older than a concurrent write.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.lock = Lock()
+        self.entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.generation = 0 # incremented by every write
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Returns (True, value) on a hit, or (False, generation) on a miss.
+        The generation must be passed to fill after reading the value from disk.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return True, self.entries[key]
+            return False, self.generation
+
+    def fill(self, key: Hashable, value: Any, generation: int):
+        """
+        Caches a value read from disk after a miss, unless a write happened since the miss.
+        """
+        with self.lock:
+            if generation == self.generation:
+                self._insert(key, value)
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Caches a value written by this server.
+        """
+        with self.lock:
+            self.generation += 1
+            self._insert(key, value)
+
+    def _insert(self, key: Hashable, value: Any):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
@@ -0,0 +1,301 @@
+import asyncio
+import functools
+import logging
+import time
+from typing import Any, Dict, List, Set, Tuple
+
+import grpc
+import protobuf.service_pb2_grpc as service_pb2_grpc
+import protobuf.service_pb2 as service_pb2
+
+from channel_pool.channel_pool import AsyncChannelPool
+from lamport_clock.lamport_clock import LamportClock
+from lock_table.lock_table import FENCING_SERVER_ID_RANGE, LockTable, PendingRequest, fencing_token
+from read_cache.read_cache import ReadCache
+from storage.storage import (
+    DATA_PATH,
+    LOCK_LEASE,
+    PEER_RESPONSE_TIMEOUT,
+    READ_CACHE_SIZE,
+    REQUEST_RESEND_INTERVAL,
+    REQUEST_RETRY_INTERVAL,
+    STORAGE_ADDRESSES,
+    StorageMixin,
+)
+
+
+class AsyncPendingRequest(PendingRequest):
+    """
+    Pending request that can be awaited on an event loop.
+    """
+    def __init__(self, key: int, request_time: int, required_servers: Set[int]):
+        super().__init__(key, request_time, required_servers)
+        self.completed: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._complete_if_done()
+
+    def add_ok(self, server_id: int):
+        super().add_ok(server_id)
+        self._complete_if_done()
+
+    def _complete_if_done(self):
+        if self.is_complete() and not self.completed.done():
+            self.completed.set_result(True)
+
+    async def wait_async(self, timeout: float = None) -> bool:
+        try:
+            await asyncio.wait_for(asyncio.shield(self.completed), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class AsyncStorage(StorageMixin, service_pb2_grpc.NodeCommunicationServiceServicer):
+    """
+    Asyncio version of Storage built on grpc.aio.
+    Server handlers, the request fan-out and the wait for ok messages all run on one event loop,
+    so many outstanding lock requests cost coroutines instead of OS threads.
+    It only implements the Ricart-Agrawala subset of the Storage protocol: unary lock messages, optionally with
+    piggybacked oks, and key version announcements. Locks are leased for LOCK_LEASE seconds and the versions it
+    announces are fencing tokens, as with Storage. It has no lock streams, no other mutual exclusion algorithms,
+    no sharding, no membership changes and no metrics, so it can only share a cluster with Storage servers that run
+    Ricart-Agrawala over unary calls with a static membership.
+    """
+    def __init__(self, server_id: int, piggyback_oks: bool = False, addresses: Dict[int, str] = None, data_path: str = DATA_PATH):
+        self.lamport_clock = LamportClock()
+        self.id = server_id
+        self.lock_table = LockTable(self.id, self.lamport_clock, pending_request_factory=AsyncPendingRequest)
+        self.store = self.open_store(data_path)
+        # after a restart the clock starts past every stored token, so new fencing tokens are never older
+        self.lamport_clock.update_clock(self.store.highest_fencing_token() // FENCING_SERVER_ID_RANGE)
+        self.read_cache = ReadCache(READ_CACHE_SIZE)
+        self.lock_leases: Dict[int, Tuple[int, float, float]] = {} # key: (fencing token, acquired at, lease deadline)
+        self.other_storages_addresses: Dict[int, str] = dict(STORAGE_ADDRESSES if addresses is None else addresses)
+        self.channel_pool = AsyncChannelPool(self.id, self.other_storages_addresses)
+        self.piggyback_oks = piggyback_oks
+        self.critical_section_delay = 0.0
+        # local coroutines that want a key queue on its asyncio lock, so the lock table never blocks the loop
+        self.local_key_locks: Dict[int, Tuple[asyncio.Lock, int]] = {} # key: (lock, coroutines using it)
+        self.background_tasks: Set[asyncio.Task] = set()
+
+    def _run_in_background(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def ReceiveOkMessage(self, request, context):
+        """
+        Receives an ok message from another storage server and signals the pending request it answers.
+        """
+        logging.debug(f"Server {self.id} received ok message from server {request.from_server_id} for key {request.key}")
+        if not self.lock_table.receive_ok(request.key, request.request_timestamp, request.from_server_id):
+            logging.warning(f"Server {self.id} received ok message from server {request.from_server_id} for unknown request {request.request_timestamp} on key {request.key}")
+            return service_pb2.UsageResponse(response="unknown request")
+        return service_pb2.UsageResponse(response="received ok")
+
+    def send_ok_message(self, server_id: int, key: int, request_timestamp: int):
+        """
+        Sends an ok message to another storage server in the background, retrying failed deliveries until one succeeds.
+        """
+        self._run_in_background(self._deliver_ok_message(server_id, key, request_timestamp))
+
+    async def _deliver_ok_message(self, server_id: int, key: int, request_timestamp: int):
+        logging.debug(f"Server {self.id} sending ok message for key {key} to server {server_id}")
+        message = service_pb2.okMessage(from_server_id=self.id, response="ok", request_timestamp=request_timestamp, key=key)
+        attempt = 1
+        while True:
+            try:
+                await self.channel_pool.get_stub(server_id).ReceiveOkMessage(message, timeout=PEER_RESPONSE_TIMEOUT, wait_for_ready=True)
+                return
+            except grpc.RpcError as e:
+                logging.error(f"Server {self.id} could not send ok message for key {key} to server {server_id} (attempt {attempt}). Error: {e.code()}. Retrying in {REQUEST_RETRY_INTERVAL} seconds...")
+            attempt += 1
+            await asyncio.sleep(REQUEST_RETRY_INTERVAL)
+
+    async def AnnounceKeyVersion(self, request, context):
+        """
+        Receives the announcement that another storage server committed a new version of a key.
+        The version is the fencing token of that write, so this server can no longer write the key with an older token.
+        The write went to the store of that server, not to this one, so the read cache of this server is left as it is:
+        it only mirrors the local store.
+        """
+        logging.debug(f"Server {self.id} was told by server {request.server_id} that key {request.key} is at version {request.version}")
+        # the fence is logged and synced, so it runs in the default executor like the store writes
+        await asyncio.get_running_loop().run_in_executor(None, self.store.fence, request.key, request.version)
+        return service_pb2.UsageResponse(response="fenced")
+
+    def announce_key_version(self, key: int, version: int):
+        """
+        Tells every other storage server that key has a new version, without waiting for their answers.
+        This is what fences a server whose lease on key expired: its late write to its own store is rejected.
+        """
+        announcement = service_pb2.KeyVersion(key=key, version=version, server_id=self.id)
+        self._run_in_background(self.broadcast("AnnounceKeyVersion", announcement, self._other_server_ids()))
+
+    async def ReceiveRequestResourceUsage(self, request, context):
+        """
+        Receives a request from another storage server to use a key.
+        Answers with an ok right away, or defers the request until this server releases the key.
+        If the request asks for it, an immediate ok is carried in the response instead of a separate ok message.
+        """
+        if request.piggyback_ok:
+            if self.lock_table.receive_request(request):
+                logging.debug(f"Server {self.id} granting key {request.key} to server {request.server_id} in the response")
+                return service_pb2.UsageResponse(response="ok", status=service_pb2.GRANTED, lamport_timestamp=self.lamport_clock.get_clock())
+            logging.debug(f"Server {self.id} holds key {request.key} or has priority on it, queuing request from server {request.server_id}")
+            return service_pb2.UsageResponse(response="queed request", status=service_pb2.DEFERRED, lamport_timestamp=self.lamport_clock.get_clock())
+
+        if self.lock_table.receive_request(request):
+            logging.debug(f"Server {self.id} not holding key {request.key} and without priority on it, sending ok to server {request.server_id}")
+            self.send_ok_message(request.server_id, request.key, request.lamport_timestamp)
+            return service_pb2.UsageResponse(response="send ok")
+        logging.debug(f"Server {self.id} holds key {request.key} or has priority on it, queuing request from server {request.server_id}")
+        return service_pb2.UsageResponse(response="queed request")
+
+    def _other_server_ids(self) -> List[int]:
+        return [storage_server_id for storage_server_id in self.other_storages_addresses if storage_server_id != self.id]
+
+    async def request_resource_usage(self, want_to_use_key: int) -> int:
+        """
+        Sends a request to all other storage servers to use a key and waits until all of them answered with an ok.
+        Servers unreachable for longer than LOCK_LEASE are not waited for, and the servers still missing are asked
+        again every REQUEST_RESEND_INTERVAL seconds.
+        Returns the fencing token of the granted lock, which is valid for LOCK_LEASE seconds.
+        If the request fails or is cancelled, the key is given up as if it had been released.
+        """
+        logging.debug(f"Server {self.id} requesting resource usage for key {want_to_use_key}")
+        local_key_lock, users = self.local_key_locks.get(want_to_use_key, (asyncio.Lock(), 0))
+        self.local_key_locks[want_to_use_key] = (local_key_lock, users + 1)
+        try:
+            await local_key_lock.acquire()
+        except BaseException:
+            self._drop_local_key_lock(want_to_use_key, release=False)
+            raise
+
+        try:
+            pending_servers = self._other_server_ids()
+            pending_request = self.lock_table.begin_request(want_to_use_key, pending_servers)
+        except BaseException:
+            self._drop_local_key_lock(want_to_use_key)
+            raise
+        try:
+            request = service_pb2.UsageRequest(
+                lamport_timestamp=pending_request.request_time,
+                server_id=self.id,
+                key=want_to_use_key,
+                piggyback_ok=self.piggyback_oks
+            )
+            while pending_servers:
+                responses = await self.broadcast("ReceiveRequestResourceUsage", request, pending_servers)
+                pending_servers = [storage_server_id for storage_server_id, response in responses.items() if isinstance(response, grpc.RpcError)]
+                self.receive_piggybacked_oks(want_to_use_key, pending_request.request_time, responses)
+                if pending_servers:
+                    logging.error(f"Server {self.id} could not deliver request for key {want_to_use_key} to servers {pending_servers}. Retrying in {REQUEST_RETRY_INTERVAL} seconds...")
+                    await asyncio.sleep(REQUEST_RETRY_INTERVAL)
+
+            await self.wait_for_ok_messages(pending_request, request)
+            self.lock_table.mark_held(want_to_use_key)
+        except BaseException:
+            # answers the requests deferred meanwhile and frees the key for the next local coroutine
+            self.release_resource_usage(want_to_use_key)
+            raise
+        logging.debug(f"Server {self.id} has entered critical section for key {want_to_use_key}")
+        token = fencing_token(pending_request.request_time, self.id)
+        acquired_at = time.monotonic()
+        self.lock_leases[want_to_use_key] = (token, acquired_at, acquired_at + LOCK_LEASE)
+        asyncio.get_running_loop().call_later(LOCK_LEASE, self._expire_lease, want_to_use_key, token)
+        return token
+
+    async def wait_for_ok_messages(self, pending_request: AsyncPendingRequest, request: service_pb2.UsageRequest):
+        """
+        Waits for all other storage servers to respond with an ok message, giving up on the servers whose lease
+        expired and asking the missing ones again every REQUEST_RESEND_INTERVAL seconds.
+        """
+        logging.debug(f"Server {self.id} waiting for {len(pending_request.required_servers)} ok messages for key {pending_request.key}")
+        resend_at = time.monotonic() + REQUEST_RESEND_INTERVAL
+        while not await pending_request.wait_async(timeout=REQUEST_RETRY_INTERVAL):
+            for storage_server_id in pending_request.missing_servers():
+                self._reclaim_expired_lease(pending_request, storage_server_id)
+            if time.monotonic() >= resend_at:
+                missing_servers = sorted(pending_request.missing_servers())
+                logging.warning(f"Server {self.id} still waiting for ok messages for key {pending_request.key} from servers {missing_servers}, requesting again")
+                responses = await self.broadcast("ReceiveRequestResourceUsage", request, missing_servers)
+                self.receive_piggybacked_oks(pending_request.key, pending_request.request_time, responses)
+                resend_at = time.monotonic() + REQUEST_RESEND_INTERVAL
+
+    def release_resource_usage(self, key: int):
+        """
+        Leaves the critical section for key and sends an ok message for each request deferred on it.
+        """
+        self.lock_leases.pop(key, None)
+        deferred_requests = self.lock_table.release(key)
+        logging.debug(f"Server {self.id} left critical section for key {key}, answering {len(deferred_requests)} queued requests")
+        for request in deferred_requests:
+            self.send_ok_message(request.server_id, request.key, request.lamport_timestamp)
+        self._drop_local_key_lock(key)
+
+    def _drop_local_key_lock(self, key: int, release: bool = True):
+        """
+        Stops using the local lock of key, releasing it if this coroutine acquired it.
+        """
+        local_key_lock, users = self.local_key_locks[key]
+        if release:
+            local_key_lock.release()
+        if users == 1:
+            del self.local_key_locks[key]
+        else:
+            self.local_key_locks[key] = (local_key_lock, users - 1)
+
+    async def broadcast(self, rpc_name: str, message: Any, server_ids: List[int]) -> Dict[int, Any]:
+        """
+        Calls the same RPC on several storage servers concurrently, each call with its own deadline.
+        Returns the response of each server, or the grpc.RpcError raised by its call.
+        """
+        calls = [
+            getattr(self.channel_pool.get_stub(storage_server_id), rpc_name)(message, timeout=PEER_RESPONSE_TIMEOUT, wait_for_ready=True)
+            for storage_server_id in server_ids
+        ]
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        responses: Dict[int, Any] = {}
+        for storage_server_id, result in zip(server_ids, results):
+            if isinstance(result, grpc.RpcError):
+                logging.error(f"Server {self.id} got no response to {rpc_name} from server {storage_server_id}. Error: {result.code()}")
+            elif isinstance(result, BaseException):
+                raise result
+            responses[storage_server_id] = result
+        return responses
+
+    async def set_value(self, key, value):
+        """
+        Critical section where the server sets a value in a key.
+        The write carries the fencing token of the lock, and fails if the lease expired or a newer holder already wrote.
+        The blocking store write runs in the default executor, off the event loop.
+        """
+        version = await self.request_resource_usage(key)
+        try:
+            if self.critical_section_delay:
+                await asyncio.sleep(self.critical_section_delay)
+            self.check_lease(key)
+            await asyncio.get_running_loop().run_in_executor(None, functools.partial(self.store.put, key, value, fencing_token=version))
+            self.read_cache.put(key, value)
+            logging.debug(f"Server {self.id} set key {key} to {value}")
+        finally:
+            self.release_resource_usage(key)
+        self.announce_key_version(key, version)
+
+    async def get_value(self, key, linearizable: bool = False):
+        """
+        Reads the value of a key from the read cache, or through the mutual exclusion protocol if linearizable=True.
+        """
+        if linearizable:
+            await self.request_resource_usage(key)
+            try:
+                return self._read_from_store(key)
+            finally:
+                self.release_resource_usage(key)
+
+        is_cached, cached = self.read_cache.get(key)
+        if is_cached:
+            return cached
+        value = self._read_from_store(key)
+        self.read_cache.fill(key, value, generation=cached)
+        return value
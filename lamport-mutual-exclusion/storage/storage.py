@@ -1,158 +1,931 @@
 import logging
+import os
 import time
-from typing import Any, Dict, List, Tuple
+from threading import Event, Lock, Thread, Timer
+from typing import Any, Dict, List, Tuple, Union
 
 import grpc
 import protobuf.service_pb2_grpc as service_pb2_grpc
 import protobuf.service_pb2 as service_pb2
-from joblib import dump, load
+from joblib import load
 
+from channel_pool.channel_pool import ChannelPool
+from hash_ring.hash_ring import HashRing
+from kv_store.kv_store import KeyValueStore, StaleFencingTokenError
 from lamport_clock.lamport_clock import LamportClock
+from lock_stream.lock_stream import LockStreams
+from lock_table.lock_table import FENCING_SERVER_ID_RANGE, LockTable, PendingRequest, fencing_token
+from maekawa.maekawa import MaekawaEngine
+from membership.membership import Membership
+from metrics.registry import MetricsRegistry, SentRpcCounter
+from read_cache.read_cache import ReadCache
+from suzuki_kasami.suzuki_kasami import SuzukiKasamiEngine
 
-class Storage(service_pb2_grpc.NodeCommunicationServiceServicer):
-    def __init__(self, server_id: int):
-        self.is_in_critical_section = False
-        self.want_to_enter_critical_section = False
-        self.request_queue: List[Tuple[service_pb2.UsageRequest, grpc.ServicerContext]] = []
-        self.key_in_use: int = 0
-        self.key_want_to_use: int = 0
+
+# constants
+PEER_RESPONSE_TIMEOUT = 5.0
+REQUEST_RETRY_INTERVAL = 1.0
+REQUEST_RESEND_INTERVAL = 10.0
+LOCK_LEASE = 30.0
+JOIN_ATTEMPTS = 30
+DATA_PATH = "data.log"
+LEGACY_DATA_PATH = "data.pkl"
+TOKEN_DATA_SUFFIX = ".tokens"
+READ_CACHE_SIZE = 4096
+SHARD_REPLICAS = 3
+# replicas of a key that must store a write when the key space is sharded, so a write survives losing one of them
+WRITE_QUORUM = 2
+# KeyValue carries values as int64
+REPLICATED_VALUE_RANGE = (-(1 << 63), (1 << 63) - 1)
+# quorums computed from different membership views may not intersect, so these keep the membership fixed
+STATIC_MEMBERSHIP_ALGORITHMS = ("maekawa", "sharded")
+STORAGE_ADDRESSES: Dict[int, str] = {
+    1: "server1:50051",
+    2: "server2:50052",
+    3: "server3:50053",
+    4: "server4:50054",
+    5: "server5:50055",
+}
+
+
+class LeaseExpiredError(Exception):
+    """
+    Raised when a server tries to write under a lock whose lease already expired.
+    """
+    pass
+
+
+class ReplicationError(Exception):
+    """
+    Raised when a write was stored by fewer replicas of a key than WRITE_QUORUM.
+    The replicas that stored it keep it, so later reads may still return it.
+    """
+    pass
+
+
+class StorageMixin:
+    """
+    Logic shared by Storage and AsyncStorage: opening and reading the local store, recording piggybacked oks,
+    and the Ricart-Agrawala lock leases.
+    Expects the id, store, lamport_clock, lock_table, lock_leases and channel_pool attributes and the send_ok_message
+    method of the class it is mixed into.
+    """
+    def open_store(self, path: str) -> KeyValueStore:
+        """
+        Opens the key-value store, importing the data of the old pickle file next to it the first time it is opened.
+        """
+        store = KeyValueStore(path)
+        legacy_path = os.path.join(os.path.dirname(path), LEGACY_DATA_PATH)
+        if len(store) == 0 and os.path.exists(legacy_path):
+            for key, value in load(legacy_path).items():
+                store.put(key, value)
+            logging.info(f"Server {self.id} imported {len(store)} keys from {legacy_path}")
+        return store
+
+    def receive_piggybacked_oks(self, key: int, request_time: int, responses: Dict[int, Any]):
+        """
+        Records the oks that came back in the responses to a request.
+        Deferred requests are answered later with a separate ok message, as usual.
+        """
+        for storage_server_id, response in responses.items():
+            if isinstance(response, grpc.RpcError) or response.status != service_pb2.GRANTED:
+                continue
+            self.lamport_clock.update_clock(response.lamport_timestamp)
+            self.lock_table.receive_ok(key, request_time, storage_server_id)
+
+    def check_lease(self, key: int):
+        """
+        Raises LeaseExpiredError if this server no longer holds a valid lease on key.
+        """
+        token, _, deadline = self.lock_leases.get(key, (None, 0.0, 0.0))
+        if time.monotonic() > deadline:
+            raise LeaseExpiredError(f"Server {self.id} lease on key {key} with fencing token {token} expired")
+
+    def _reclaim_expired_lease(self, pending_request: PendingRequest, server_id: int) -> bool:
+        """
+        Counts an unreachable server as having answered with an ok once it has been down for longer than LOCK_LEASE.
+        Returns True if the server's permission was reclaimed.
+        """
+        unreachable_for = self.channel_pool.unreachable_for(server_id)
+        if unreachable_for <= LOCK_LEASE:
+            return False
+        logging.warning(f"Server {self.id} reclaiming key {pending_request.key} from server {server_id}, unreachable for {unreachable_for:.1f} seconds")
+        pending_request.add_ok(server_id)
+        return True
+
+    def _expire_lease(self, key: int, token: int):
+        """
+        Once the lease with this fencing token is over, answers the requests deferred on key without waiting for
+        the release, so a holder that is stuck in its critical section does not block the other servers.
+        """
+        lease = self.lock_leases.get(key)
+        if lease is None or lease[0] != token:
+            return
+        deferred_requests = self.lock_table.expire_lease(key, token // FENCING_SERVER_ID_RANGE)
+        if deferred_requests:
+            logging.warning(f"Server {self.id} lease on key {key} expired before its release, answering {len(deferred_requests)} queued requests")
+        for request in deferred_requests:
+            self.send_ok_message(request.server_id, request.key, request.lamport_timestamp)
+
+    def _read_from_store(self, key):
+        try:
+            return self.store.get(key)
+        except KeyError:
+            raise KeyError(f"Key {key} not found")
+
+
+class Storage(StorageMixin, service_pb2_grpc.NodeCommunicationServiceServicer):
+    def __init__(
+        self,
+        server_id: int,
+        use_lock_streams: bool = False,
+        piggyback_oks: bool = False,
+        mutex_algorithm: str = "ricart_agrawala",
+        addresses: Dict[int, str] = None,
+        data_path: str = DATA_PATH,
+        address: str = None,
+        join_address: str = None,
+        shard_replicas: int = SHARD_REPLICAS,
+        metrics: MetricsRegistry = None,
+        server_workers: int = None,
+    ):
+        if join_address is not None and mutex_algorithm in STATIC_MEMBERSHIP_ALGORITHMS:
+            raise ValueError(f"Servers cannot join a running cluster with the {mutex_algorithm} algorithm")
+        if join_address is not None and address is None and (addresses or {}).get(server_id) is None:
+            raise ValueError(f"Server {server_id} needs an address the other servers can reach it at to join the cluster")
         self.lamport_clock = LamportClock()
         self.id = server_id
-        self.received_ok: List[bool] = [] # server_id: bool
-        self.other_storages_addresses: Dict[int, str] = {
-            1: "server1:50051",
-            2: "server2:50052",
-            3: "server3:50053",
-            4: "server4:50054",
-            5: "server5:50055",
-        }
-        self.my_request_time = 0
+        self.metrics = MetricsRegistry() if metrics is None else metrics
+        self.lock_table = LockTable(self.id, self.lamport_clock)
+        started_at = time.monotonic()
+        self.store = self.open_store(data_path)
+        self.metrics.histogram("storage_load_seconds", "Time to open the key-value store and replay its log.").record(time.monotonic() - started_at)
+        self.storage_write_histogram = self.metrics.histogram("storage_write_seconds", "Time to durably write values to the key-value store.")
+        # after a restart the clock starts past every stored token, so new fencing tokens are never older
+        self.lamport_clock.update_clock(self.store.highest_fencing_token() // FENCING_SERVER_ID_RANGE)
+        self.read_cache = ReadCache(READ_CACHE_SIZE)
+        # locks are held for at most LOCK_LEASE seconds, and writes under them carry a fencing token
+        self.lock_leases: Dict[int, Tuple[int, float, float]] = {} # key: (fencing token, acquired at, lease deadline)
+        # seconds spent inside set_value's critical section on top of the write itself, to emulate slower work
+        self.critical_section_delay = 0.0
+        self.lock_wait_histogram = self.metrics.histogram("lock_wait_seconds", "Time from requesting a key to entering its critical section.")
+        self.lock_hold_histogram = self.metrics.histogram("lock_hold_seconds", "Time spent inside the critical section of a key.")
+        # lock protocol messages sent to other servers, retries included
+        self.lock_messages_sent = 0
+        self.lock_messages_sent_lock = Lock()
+        self.metrics.gauge("lock_messages_sent_total", "Lock protocol messages sent, retries included.", lambda: self.lock_messages_sent, metric_type="counter")
+        self.metrics.gauge("lock_queue_depth", "Requests waiting on this server for a key, a vote or a token.", self.lock_queue_depth)
+        # a server joining through join_address starts out knowing only itself, and gets the others from the cluster
+        if addresses is None:
+            addresses = STORAGE_ADDRESSES if join_address is None else { server_id: address }
+        self.address = addresses.get(self.id) if address is None else address
+        # the live members of the cluster, replaced as a whole on every membership change, so it can be iterated safely
+        self.other_storages_addresses: Dict[int, str] = dict(addresses)
+        self.channel_pool = ChannelPool(self.id, self.other_storages_addresses, interceptors=[SentRpcCounter(self.metrics)])
+        # ask peers to answer requests in the UsageResponse itself instead of with a separate ReceiveOkMessage call
+        self.piggyback_oks = piggyback_oks
+        self.lock_streams: LockStreams = None
+        self.mutex_engine: Union[MaekawaEngine, SuzukiKasamiEngine] = None
+        self.token_store: KeyValueStore = None
+        # with "sharded", each key is owned by the shard_replicas servers after it on the ring
+        self.hash_ring: HashRing = None
+        self.shard_replicas = shard_replicas
+        # servers join and leave at runtime, the lock protocol follows the view kept in sync by gossip,
+        # except with the algorithms in STATIC_MEMBERSHIP_ALGORITHMS, which keep the servers they started with
+        self.static_membership = mutex_algorithm in STATIC_MEMBERSHIP_ALGORITHMS
+        self.membership_lock = Lock()
+        self.membership = Membership(self.id, self.other_storages_addresses, self.channel_pool)
+        self.membership.add_listener(self._on_membership_change)
+        if join_address is not None:
+            self.join_cluster(join_address)
+        # lock traffic goes through one batched stream per peer when enabled, unary calls remain the fallback
+        if use_lock_streams:
+            self.lock_streams = LockStreams(
+                self.id,
+                list(self.other_storages_addresses),
+                self.channel_pool,
+                on_messages=self.receive_lock_messages,
+                on_undelivered=self.resend_lock_messages,
+                server_workers=server_workers,
+            )
+        # "maekawa" asks a grid quorum of about 2*sqrt(N) servers instead of every server
+        # "suzuki_kasami" moves a token per key on demand, so its holder writes again without any message
+        # "sharded" only asks the replica group of the key, and stores the key on that group only
+        if mutex_algorithm == "maekawa":
+            self.mutex_engine = MaekawaEngine(self.id, list(self.other_storages_addresses), self.lamport_clock, self.send_lock_message)
+        elif mutex_algorithm == "suzuki_kasami":
+            # a server that joined later never creates tokens, they start at the lowest id of the servers it joined
+            token_home = None if join_address is None else min(server_id for server_id in self.other_storages_addresses if server_id != self.id)
+            # token ownership is kept in a log of its own next to the data, so it survives restarts
+            data_root, data_extension = os.path.splitext(data_path)
+            self.token_store = KeyValueStore(f"{data_root}{TOKEN_DATA_SUFFIX}{data_extension}")
+            self.mutex_engine = SuzukiKasamiEngine(
+                self.id,
+                list(self.other_storages_addresses),
+                self.lamport_clock,
+                self.send_lock_message,
+                token_home,
+                token_store=self.token_store,
+            )
+        elif mutex_algorithm == "sharded":
+            self.hash_ring = HashRing(list(self.other_storages_addresses))
+            self.mutex_engine = MaekawaEngine(
+                self.id,
+                list(self.other_storages_addresses),
+                self.lamport_clock,
+                self.send_lock_message,
+                quorum_for=lambda key: set(self.replica_group(key)),
+            )
+        elif mutex_algorithm != "ricart_agrawala":
+            raise ValueError(f"Unknown mutual exclusion algorithm {mutex_algorithm}")
+        # a Ricart-Agrawala lock whose lease ran out stops deferring requests, even if its holder never releases it
+        self.closed = Event()
+        if self.mutex_engine is None:
+            Thread(target=self._expire_leases_loop, daemon=True).start()
+        self.membership.start()
 
-    def connect_to_other_storage(self, address: str):
+    def close(self):
         """
-        This function connects to another storage server using gRPC.
+        Stops gossiping and closes the lock streams, the channels to the other servers and the stores.
         """
-        while True:
-            try:
-                channel = grpc.insecure_channel(f'{address}')
-                grpc.channel_ready_future(channel).result(timeout=10)
-                return channel
-            except grpc.FutureTimeoutError:
-                logging.error(f"Connection to {address} failed. Retrying in 5 seconds...")
-                time.sleep(5)
+        self.closed.set()
+        self.membership.stop()
+        if self.lock_streams is not None:
+            self.lock_streams.close()
+        self.channel_pool.close()
+        self.store.close()
+        if self.token_store is not None:
+            self.token_store.close()
+
+    def lock_queue_depth(self) -> int:
+        """
+        Returns how many requests are waiting on this server, for the lock protocol in use.
+        """
+        if self.mutex_engine is not None:
+            return self.mutex_engine.queue_depth()
+        return self.lock_table.queue_depth()
+
+    def _count_lock_messages(self, count: int = 1):
+        with self.lock_messages_sent_lock:
+            self.lock_messages_sent += count
+
+    def join_cluster(self, seed_address: str):
+        """
+        Asks the server at seed_address to add this server to the cluster, and merges the view it answers with.
+        The seed may still be starting, so the call is retried up to JOIN_ATTEMPTS times.
+        """
+        member = service_pb2.Member(server_id=self.id, address=self.address, status=service_pb2.ALIVE, incarnation=1)
+        for attempt in range(1, JOIN_ATTEMPTS + 1):
+            with grpc.insecure_channel(seed_address) as channel:
+                try:
+                    view = service_pb2_grpc.NodeCommunicationServiceStub(channel).Join(member, timeout=PEER_RESPONSE_TIMEOUT)
+                except grpc.RpcError as e:
+                    if attempt == JOIN_ATTEMPTS:
+                        raise
+                    logging.error(f"Server {self.id} could not join the cluster through {seed_address}. Error: {e.code()}. Retrying in {REQUEST_RETRY_INTERVAL} seconds...")
+                    time.sleep(REQUEST_RETRY_INTERVAL)
+                    continue
+            self.membership.merge(view)
+            logging.info(f"Server {self.id} joined the cluster at version {view.version} with servers {sorted(self.other_storages_addresses)}")
+            return
+
+    def leave_cluster(self):
+        """
+        Tells every other server that this one is leaving, so they stop waiting for its ok messages, and stops gossiping.
+        Must be called once this server no longer holds or requests any key.
+        With a static membership the others are not told, they keep this server in their quorums until it is back.
+        """
+        if self.static_membership:
+            self.membership.stop()
+            logging.info(f"Server {self.id} stopped, the membership is static so it stays in the cluster")
+            return
+        left = self.membership.leave(self.id)
+        calls = []
+        for storage_server_id in self.other_storages_addresses:
+            if storage_server_id != self.id:
+                calls.append(self.channel_pool.get_stub(storage_server_id).Leave.future(left, timeout=PEER_RESPONSE_TIMEOUT))
+        for call in calls:
+            if call.exception() is not None:
+                logging.error(f"Server {self.id} could not announce it is leaving to a server. Error: {call.code()}")
+        self.membership.stop()
+        logging.info(f"Server {self.id} left the cluster")
+
+    def Join(self, request, context):
+        """
+        Adds a new server to the cluster and answers with the whole membership view.
+        Fails with FAILED_PRECONDITION if the membership is static.
+        """
+        if self.static_membership:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "the membership of this cluster is static")
+        return self.membership.join(request)
+
+    def Leave(self, request, context):
+        """
+        Removes a server that is leaving the cluster.
+        Fails with FAILED_PRECONDITION if the membership is static.
+        """
+        if self.static_membership:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "the membership of this cluster is static")
+        return self.membership.merge(service_pb2.MembershipView(members=[request]))
+
+    def GossipMembership(self, request, context):
+        """
+        Merges the membership view of another server and answers with the merged view.
+        """
+        return self.membership.merge(request)
+
+    def _on_membership_change(self, added: Dict[int, str], removed: List[int]):
+        """
+        Makes the lock protocol follow a membership change: channels and lock streams are opened to the servers
+        that joined and closed to the ones that left, and the pending requests of this server stop waiting for
+        the servers that left and are sent to the ones that joined.
+        """
+        with self.membership_lock:
+            addresses = { server_id: address for server_id, address in self.other_storages_addresses.items() if server_id not in removed }
+            addresses.update(added)
+            self.other_storages_addresses = addresses
+            for server_id, address in added.items():
+                self.channel_pool.add_peer(server_id, address)
+                if self.lock_streams is not None:
+                    self.lock_streams.add_peer(server_id)
+            for server_id in removed:
+                if self.lock_streams is not None:
+                    self.lock_streams.remove_peer(server_id)
+                self.channel_pool.remove_peer(server_id)
+
+            if self.mutex_engine is not None:
+                self.mutex_engine.set_members(list(addresses))
+                return
+            for pending_request in self.lock_table.pending_requests():
+                for server_id in removed:
+                    pending_request.remove_required_server(server_id)
+                for server_id in added:
+                    if pending_request.add_required_server(server_id):
+                        request = service_pb2.UsageRequest(key=pending_request.key, lamport_timestamp=pending_request.request_time, server_id=self.id)
+                        Thread(target=self._deliver_request_unary, args=(server_id, request), daemon=True).start()
+
+    def _sync_required_servers(self, pending_request: PendingRequest) -> List[int]:
+        """
+        Brings the servers a new request waits for up to date with the membership, which may have changed while
+        the request waited for another local thread to release the key. Changes after this are applied by
+        _on_membership_change. Returns the servers the request must be sent to.
+        """
+        with self.membership_lock:
+            current_servers = [storage_server_id for storage_server_id in self.other_storages_addresses if storage_server_id != self.id]
+            pending_request.set_required_servers(set(current_servers))
+        return current_servers
 
     def ReceiveOkMessage(self, request, context):
         """
-        Receives an ok message from another storage server and appends it to the received_ok list.
+        Receives an ok message from another storage server and signals the pending request it answers.
         """
-        logging.info(f"Server {self.id} received ok message from server {request.from_server_id}")
-        self.received_ok.append(True)
+        logging.debug(f"Server {self.id} received ok message from server {request.from_server_id} for key {request.key}")
+        if not self.lock_table.receive_ok(request.key, request.request_timestamp, request.from_server_id):
+            logging.warning(f"Server {self.id} received ok message from server {request.from_server_id} for unknown request {request.request_timestamp} on key {request.key}")
+            return service_pb2.UsageResponse(response="unknown request")
         return service_pb2.UsageResponse(response="received ok")
-    
-    def send_ok_message(self, server_id: int):
+
+    def send_ok_message(self, server_id: int, key: int, request_timestamp: int):
+        """
+        Sends an ok message to another storage server, answering its request for key made at request_timestamp.
+        The message goes through the lock stream with that server if it is up, or through a unary call otherwise.
+        """
+        if self.lock_streams is not None and self.lock_streams.send(server_id, service_pb2.LockMessage(
+            type=service_pb2.OK,
+            key=key,
+            server_id=self.id,
+            request_timestamp=request_timestamp
+        )):
+            self._count_lock_messages()
+            return
+        self._send_ok_message_unary(server_id, key, request_timestamp)
+
+    def _send_ok_message_unary(self, server_id: int, key: int, request_timestamp: int, attempt: int = 1):
+        """
+        Sends an ok message with the ReceiveOkMessage RPC.
+        The call is asynchronous, so gRPC handlers never block on outbound calls.
+        The requester never asks again for an ok, so a failed delivery is retried from a timer until it succeeds
+        or the server leaves the cluster.
+        """
+        logging.debug(f"Server {self.id} sending ok message for key {key} to server {server_id}")
+        try:
+            stub = self.channel_pool.get_stub(server_id)
+        except KeyError:
+            logging.warning(f"Server {self.id} dropping ok message for key {key} to server {server_id}, which left the cluster")
+            return
+        self._count_lock_messages()
+        call = stub.ReceiveOkMessage.future(service_pb2.okMessage(
+            from_server_id=self.id,
+            response="ok",
+            request_timestamp=request_timestamp,
+            key=key
+        ), timeout=PEER_RESPONSE_TIMEOUT, wait_for_ready=True)
+
+        def on_done(call):
+            if call.exception() is None:
+                return
+            logging.error(f"Server {self.id} could not send ok message for key {key} to server {server_id} (attempt {attempt}). Error: {call.code()}. Retrying in {REQUEST_RETRY_INTERVAL} seconds...")
+            retry = Timer(REQUEST_RETRY_INTERVAL, self._send_ok_message_unary, args=(server_id, key, request_timestamp, attempt + 1))
+            retry.daemon = True
+            retry.start()
+
+        call.add_done_callback(on_done)
+
+    def AnnounceKeyVersion(self, request, context):
+        """
+        Receives the announcement that another storage server committed a new version of a key.
+        The version is the fencing token of that write, so this server can no longer write the key with an older token.
+        The write went to the store of that server, not to this one, so the read cache of this server is left as it is:
+        it only mirrors the local store.
+        """
+        logging.debug(f"Server {self.id} was told by server {request.server_id} that key {request.key} is at version {request.version}")
+        self.store.fence(request.key, request.version)
+        return service_pb2.UsageResponse(response="fenced")
+
+    def announce_key_version(self, key: int, version: int):
+        """
+        Tells every other storage server that key has a new version, without waiting for their answers.
+        This is what fences a server whose lease on key expired: its late write to its own store is rejected.
+        """
+        announcement = service_pb2.KeyVersion(key=key, version=version, server_id=self.id)
+        for storage_server_id in self.other_storages_addresses:
+            if storage_server_id == self.id:
+                continue
+            try:
+                self.channel_pool.get_stub(storage_server_id).AnnounceKeyVersion.future(announcement, timeout=PEER_RESPONSE_TIMEOUT)
+            except KeyError:
+                pass # the server left the cluster after the loop started
+
+    def replica_group(self, key: int) -> List[int]:
+        """
+        Returns the servers that own key when the key space is sharded, its primary first.
+        """
+        return self.hash_ring.replica_group(key, self.shard_replicas)
+
+    def ReplicateWrites(self, request, context):
         """
-        Sends an ok message to another storage server.
+        Stores the writes another server made under its locks on keys that this server replicates.
+        The writes are rejected as a whole if one of their fencing tokens is older than one already seen.
         """
-        logging.info(f"Server {self.id} sending ok message to server {server_id}")
-        channel = self.connect_to_other_storage(self.other_storages_addresses[server_id])
-        stub = service_pb2_grpc.NodeCommunicationServiceStub(channel)
-        response = stub.ReceiveOkMessage(service_pb2.okMessage(from_server_id=self.id, response="ok"))
-        return response
+        values = { key_value.key: key_value.value for key_value in request.values }
+        fencing_tokens = { key_value.key: key_value.fencing_token for key_value in request.values }
+        try:
+            self._apply_writes(values, fencing_tokens)
+        except StaleFencingTokenError as e:
+            logging.warning(f"Server {self.id} rejected writes of keys {sorted(values)} from a server: {e}")
+            return service_pb2.UsageResponse(response="stale fencing token")
+        logging.debug(f"Server {self.id} stored replicated keys {sorted(values)}")
+        return service_pb2.UsageResponse(response="stored")
+
+    def replicate_writes(self, values: Dict[int, int], fencing_tokens: Dict[int, int]):
+        """
+        Writes each value to the replica group of its key, with one call per server of the groups.
+        Servers of the groups that cannot be reached miss the writes until a read of the key repairs them.
+        Raises StaleFencingTokenError if a server rejected them because a newer lock holder already wrote one of the keys,
+        and ReplicationError if fewer than WRITE_QUORUM servers of the group of a key stored it.
+        """
+        batches: Dict[int, List[service_pb2.KeyValue]] = {}
+        quorums: Dict[int, int] = {}
+        for key, value in values.items():
+            replica_group = self.replica_group(key)
+            quorums[key] = min(WRITE_QUORUM, len(replica_group))
+            for storage_server_id in replica_group:
+                batches.setdefault(storage_server_id, []).append(
+                    service_pb2.KeyValue(key=key, value=value, fencing_token=fencing_tokens[key], server_id=self.id)
+                )
+        local_batch = batches.pop(self.id, None)
+        calls = {}
+        for storage_server_id, batch in batches.items():
+            try:
+                stub = self.channel_pool.get_stub(storage_server_id)
+            except KeyError:
+                continue # the server left the cluster after the groups were computed
+            calls[storage_server_id] = stub.ReplicateWrites.future(service_pb2.KeyValueBatch(values=batch), timeout=PEER_RESPONSE_TIMEOUT)
+        acks = { key: 0 for key in values }
+        if local_batch is not None:
+            self._apply_writes({ key_value.key: key_value.value for key_value in local_batch }, fencing_tokens)
+            for key_value in local_batch:
+                acks[key_value.key] += 1
+        for storage_server_id, call in calls.items():
+            if call.exception() is not None:
+                logging.error(f"Server {self.id} could not replicate writes to server {storage_server_id}. Error: {call.code()}")
+            elif call.result().response == "stale fencing token":
+                raise StaleFencingTokenError(f"Server {storage_server_id} rejected writes of keys {sorted(values)}, a newer lock holder already wrote")
+            else:
+                for key_value in batches[storage_server_id]:
+                    acks[key_value.key] += 1
+        unreplicated_keys = sorted(key for key, count in acks.items() if count < quorums[key])
+        if unreplicated_keys:
+            raise ReplicationError(f"Server {self.id} could not store keys {unreplicated_keys} on {WRITE_QUORUM} of their replicas")
+
+    def _check_replicated_values(self, values: Dict[int, Any]):
+        """
+        Raises ValueError unless every value fits the int64 values of KeyValue, before any lock is taken.
+        """
+        low, high = REPLICATED_VALUE_RANGE
+        for key, value in values.items():
+            if not isinstance(value, int) or not low <= value <= high:
+                raise ValueError(f"Value {value!r} of key {key} cannot be replicated, sharded keys only hold int64 values")
+
+    def _apply_writes(self, values: Dict[int, Any], fencing_tokens: Dict[int, int]):
+        started_at = time.monotonic()
+        self.store.put_many(values, fencing_tokens={ key: fencing_tokens[key] for key in values })
+        self.storage_write_histogram.record(time.monotonic() - started_at)
+        for key, value in values.items():
+            self.read_cache.put(key, value)
+
+    def ReadKey(self, request, context):
+        """
+        Reads a key of a shard this server replicates, with the fencing token of its value.
+        """
+        return self._read_key_value(request.key)
+
+    def _read_key_value(self, key: int) -> service_pb2.KeyValue:
+        try:
+            value, token = self.store.get_with_token(key)
+        except KeyError:
+            return service_pb2.KeyValue(key=key, server_id=self.id, found=False)
+        return service_pb2.KeyValue(key=key, value=value, fencing_token=token or 0, server_id=self.id, found=True)
+
+    def _read_from_shard(self, key: int):
+        """
+        Reads a key from every server of its replica group at once and returns the value with the highest fencing token,
+        so a replica that missed a write does not serve its stale value. The replicas found stale or missing the key
+        are sent the newest value in the background (read repair).
+        Raises KeyError if none of the replicas that answered has the key.
+        """
+        calls = {}
+        answers: Dict[int, service_pb2.KeyValue] = {}
+        for storage_server_id in self.replica_group(key):
+            if storage_server_id == self.id:
+                answers[self.id] = self._read_key_value(key)
+                continue
+            try:
+                calls[storage_server_id] = self.channel_pool.get_stub(storage_server_id).ReadKey.future(service_pb2.KeyValue(key=key), timeout=PEER_RESPONSE_TIMEOUT)
+            except KeyError:
+                continue # the server left the cluster after the group was computed
+        error = None
+        for storage_server_id, call in calls.items():
+            if call.exception() is not None:
+                logging.error(f"Server {self.id} could not read key {key} from server {storage_server_id}. Error: {call.code()}")
+                error = call.exception()
+                continue
+            answers[storage_server_id] = call.result()
+
+        found = [answer for answer in answers.values() if answer.found]
+        if not found:
+            if not answers and error is not None:
+                raise error
+            raise KeyError(f"Key {key} not found")
+        newest = max(found, key=lambda answer: answer.fencing_token)
+        stale_servers = [storage_server_id for storage_server_id, answer in answers.items() if not answer.found or answer.fencing_token < newest.fencing_token]
+        if stale_servers:
+            self._repair_replicas(newest, stale_servers)
+        return newest.value
+
+    def _repair_replicas(self, newest: service_pb2.KeyValue, server_ids: List[int]):
+        """
+        Sends the newest value of a key to the replicas that answered a read with an older one, without waiting.
+        """
+        logging.warning(f"Server {self.id} repairing key {newest.key} on stale replicas {sorted(server_ids)}")
+        for storage_server_id in server_ids:
+            if storage_server_id == self.id:
+                try:
+                    self._apply_writes({ newest.key: newest.value }, { newest.key: newest.fencing_token })
+                except StaleFencingTokenError:
+                    pass # a newer write arrived meanwhile
+                continue
+            try:
+                stub = self.channel_pool.get_stub(storage_server_id)
+            except KeyError:
+                continue
+            stub.ReplicateWrites.future(service_pb2.KeyValueBatch(values=[newest]), timeout=PEER_RESPONSE_TIMEOUT)
 
     def ReceiveRequestResourceUsage(self, request, context):
         """
         This function receives a request from another storage server to use a resource.
-        The server will send an ok message if it is not in the critical section and does not want to enter the critical section.
-        If the server is in the critical section, it will queue the request.
+        The server will send an ok message if it does not hold the key and does not want it with an earlier timestamp.
+        Otherwise, it will defer the request until it releases the key.
+        Requests for different keys never affect each other.
+        If the request asks for it, an immediate ok is carried in the response instead of a separate ok message.
         """
-        self.lamport_clock.update_clock(request.lamport_timestamp)
-        self.lamport_clock.tick()
+        if request.piggyback_ok:
+            if self.lock_table.receive_request(request):
+                logging.debug(f"Server {self.id} granting key {request.key} to server {request.server_id} in the response")
+                return service_pb2.UsageResponse(response="ok", status=service_pb2.GRANTED, lamport_timestamp=self.lamport_clock.get_clock())
+            logging.debug(f"Server {self.id} holds key {request.key} or has priority on it, queuing request from server {request.server_id}")
+            return service_pb2.UsageResponse(response="queed request", status=service_pb2.DEFERRED, lamport_timestamp=self.lamport_clock.get_clock())
 
-        if not self.is_in_critical_section and not self.want_to_enter_critical_section:
-            logging.info(f"Server {self.id} not in critical section and not wanting to enter critical section, sending ok to server {request.server_id}")
-            self.send_ok_message(request.server_id)
+        if self.handle_resource_request(request):
             return service_pb2.UsageResponse(response="send ok")
-        elif self.is_in_critical_section and self.key_in_use == request.key:
-            logging.info(f"Server {self.id} is in critical section and using key {self.key_in_use}, queuing request from server {request.server_id}")
-            self.request_queue.append((request, context))
-            return service_pb2.UsageResponse(response="queed request")
-        elif self.want_to_enter_critical_section and self.key_want_to_use == request.key:
-            if self.my_request_time < request.lamport_timestamp or (self.my_request_time == request.lamport_timestamp and self.id < request.server_id):
-                logging.info(f"Server {self.id} wants to enter critical section and wants to use key {self.key_want_to_use} but server {request.server_id} has priority, queuing request")
-                self.send_ok_message(request.server_id)
-                return service_pb2.UsageResponse(response="send ok")
+        return service_pb2.UsageResponse(response="queed request")
+
+    def handle_resource_request(self, request: service_pb2.UsageRequest) -> bool:
+        """
+        Answers a resource request with an ok, or defers it. Returns True if the ok was sent.
+        """
+        if self.lock_table.receive_request(request):
+            logging.debug(f"Server {self.id} not holding key {request.key} and without priority on it, sending ok to server {request.server_id}")
+            self.send_ok_message(request.server_id, request.key, request.lamport_timestamp)
+            return True
+        logging.debug(f"Server {self.id} holds key {request.key} or has priority on it, queuing request from server {request.server_id}")
+        return False
+
+    def ExchangeLockMessages(self, request_iterator, context):
+        """
+        Bidirectional stream of batched lock messages with another storage server.
+        """
+        if self.lock_streams is None:
+            context.abort(grpc.StatusCode.UNIMPLEMENTED, "lock streams are disabled on this server")
+        return self.lock_streams.serve(request_iterator, context)
+
+    def ReceiveLockMessage(self, request, context):
+        """
+        Receives a single lock message from another storage server, when there is no lock stream with it.
+        """
+        self.receive_lock_messages(request.server_id, [request])
+        return service_pb2.UsageResponse(response="received")
+
+    def send_lock_message(self, server_id: int, message: service_pb2.LockMessage, attempt: int = 1):
+        """
+        Sends a lock message through the lock stream with server_id if it is up, or with the ReceiveLockMessage RPC otherwise.
+        A failed unary delivery is retried from a timer until it succeeds or the server leaves the cluster,
+        since the engines never send a lost vote or token again.
+        """
+        self._count_lock_messages()
+        if self.lock_streams is not None and self.lock_streams.send(server_id, message):
+            return
+        try:
+            stub = self.channel_pool.get_stub(server_id)
+        except KeyError:
+            logging.warning(f"Server {self.id} dropping lock message for key {message.key} to server {server_id}, which left the cluster")
+            return
+        call = stub.ReceiveLockMessage.future(message, timeout=PEER_RESPONSE_TIMEOUT, wait_for_ready=True)
+
+        def on_done(call):
+            if call.exception() is None:
+                return
+            logging.error(f"Server {self.id} could not send lock message for key {message.key} to server {server_id} (attempt {attempt}). Error: {call.code()}. Retrying in {REQUEST_RETRY_INTERVAL} seconds...")
+            retry = Timer(REQUEST_RETRY_INTERVAL, self.send_lock_message, args=(server_id, message, attempt + 1))
+            retry.daemon = True
+            retry.start()
+
+        call.add_done_callback(on_done)
+
+    def receive_lock_messages(self, server_id: int, messages: List[service_pb2.LockMessage]):
+        """
+        Handles a batch of lock messages received on the stream with another storage server.
+        Ricart-Agrawala has no release message, releasing a key is sending the deferred oks, so RELEASE frames
+        only come from the Maekawa engine.
+        """
+        if self.mutex_engine is not None:
+            for message in messages:
+                self.mutex_engine.receive(message)
+            return
+        for message in messages:
+            if message.type == service_pb2.REQUEST:
+                self.handle_resource_request(service_pb2.UsageRequest(
+                    key=message.key,
+                    lamport_timestamp=message.lamport_timestamp,
+                    server_id=message.server_id
+                ))
+            elif message.type == service_pb2.OK:
+                if not self.lock_table.receive_ok(message.key, message.request_timestamp, message.server_id):
+                    logging.warning(f"Server {self.id} received ok message from server {message.server_id} for unknown request {message.request_timestamp} on key {message.key}")
             else:
-                logging.info(f"Server {self.id} wants to enter critical section and wants to use key {self.key_want_to_use} and has priority, queuing request from server {request.server_id}")
-                self.request_queue.append((request, context))
-                return service_pb2.UsageResponse(response="queed request")
-        
+                logging.warning(f"Server {self.id} ignoring lock message of type {message.type} from server {server_id}")
+
+    def resend_lock_messages(self, server_id: int, messages: List[service_pb2.LockMessage]):
+        """
+        Sends the messages that were queued on a lock stream when it broke through the unary RPCs.
+        """
+        if self.mutex_engine is not None:
+            for message in messages:
+                self.send_lock_message(server_id, message)
+            return
+        for message in messages:
+            if message.type == service_pb2.REQUEST:
+                request = service_pb2.UsageRequest(key=message.key, lamport_timestamp=message.lamport_timestamp, server_id=message.server_id)
+                Thread(target=self._deliver_request_unary, args=(server_id, request), daemon=True).start()
+            elif message.type == service_pb2.OK:
+                self._send_ok_message_unary(server_id, message.key, message.request_timestamp)
+
+    def _deliver_request_unary(self, server_id: int, request: service_pb2.UsageRequest):
+        # a server that left the cluster is no longer in the responses
+        while isinstance(self.broadcast("ReceiveRequestResourceUsage", request, [server_id]).get(server_id), grpc.RpcError):
+            time.sleep(REQUEST_RETRY_INTERVAL)
 
-    def request_resource_usage(self, want_to_use_key: int):
+    def request_resource_usage(self, want_to_use_key: int) -> int:
         """
         Sends a request to all other storage servers to use a resource.
-        When all servers have responded with an ok message, the server will enter the critical section.
+        When all servers have responded with an ok message, the server will enter the critical section for that key.
         Until then, the server will wait.
+        Servers that stay unreachable for longer than LOCK_LEASE are not waited for, since any lock they held has expired.
+        Servers that still have not answered are asked again every REQUEST_RESEND_INTERVAL seconds, in case they
+        restarted and forgot the request.
+        Returns the fencing token of the granted lock, which is valid for LOCK_LEASE seconds.
         """
-        logging.info(f"Server {self.id} requesting resource usage for key {want_to_use_key}")
-        self.lamport_clock.tick()
-        self.my_request_time = self.lamport_clock.get_clock()
+        requested_at = time.monotonic()
+        if self.mutex_engine is not None:
+            entry_time = self.mutex_engine.acquire(want_to_use_key)
+            logging.debug(f"Server {self.id} has entered critical section for key {want_to_use_key}")
+            return self._start_lease(want_to_use_key, entry_time, requested_at)
 
-        for storage_server_id, storage_address in self.other_storages_addresses.items():
-            if storage_server_id != self.id:
-                logging.info(f"Server {self.id} requesting resource usage for key {want_to_use_key} to server {storage_server_id}")
-                channel = self.connect_to_other_storage(storage_address)
-                stub = service_pb2_grpc.NodeCommunicationServiceStub(channel)
-                response = stub.ReceiveRequestResourceUsage(service_pb2.UsageRequest(
-                    lamport_timestamp=self.lamport_clock.get_clock(), 
-                    server_id=self.id, 
-                    key=want_to_use_key
-                ))
+        logging.debug(f"Server {self.id} requesting resource usage for key {want_to_use_key}")
+        pending_servers = [storage_server_id for storage_server_id in self.other_storages_addresses if storage_server_id != self.id]
+        pending_request = self.lock_table.begin_request(want_to_use_key, pending_servers)
+        pending_servers = self._sync_required_servers(pending_request)
+
+        request = service_pb2.UsageRequest(
+            lamport_timestamp=pending_request.request_time,
+            server_id=self.id,
+            key=want_to_use_key,
+            piggyback_ok=self.piggyback_oks
+        )
+        if self.lock_streams is not None:
+            frame = service_pb2.LockMessage(
+                type=service_pb2.REQUEST,
+                key=want_to_use_key,
+                lamport_timestamp=pending_request.request_time,
+                server_id=self.id
+            )
+            streamed_servers = [storage_server_id for storage_server_id in pending_servers if self.lock_streams.send(storage_server_id, frame)]
+            self._count_lock_messages(len(streamed_servers))
+            pending_servers = [storage_server_id for storage_server_id in pending_servers if storage_server_id not in streamed_servers]
+        while pending_servers:
+            responses = self.broadcast("ReceiveRequestResourceUsage", request, pending_servers)
+            pending_servers = [storage_server_id for storage_server_id, response in responses.items() if isinstance(response, grpc.RpcError)]
+            self.receive_piggybacked_oks(want_to_use_key, pending_request.request_time, responses)
+            pending_servers = [storage_server_id for storage_server_id in pending_servers if not self._reclaim_expired_lease(pending_request, storage_server_id)]
+            # servers that left the cluster are no longer waited for
+            pending_servers = [storage_server_id for storage_server_id in pending_servers if storage_server_id in pending_request.missing_servers()]
+            if pending_servers:
+                logging.error(f"Server {self.id} could not deliver request for key {want_to_use_key} to servers {pending_servers}. Retrying in {REQUEST_RETRY_INTERVAL} seconds...")
+                time.sleep(REQUEST_RETRY_INTERVAL)
 
-        self.wait_for_ok_messages()
-        self.is_in_critical_section = True
-        logging.info(f"Server {self.id} has entered critical section")
+        self.wait_for_ok_messages(pending_request, request)
+        self.lock_table.mark_held(want_to_use_key)
+        logging.debug(f"Server {self.id} has entered critical section for key {want_to_use_key}")
+        return self._start_lease(want_to_use_key, pending_request.request_time, requested_at)
 
+    def _start_lease(self, key: int, lock_time: int, requested_at: float) -> int:
+        token = fencing_token(lock_time, self.id)
+        acquired_at = time.monotonic()
+        self.lock_wait_histogram.record(acquired_at - requested_at)
+        self.lock_leases[key] = (token, acquired_at, acquired_at + LOCK_LEASE)
+        return token
 
-    def wait_for_ok_messages(self):
+    def _expire_leases_loop(self):
         """
-        Waits for all other storage servers to respond with an ok message.
+        Expires the Ricart-Agrawala leases of this server that ran out before their release.
         """
-        logging.info(f"Server {self.id} waiting for ok messages")
-        while len(self.received_ok) < 4:
-            time.sleep(1)
+        while not self.closed.wait(REQUEST_RETRY_INTERVAL):
+            now = time.monotonic()
+            for key, (token, _, deadline) in list(self.lock_leases.items()):
+                if now > deadline:
+                    self._expire_lease(key, token)
 
-    def process_request_queue(self):
+    def release_resource_usage(self, key: int):
         """
-        Sends and Ok message for each request in the request queue.
+        Leaves the critical section for key and sends an ok message for each request deferred on it.
         """
-        logging.info(f"Server {self.id} Processing request queue of length {len(self.request_queue)}")
-        while self.request_queue:
-            request, context = self.request_queue.pop(0)
-            self.send_ok_message(request.server_id)
-            logging.info(f"Server {self.id} sending ok message to server {request.server_id} that was in the queue")
+        lease = self.lock_leases.pop(key, None)
+        if lease is not None:
+            self.lock_hold_histogram.record(time.monotonic() - lease[1])
+        if self.mutex_engine is not None:
+            self.mutex_engine.release(key)
+            logging.debug(f"Server {self.id} left critical section for key {key}")
+            return
+
+        deferred_requests = self.lock_table.release(key)
+        logging.debug(f"Server {self.id} left critical section for key {key}, answering {len(deferred_requests)} queued requests")
+        for request in deferred_requests:
+            self.send_ok_message(request.server_id, request.key, request.lamport_timestamp)
+            logging.debug(f"Server {self.id} sending ok message to server {request.server_id} that was in the queue")
+
+    def broadcast(self, rpc_name: str, message: Any, server_ids: List[int]) -> Dict[int, Any]:
+        """
+        Calls the same RPC on several storage servers concurrently, each call with its own deadline.
+        Returns the response of each server, or the grpc.RpcError raised by its call.
+        Servers that left the cluster are skipped and missing from the responses.
+        The total time is about one round trip to the slowest server, not the sum of all round trips.
+        """
+        calls = {}
+        for storage_server_id in server_ids:
+            try:
+                stub = self.channel_pool.get_stub(storage_server_id)
+            except KeyError:
+                logging.warning(f"Server {self.id} not sending {rpc_name} to server {storage_server_id}, which left the cluster")
+                continue
+            logging.debug(f"Server {self.id} sending {rpc_name} to server {storage_server_id}")
+            self._count_lock_messages()
+            rpc = getattr(stub, rpc_name)
+            calls[storage_server_id] = rpc.future(message, timeout=PEER_RESPONSE_TIMEOUT, wait_for_ready=True)
+
+        responses: Dict[int, Any] = {}
+        for storage_server_id, call in calls.items():
+            try:
+                responses[storage_server_id] = call.result()
+            except grpc.RpcError as e:
+                logging.error(f"Server {self.id} got no response to {rpc_name} from server {storage_server_id}. Error: {e.code()}")
+                responses[storage_server_id] = e
+        return responses
+
+    def wait_for_ok_messages(self, pending_request: PendingRequest, request: service_pb2.UsageRequest):
+        """
+        Waits for all other storage servers to respond with an ok message.
+        The waiting thread is woken up by ReceiveOkMessage as soon as the last ok arrives.
+        Servers that crashed while holding or wanting the key are given up on once their lease has expired,
+        and the request is sent again to the servers that are still missing every REQUEST_RESEND_INTERVAL seconds.
+        """
+        logging.debug(f"Server {self.id} waiting for {len(pending_request.required_servers)} ok messages for key {pending_request.key}")
+        resend_at = time.monotonic() + REQUEST_RESEND_INTERVAL
+        while not pending_request.wait(timeout=REQUEST_RETRY_INTERVAL):
+            for storage_server_id in pending_request.missing_servers():
+                self._reclaim_expired_lease(pending_request, storage_server_id)
+            if time.monotonic() >= resend_at:
+                missing_servers = sorted(pending_request.missing_servers())
+                logging.warning(f"Server {self.id} still waiting for ok messages for key {pending_request.key} from servers {missing_servers}, requesting again")
+                responses = self.broadcast("ReceiveRequestResourceUsage", request, missing_servers)
+                self.receive_piggybacked_oks(pending_request.key, pending_request.request_time, responses)
+                resend_at = time.monotonic() + REQUEST_RESEND_INTERVAL
 
     def set_value(self, key, value):
         """
         Critical section where the server sets a value in a key.
+        The write carries the fencing token of the lock, and fails if the lease expired or a newer holder already wrote.
+        When the key space is sharded, the value is written to the replica group of the key instead of this server,
+        and must be an int64.
         """
-        self.want_to_enter_critical_section = True
-        self.key_want_to_use = key
-        self.request_resource_usage(key)
-        self.key_in_use = key
-        data = load("data.pkl")
-        data[key] = value
-        time.sleep(7)
-        logging.info(f"data: {data}")
-        dump(data, "data.pkl")
-        self.key_in_use = 0
-        self.key_want_to_use = 0
-        self.is_in_critical_section = False
-        self.want_to_enter_critical_section = False
-        self.process_request_queue()
-
-    def get_value(self, key):
-        data = load("data.pkl")
-        if key not in data:
-            raise KeyError(f"Key {key} not found")
-        return data.get(key)
-    
\ No newline at end of file
+        if self.hash_ring is not None:
+            self._check_replicated_values({ key: value })
+        version = self.request_resource_usage(key)
+        try:
+            if self.critical_section_delay:
+                time.sleep(self.critical_section_delay)
+            self.check_lease(key)
+            if self.hash_ring is not None:
+                self.replicate_writes({ key: value }, { key: version })
+            else:
+                started_at = time.monotonic()
+                self.store.put(key, value, fencing_token=version)
+                self.storage_write_histogram.record(time.monotonic() - started_at)
+                self.read_cache.put(key, value)
+            logging.debug(f"Server {self.id} set key {key} to {value}")
+        finally:
+            self.release_resource_usage(key)
+        if self.hash_ring is None:
+            self.announce_key_version(key, version)
+
+    def set_values(self, values: Dict[int, Any]):
+        """
+        Critical section where the server sets several keys at once.
+        The key locks are taken one by one in increasing key order, so servers writing overlapping batches
+        can never wait on each other in a cycle. Every value is then written with a single storage commit
+        and all the locks are released together.
+        """
+        if self.hash_ring is not None:
+            self._check_replicated_values(values)
+        versions: Dict[int, int] = {}
+        try:
+            for key in sorted(values):
+                versions[key] = self.request_resource_usage(key)
+            if self.critical_section_delay:
+                time.sleep(self.critical_section_delay)
+            for key in versions:
+                self.check_lease(key)
+            if self.hash_ring is not None:
+                self.replicate_writes(values, versions)
+            else:
+                self._apply_writes(values, versions)
+            logging.debug(f"Server {self.id} set keys {sorted(values)}")
+        finally:
+            for key in reversed(list(versions)):
+                self.release_resource_usage(key)
+        if self.hash_ring is None:
+            for key, version in versions.items():
+                self.announce_key_version(key, version)
+
+    def get_value(self, key, linearizable: bool = False):
+        """
+        Reads the value of a key.
+        By default the value is served from the read cache, falling back to disk on a miss.
+        With linearizable=True, the read goes through the mutual exclusion protocol and skips the cache.
+        When the key space is sharded, keys are always read from their whole replica group and never cached,
+        even on a server of the group, since its own replica may have missed a write.
+        """
+        if linearizable:
+            self.request_resource_usage(key)
+            try:
+                return self._read_from_store(key) if self.hash_ring is None else self._read_from_shard(key)
+            finally:
+                self.release_resource_usage(key)
+
+        if self.hash_ring is not None:
+            return self._read_from_shard(key)
+        is_cached, cached = self.read_cache.get(key)
+        if is_cached:
+            return cached
+        value = self._read_from_store(key)
+        self.read_cache.fill(key, value, generation=cached)
+        return value
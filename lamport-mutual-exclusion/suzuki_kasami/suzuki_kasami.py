@@ -0,0 +1,241 @@
+import logging
+from threading import Condition, Lock
+from typing import Callable, Dict, List, Tuple
+
+import protobuf.service_pb2 as service_pb2
+
+from kv_store.kv_store import KeyValueStore
+from lamport_clock.lamport_clock import LamportClock
+
+
+Outgoing = List[Tuple[int, service_pb2.LockMessage]]
+
+
+class KeyToken:
+    """
+    The token of one key: the sequence number of the last granted request of each server,
+    the servers waiting for it, and a generation that grows each time it moves.
+    """
+    def __init__(self, generation: int = 0, last_granted: Dict[int, int] = None, queue: List[int] = None):
+        self.generation = generation
+        self.last_granted: Dict[int, int] = dict(last_granted or {})
+        self.queue: List[int] = list(queue or [])
+
+
+class KeyTokenState:
+    """
+    What a server knows about one key: the highest request number seen from each server, and the token if it holds it.
+    """
+    def __init__(self, token: KeyToken = None):
+        self.requested_numbers: Dict[int, int] = {}
+        self.token = token
+        self.last_generation = -1 if token is None else token.generation
+        self.requesting = False
+        self.in_critical_section = False
+
+    def is_busy(self) -> bool:
+        return self.requesting or self.in_critical_section
+
+
+class SuzukiKasamiEngine:
+    """
+    Suzuki-Kasami token based mutual exclusion, with one token per key.
+    The server holding the token of a key enters its critical section without sending any message, so a server
+    that writes the same key again and again only pays for the first write. Other servers broadcast a request
+    and the token moves to them when the holder leaves the critical section.
+    The token of every key starts at token_home, by default the server with the lowest id, and stays there when
+    servers join or leave later.
+    With a token_store, each server durably records for every key it has seen a token of the generation it last
+    saw, its own request number and the token if it holds it, so a restarted server gets back the tokens it held
+    and token_home never creates a second token for a key it already created one for. A token is lost when its
+    holder departs, or crashes after recording that it passed the token but before the token was delivered.
+    """
+    def __init__(
+        self,
+        server_id: int,
+        server_ids: List[int],
+        lamport_clock: LamportClock,
+        send: Callable[[int, service_pb2.LockMessage], None],
+        token_home: int = None,
+        token_store: KeyValueStore = None,
+    ):
+        self.id = server_id
+        self.server_ids = sorted(server_ids)
+        self.token_home = self.server_ids[0] if token_home is None else token_home
+        self.lamport_clock = lamport_clock
+        self.send = send
+        self.lock = Lock()
+        self.cv = Condition(self.lock)
+        self.keys: Dict[int, KeyTokenState] = {}
+        self.token_store = token_store
+        if token_store is not None:
+            self._load_tokens()
+
+    def _load_tokens(self):
+        """
+        Restores the tokens this server held and the generations and request numbers it had seen before a restart.
+        """
+        for key, (generation, sequence_number, token) in self.token_store.items().items():
+            state = KeyTokenState(None if token is None else KeyToken(generation, *token))
+            state.last_generation = generation
+            state.requested_numbers[self.id] = sequence_number
+            self.keys[key] = state
+        if self.keys:
+            held = sum(1 for state in self.keys.values() if state.token is not None)
+            logging.info(f"Server {self.id} restored {len(self.keys)} keys, holding the token of {held} of them")
+
+    def _save_token(self, key: int, state: KeyTokenState, sync: bool = True):
+        """
+        Records what this server knows about the token of key, before it acts on it.
+        """
+        if self.token_store is None:
+            return
+        token = None if state.token is None else (state.token.last_granted, state.token.queue)
+        self.token_store.put(key, (state.last_generation, state.requested_numbers.get(self.id, 0), token), sync=sync)
+
+    def _state(self, key: int) -> KeyTokenState:
+        state = self.keys.get(key)
+        if state is None:
+            # keys restored from the token store are never in here, so a token is created once per key
+            state = KeyTokenState(KeyToken() if self.id == self.token_home else None)
+            self.keys[key] = state
+            if state.token is not None:
+                self._save_token(key, state)
+        return state
+
+    def _message(self, message_type: int, key: int, request_timestamp: int) -> service_pb2.LockMessage:
+        return service_pb2.LockMessage(
+            type=message_type,
+            key=key,
+            lamport_timestamp=self.lamport_clock.get_clock(),
+            server_id=self.id,
+            request_timestamp=request_timestamp,
+        )
+
+    def _token_message(self, key: int, token: KeyToken) -> service_pb2.LockMessage:
+        message = self._message(service_pb2.TOKEN, key, token.generation)
+        message.last_granted.update(token.last_granted)
+        message.queue.extend(token.queue)
+        return message
+
+    def _pass_token(self, key: int, state: KeyTokenState, server_id: int, outgoing: Outgoing):
+        token = state.token
+        state.token = None
+        token.generation += 1
+        state.last_generation = token.generation
+        self._save_token(key, state)
+        self.lamport_clock.tick()
+        logging.debug(f"Server {self.id} passing token of key {key} to server {server_id}")
+        outgoing.append((server_id, self._token_message(key, token)))
+
+    def _dispatch(self, outgoing: Outgoing):
+        for server_id, message in outgoing:
+            self.send(server_id, message)
+
+    def set_members(self, server_ids: List[int]):
+        """
+        Sends the next requests to the servers in server_ids, after servers joined or left the cluster.
+        Servers that left are dropped from the queues of the tokens this server holds.
+        """
+        with self.lock:
+            self.server_ids = sorted(server_ids)
+            for state in self.keys.values():
+                if state.token is not None:
+                    state.token.queue = [server_id for server_id in state.token.queue if server_id in server_ids]
+
+    def queue_depth(self) -> int:
+        """
+        Returns how many requests are waiting for the tokens this server holds.
+        """
+        with self.lock:
+            return sum(
+                1
+                for state in self.keys.values() if state.token is not None
+                for server_id in self.server_ids if server_id != self.id and self._is_waiting(state, state.token, server_id)
+            )
+
+    def holds_token(self, key: int) -> bool:
+        with self.lock:
+            return self._state(key).token is not None
+
+    def acquire(self, key: int) -> int:
+        """
+        Enters the critical section for key, asking every other server for the token unless this server already holds it.
+        Returns the Lamport timestamp at which the critical section was entered.
+        """
+        outgoing: Outgoing = []
+        with self.lock:
+            self.cv.wait_for(lambda: not self._state(key).is_busy())
+            state = self._state(key)
+            self.lamport_clock.tick()
+            if state.token is None:
+                state.requesting = True
+                sequence_number = state.requested_numbers.get(self.id, 0) + 1
+                state.requested_numbers[self.id] = sequence_number
+                self._save_token(key, state)
+                logging.debug(f"Server {self.id} requesting token of key {key} with sequence number {sequence_number}")
+                outgoing = [
+                    (other_id, self._message(service_pb2.REQUEST, key, sequence_number))
+                    for other_id in self.server_ids
+                    if other_id != self.id
+                ]
+        self._dispatch(outgoing)
+        with self.lock:
+            self.cv.wait_for(lambda: state.token is not None)
+            state.requesting = False
+            state.in_critical_section = True
+            return self.lamport_clock.get_clock()
+
+    def release(self, key: int):
+        """
+        Leaves the critical section for key and hands the token to the next server waiting for it, if any.
+        """
+        outgoing: Outgoing = []
+        with self.lock:
+            state = self._state(key)
+            state.in_critical_section = False
+            token = state.token
+            token.last_granted[self.id] = state.requested_numbers.get(self.id, 0)
+            for other_id in self.server_ids:
+                if other_id not in token.queue and self._is_waiting(state, token, other_id):
+                    token.queue.append(other_id)
+            if token.queue:
+                self._pass_token(key, state, token.queue.pop(0), outgoing)
+            else:
+                # the token stays here, a lost update only makes a granted server look like it is waiting again
+                self._save_token(key, state, sync=False)
+            self.cv.notify_all()
+        self._dispatch(outgoing)
+
+    def _is_waiting(self, state: KeyTokenState, token: KeyToken, server_id: int) -> bool:
+        # a server has at most one request out, so this is the usual last_granted + 1 check, but it also holds
+        # when the last_granted of a restored token lags behind
+        return state.requested_numbers.get(server_id, 0) > token.last_granted.get(server_id, 0)
+
+    def receive(self, message: service_pb2.LockMessage):
+        """
+        Handles a token request or the token itself, sent by another server.
+        """
+        outgoing: Outgoing = []
+        with self.lock:
+            self.lamport_clock.update_clock(message.lamport_timestamp)
+            state = self._state(message.key)
+            if message.type == service_pb2.REQUEST:
+                requested_number = max(state.requested_numbers.get(message.server_id, 0), message.request_timestamp)
+                state.requested_numbers[message.server_id] = requested_number
+                token = state.token
+                if token is not None and not state.is_busy() and self._is_waiting(state, token, message.server_id):
+                    self._pass_token(message.key, state, message.server_id, outgoing)
+            elif message.type == service_pb2.TOKEN:
+                # a retried delivery can bring back a token that has already moved on
+                if message.request_timestamp <= state.last_generation:
+                    logging.warning(f"Server {self.id} ignoring stale token of key {message.key} from server {message.server_id}")
+                    return
+                state.last_generation = message.request_timestamp
+                state.token = KeyToken(message.request_timestamp, message.last_granted, message.queue)
+                self._save_token(message.key, state)
+                logging.debug(f"Server {self.id} received token of key {message.key} from server {message.server_id}")
+                self.cv.notify_all()
+            else:
+                logging.warning(f"Server {self.id} ignoring lock message of type {message.type} from server {message.server_id}")
+        self._dispatch(outgoing)